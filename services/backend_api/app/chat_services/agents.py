@@ -1,23 +1,140 @@
-from app.config import GROQ_MODEL, Config
-from app.models.chat_models import QueryOutput
+import asyncio
+import json
+import time
+
+from app.chat_services.chart_renderer import ChartRenderer, chart_block, chart_caption
+from app.chat_services.conversation import HistoryMetrics, trim_history
+from app.chat_services.inflight import InFlight
+from app.chat_services.llm_pool import LLMRegistry, llm_registry
+from app.chat_services.llm_scheduler import BudgetExhausted, LLMScheduler, llm_scheduler
+from app.chat_services.metrics import metrics
+from app.chat_services.pre_router import (
+    CHIT_CHAT,
+    DATA,
+    OUT_OF_POLICY,
+    PreRouter,
+)
+from app.chat_services.query_cache import QueryCache
+from app.chat_services.query_executor import QueryExecutor
+from app.chat_services.result_cache import ResultCache, canonical_sql
+from app.chat_services.result_profile import needs_profile, profile_result
+from app.chat_services.rollup_rewriter import RollupRewriter
+from app.chat_services.schema_cache import SchemaCache
+from app.chat_services.schema_retriever import SchemaRetriever
+from app.chat_services.sql_guard import SQLGuard
+from app.chat_services.sql_race import SQLRace
+from app.chat_services.sql_validator import SQLValidator
+from app.chat_services.text_retriever import TextRetriever
+from app.config import SQL_CANDIDATE_MODELS, Config
+from app.models.chat_models import ChartSpec, QueryOutput
+from app.models.query_result import QueryResult
 from app.models.state import State
-from langchain_community.tools.sql_database.tool import QuerySQLDatabaseTool
-from langchain_community.utilities.sql_database import SQLDatabase
-from langchain_core.messages import AIMessage
+from langchain_core.messages import AIMessage, HumanMessage
+from langchain_core.messages.utils import count_tokens_approximately
 from langchain_core.prompts import ChatPromptTemplate
-from langchain_groq import ChatGroq
 from sqlalchemy import create_engine
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.ext.asyncio import create_async_engine
 
 config = Config()
 
 
 class Agent:
-    def __init__(self):
-        db_uri = config.DATABASE_URI()
-        engine = create_engine(db_uri)
-        self.db = SQLDatabase(engine)
+    """Graph nodes. Each node has a sync version and an async `a...` twin.
+
+    The sync nodes serve `graph.invoke`, the async ones serve `graph.ainvoke`
+    so that LLM and database I/O do not block the event loop.
+    """
+
+    def __init__(
+        self,
+        engine=None,
+        async_engine=None,
+        llms: LLMRegistry | None = None,
+        scheduler: LLMScheduler | None = None,
+        chart_renderer: ChartRenderer | None = None,
+    ):
+        if engine is None:
+            engine = create_engine(config.DATABASE_URI())
+            async_engine = async_engine or create_async_engine(
+                config.ASYNC_DATABASE_URI()
+            )
+        self.engine = engine
+        # without an async engine the async nodes run queries in a worker thread
+        self.async_engine = async_engine
+        self.schema_cache = SchemaCache(engine)
+        self.schema_retriever = SchemaRetriever(self.schema_cache)
+        self.pre_router = PreRouter(self.schema_retriever)
+        self.history_metrics = HistoryMetrics()
+        self.executor = QueryExecutor(engine, async_engine)
+        self.validator = SQLValidator(self.schema_cache)
+        self.guard = SQLGuard(engine, async_engine)
+        self.rollup_rewriter = (
+            RollupRewriter(self.schema_cache) if Config.ROLLUP_REWRITE_ENABLED else None
+        )
+        self.text_retriever = (
+            TextRetriever(self.schema_cache, self.executor)
+            if Config.TEXT_SEARCH_ENABLED
+            else None
+        )
+        self.llms = llms or llm_registry
+        # every LLM call waits for token budget, falling back to other models
+        self.scheduler = scheduler or llm_scheduler
+        self.query_cache = QueryCache() if Config.QUERY_CACHE_ENABLED else None
+        self.result_cache = (
+            ResultCache.from_config() if Config.RESULT_CACHE_ENABLED else None
+        )
+        # concurrent turns that wrote the same SQL share one execution
+        self.inflight_sql = InFlight()
+        self.sql_race = (
+            SQLRace(SQL_CANDIDATE_MODELS[: Config.SQL_CANDIDATES])
+            if Config.SQL_CANDIDATES > 1
+            else None
+        )
+        self.chart_renderer = chart_renderer or ChartRenderer()
+
+    @property
+    def db(self):
+        return self.schema_cache.db
+
+    def _history(self, state: State, node: str) -> list:
+        """Conversation history for a node's prompt, trimmed to the node's token budget."""
+        messages = list(state.messages)
+        budget = Config.HISTORY_TOKEN_BUDGETS.get(node)
+        if budget is None:
+            return messages
+        trimmed = trim_history(messages, budget)
+        self.history_metrics.record(
+            node,
+            count_tokens_approximately(messages),
+            count_tokens_approximately(trimmed),
+        )
+        return trimmed
+
+    def _busy_answer(self, state: State) -> dict:
+        """Answer without the LLM when every model is out of token budget."""
+        content = "The assistant is busy right now, please try again in a minute."
+        if state.sql_result:
+            content += f"\nHere is the data for your question:\n{state.sql_result}"
+        return {"messages": [AIMessage(content=content)]}
+
+    def _table_info(self, state: State) -> str:
+        """Schema context for the prompt, pruned to the tables the turn needs."""
+        if not Config.SCHEMA_PRUNING_ENABLED:
+            return self.schema_cache.get_table_info()
+        # a follow-up such as "and for Tokyo?" needs the tables of the question
+        # before it, the previous SQL and its error name the tables a retry needs
+        questions = [m.content for m in state.messages if isinstance(m, HumanMessage)]
+        text = " ".join(
+            [
+                *questions[-Config.SCHEMA_PRUNING_QUESTIONS :],
+                state.sql_query,
+                state.sql_query_error,
+            ]
+        )
+        return self.schema_retriever.table_info(text)
 
-    def chat_agent(self, state: State):
+    def _chat_agent_prompt(self, state: State):
         user_message = state.messages[-1].content  # langgraph approach
         system_message = """
         /no_think
@@ -35,23 +152,88 @@ class Agent:
 
         formatted_prompt = general_agent_prompt_template.invoke(
             {
-                "table_info": self.db.get_table_info(),
+                "table_info": self._table_info(state),
                 "user_message": user_message,
             }
         )
 
-        # prompt = state.history + formatted_prompt.messages # fastapi approach
-        prompt = list(state.messages) + formatted_prompt.messages
+        return self._history(state, "chat_agent") + formatted_prompt.messages
+
+    def chat_agent(self, state: State):
+        try:
+            response = self.scheduler.invoke(
+                self.llms.chat_model, self._chat_agent_prompt(state)
+            )
+        except BudgetExhausted:
+            return self._busy_answer(state)
+
+        return {
+            "messages": [AIMessage(content=response.content)],
+        }
 
-        llm = ChatGroq(model=GROQ_MODEL, groq_api_key=Config.groq_api_key)
-        response = llm.invoke(prompt)
+    async def achat_agent(self, state: State):
+        try:
+            response = await self.scheduler.ainvoke(
+                self.llms.chat_model, self._chat_agent_prompt(state)
+            )
+        except BudgetExhausted:
+            return self._busy_answer(state)
 
         return {
-            # "agent_answer": response.content, # fastapi approach
             "messages": [AIMessage(content=response.content)],
         }
 
-    def write_query(self, state: State):
+    def pre_route(self, state: State):
+        """Send obvious chit-chat and off-topic turns straight past write_query.
+
+        Starts every turn with the previous turn's query, result and flags
+        cleared, a checkpointed thread would otherwise route, search or plot on
+        its previous turn's state.
+        """
+        turn = {
+            "chit_chat": False,
+            "out_of_policy": False,
+            "llm_busy": False,
+            "need_visualise": False,
+            "chart": "",
+            "sql_query": "",
+            "rollup_query": "",
+            "review_search": "",
+            "sql_query_error": "",
+            "sql_error_count": 0,
+            "sql_result": "",
+            "query_result": None,
+        }
+        if not Config.PRE_ROUTER_ENABLED:
+            return {**turn, "pre_route": ""}
+        label, confident = self.pre_router.route(
+            state.messages[-1].content, follow_up=len(state.messages) > 1
+        )
+        if not confident:
+            return {**turn, "pre_route": label}
+        return {
+            **turn,
+            "pre_route": "",
+            "chit_chat": label == CHIT_CHAT,
+            "out_of_policy": label == OUT_OF_POLICY,
+        }
+
+    async def apre_route(self, state: State):
+        return self.pre_route(state)
+
+    def _record_pre_route(self, state: State, result: QueryOutput):
+        # only the first pass, a retry is no longer the pre-router's decision
+        if not state.pre_route or state.sql_query_error:
+            return
+        if result.chit_chat:
+            llm_label = CHIT_CHAT
+        elif result.out_of_policy:
+            llm_label = OUT_OF_POLICY
+        else:
+            llm_label = DATA
+        self.pre_router.record(state.pre_route, llm_label)
+
+    def _write_query_prompt(self, state: State):
         user_message = state.messages[-1].content  # langgraph approach
         system_message = """
             You are a SQL router agent. You are given a user message and you will need to determine what is the most intention of the user.
@@ -62,6 +244,7 @@ class Agent:
             3. Never query for all the columns from a specific table, only ask for a few relevant columns given the question.
             4. Pay attention to use only the column names that you can see in the schema description.
             5. Be careful to not query for columns that do not exist. Also, pay attention to which column is in which table.
+            6. If the question is about what customers say in their reviews (opinions, complaints, praise), put a few search keywords in review_search. The review texts are searched for them directly, still write a query in case the search finds nothing.
 
             Only use the following tables:
             {table_info}
@@ -77,115 +260,476 @@ class Agent:
         query_prompt_template = ChatPromptTemplate(
             [("system", system_message), ("user", user_prompt)]
         )
-        try:
-            formatted_prompt = query_prompt_template.invoke(
-                {
-                    "dialect": self.db.dialect,
-                    "table_info": self.db.get_table_info(),
-                    "input": user_message,
-                    "query_error": state.sql_query_error or "None",
-                }
-            )
+        formatted_prompt = query_prompt_template.invoke(
+            {
+                "dialect": self.db.dialect,
+                "table_info": self._table_info(state),
+                "input": user_message,
+                "query_error": state.sql_query_error or "None",
+            }
+        )
 
-            prompt = (
-                list(state.messages) + formatted_prompt.messages
-            )  # langgraph approach
-            # prompt = state.history + formatted_prompt.messages # fastapi approach
-
-            llm = ChatGroq(model=GROQ_MODEL, groq_api_key=Config.groq_api_key)
-            structured_llm = llm.with_structured_output(QueryOutput)
-            result = structured_llm.invoke(prompt)
-
-            # If it's chit-chat or out of policy, return early with appropriate flags
-            # (chit-chat and out_of_policy don't need SQL queries)
-            if result.chit_chat or result.out_of_policy:
-                return {
-                    "sql_query": "",
-                    "sql_query_execution_status": "success",
-                    "sql_query_error": "",
-                    "sql_error_count": 0,
-                    "chit_chat": result.chit_chat,
-                    "out_of_policy": result.out_of_policy,
-                    "need_visualise": False,
-                }
-
-            # Validate that we got a SQL query for non-chit-chat queries
-            if (
-                not result.generated_sql_query
-                or result.generated_sql_query.strip() == ""
-            ):
-                return {
-                    "sql_query": "",
-                    "sql_query_execution_status": "failure",
-                    "sql_query_error": "Error: Generated SQL query is empty",
-                    "sql_error_count": state.sql_error_count + 1,
-                }
+        return (
+            self._history(state, "write_query") + formatted_prompt.messages
+        )  # langgraph approach
 
-        except Exception as e:
-            error_msg = str(e)
-            if hasattr(e, "response") and hasattr(e.response, "body"):
-                # Try to extract more detailed error message
-                try:
-                    import json
-
-                    error_body = json.loads(e.response.body)
-                    if "error" in error_body and "failed_generation" in error_body.get(
-                        "error", {}
-                    ):
-                        error_msg = error_body["error"]["failed_generation"]
-                except:
-                    pass
+    def _write_query_result(self, state: State, result: QueryOutput):
+        # If it's chit-chat or out of policy, return early with appropriate flags
+        # (chit-chat and out_of_policy don't need SQL queries)
+        if result.chit_chat or result.out_of_policy:
+            return {
+                "sql_query": "",
+                "sql_query_execution_status": "success",
+                "sql_query_error": "",
+                "sql_error_count": 0,
+                "chit_chat": result.chit_chat,
+                "out_of_policy": result.out_of_policy,
+                "need_visualise": False,
+                "review_search": "",
+                "llm_busy": False,
+            }
 
+        review_search = result.review_search.strip() if self.text_retriever else ""
+        # Validate that we got a SQL query for non-chit-chat queries
+        if not review_search and not result.generated_sql_query.strip():
             return {
                 "sql_query": "",
+                "review_search": "",
                 "sql_query_execution_status": "failure",
-                "sql_query_error": f"Error generating query: {error_msg}",
+                "sql_query_error": "Error: Generated SQL query is empty",
                 "sql_error_count": state.sql_error_count + 1,
+                "llm_busy": False,
             }
 
         return {
             "sql_query": result.generated_sql_query,
+            "review_search": review_search,
             "need_visualise": result.need_visualise,
             "out_of_policy": result.out_of_policy,
             "chit_chat": result.chit_chat,
             "sql_query_execution_status": "success",
             "sql_query_error": "",
             "sql_error_count": 0,
+            "llm_busy": False,
         }
 
-    def execute_query(self, state: State):
-        """Execute SQL query and set query_execution_status."""
-        # Check if SQL query is empty
-        if not state.sql_query or state.sql_query.strip() == "":
-            return {
-                "sql_result": "",
-                "sql_query_execution_status": "failure",
-                "sql_query_error": "Error: Cannot execute an empty SQL query",
-                "sql_error_count": state.sql_error_count + 1,
-            }
+    def _write_query_error(self, state: State, e: Exception):
+        error_msg = str(e)
+        if hasattr(e, "response") and hasattr(e.response, "body"):
+            # Try to extract more detailed error message
+            try:
+                error_body = json.loads(e.response.body)
+                if "error" in error_body and "failed_generation" in error_body.get(
+                    "error", {}
+                ):
+                    error_msg = error_body["error"]["failed_generation"]
+            except:
+                pass
 
-        execute_query_tool = QuerySQLDatabaseTool(db=self.db)
-        result = execute_query_tool.invoke(state.sql_query)
+        return {
+            "sql_query": "",
+            "review_search": "",
+            "sql_query_execution_status": "failure",
+            "sql_query_error": f"Error generating query: {error_msg}",
+            "sql_error_count": state.sql_error_count + 1,
+        }
 
-        if isinstance(result, str) and result.startswith("Error:"):
-            return {
-                "sql_result": "",
-                "sql_query_execution_status": "failure",
-                "sql_query_error": result,
-                "sql_error_count": state.sql_error_count + 1,
-            }
-        else:
+    def _write_query_busy(self, state: State, e: BudgetExhausted):
+        # no retry can succeed within this turn, go straight to cannot_answer
+        return {**self._write_query_error(state, e), "llm_busy": True}
+
+    def _query_llm(self, model: str):
+        return self.llms.structured(QueryOutput, model)
+
+    def _cacheable(self, state: State) -> bool:
+        # the cache is keyed by the message alone, a follow-up such as "and for
+        # Tokyo?" means something else in every conversation
+        return self.query_cache is not None and len(state.messages) == 1
+
+    def _cached_query(self, state: State) -> QueryOutput | None:
+        # a retry carries an error for the LLM to fix, never answer it from cache
+        if not self._cacheable(state) or state.sql_query_error:
+            return None
+        return self.query_cache.get(
+            state.messages[-1].content, self.schema_cache.fingerprint
+        )
+
+    def _cache_query(self, state: State, result: QueryOutput):
+        if not self._cacheable(state):
+            return
+        if (
+            result.chit_chat
+            or result.out_of_policy
+            or result.generated_sql_query.strip()
+            or result.review_search.strip()
+        ):
+            self.query_cache.put(
+                state.messages[-1].content, self.schema_cache.fingerprint, result
+            )
+
+    def write_query(self, state: State):
+        result = self._cached_query(state)
+        if result is not None:
+            return self._write_query_result(state, result)
+
+        try:
+            prompt = self._write_query_prompt(state)
+            result = self.scheduler.invoke(self._query_llm, prompt)
+        except BudgetExhausted as e:
+            return self._write_query_busy(state, e)
+        except Exception as e:
+            return self._write_query_error(state, e)
+
+        self._cache_query(state, result)
+        self._record_pre_route(state, result)
+        return self._write_query_result(state, result)
+
+    async def awrite_query(self, state: State):
+        result = self._cached_query(state)
+        if result is not None:
+            return self._write_query_result(state, result)
+
+        try:
+            prompt = self._write_query_prompt(state)
+            result = await self.scheduler.ainvoke(self._query_llm, prompt)
+        except BudgetExhausted as e:
+            return self._write_query_busy(state, e)
+        except Exception as e:
+            return self._write_query_error(state, e)
+
+        self._cache_query(state, result)
+        self._record_pre_route(state, result)
+        return self._write_query_result(state, result)
+
+    def _candidate_llm(self, temperature: float | None):
+        return lambda model: self.llms.structured(QueryOutput, model, temperature)
+
+    def _ran_candidate(self, update: dict) -> bool:
+        # a routing decision or a failed write has nothing to run
+        return not (
+            update["sql_query_execution_status"] == "failure"
+            or update.get("chit_chat")
+            or update.get("out_of_policy")
+            or update.get("review_search")
+        )
+
+    def _run_candidate(
+        self, state: State, output: QueryOutput
+    ) -> tuple[dict, QueryOutput]:
+        update = self._write_query_result(state, output)
+        if not self._ran_candidate(update):
+            return update, output
+        candidate = state.model_copy(update=update)
+        update |= self.guard_query(candidate)
+        if update["sql_query_execution_status"] == "success":
+            update |= self.execute_query(candidate.model_copy(update=update))
+        return update, output
+
+    async def _arun_candidate(
+        self, state: State, output: QueryOutput
+    ) -> tuple[dict, QueryOutput]:
+        update = self._write_query_result(state, output)
+        if not self._ran_candidate(update):
+            return update, output
+        candidate = state.model_copy(update=update)
+        update |= await self.aguard_query(candidate)
+        if update["sql_query_execution_status"] == "success":
+            update |= await self.aexecute_query(candidate.model_copy(update=update))
+        return update, output
+
+    def _race_attempt(self, state: State, prompt, i: int):
+        model, temperature = self.sql_race.candidates[i]
+        try:
+            output = self.scheduler.invoke(
+                self._candidate_llm(temperature), prompt, models=[model]
+            )
+        except BudgetExhausted as e:
+            return self._write_query_busy(state, e), None
+        except Exception as e:
+            return self._write_query_error(state, e), None
+        return self._run_candidate(state, output)
+
+    async def _arace_attempt(self, state: State, prompt, i: int):
+        model, temperature = self.sql_race.candidates[i]
+        try:
+            output = await self.scheduler.ainvoke(
+                self._candidate_llm(temperature), prompt, models=[model]
+            )
+        except BudgetExhausted as e:
+            return self._write_query_busy(state, e), None
+        except Exception as e:
+            return self._write_query_error(state, e), None
+        return await self._arun_candidate(state, output)
+
+    def _race_result(self, state: State, update: dict, output: QueryOutput | None):
+        if output is not None:
+            if update["sql_query_execution_status"] == "success":
+                self._cache_query(state, output)
+            self._record_pre_route(state, output)
+        return update
+
+    def race_query(self, state: State):
+        """write_query, guard_query and execute_query for every SQL candidate at once.
+
+        The first candidate whose SQL runs wins, when all fail the first one's
+        error goes to write_query like a failed sequential attempt.
+        """
+        result = self._cached_query(state)
+        if result is not None:
+            return self._run_candidate(state, result)[0]
+        try:
+            prompt = self._write_query_prompt(state)
+        except Exception as e:
+            return self._write_query_error(state, e)
+        update, output = self.sql_race.run(
+            lambda i: self._race_attempt(state, prompt, i)
+        )
+        return self._race_result(state, update, output)
+
+    async def arace_query(self, state: State):
+        result = self._cached_query(state)
+        if result is not None:
+            return (await self._arun_candidate(state, result))[0]
+        try:
+            prompt = self._write_query_prompt(state)
+        except Exception as e:
+            return self._write_query_error(state, e)
+        update, output = await self.sql_race.arun(
+            lambda i: self._arace_attempt(state, prompt, i)
+        )
+        return self._race_result(state, update, output)
+
+    def _guard_query_result(
+        self, state: State, error: str | None, rollup_query: str = ""
+    ):
+        if error is None:
             return {
-                "sql_result": result,
                 "sql_query_execution_status": "success",
                 "sql_query_error": "",
-                "sql_error_count": 0,
+                "rollup_query": rollup_query,
             }
+        return self._execute_query_error(state, error)
+
+    def _skip_guard(self, state: State) -> bool:
+        # empty SQL is reported by execute_query, a cached result already passed
+        return not state.sql_query.strip() or (
+            self.result_cache is not None
+            and self.result_cache.contains(
+                state.sql_query, self.schema_cache.get_data_version()
+            )
+        )
+
+    def _validate_query(self, state: State) -> str | None:
+        # in process and cheap, so a bad table or column never costs a round trip
+        if not Config.VALIDATOR_ENABLED:
+            return None
+        return self.validator.validate(state.sql_query)
+
+    def _rollup_query(self, state: State) -> str:
+        # checked against the schema as written, the guard then costs what will run
+        if self.rollup_rewriter is None:
+            return ""
+        return self.rollup_rewriter.rewrite(state.sql_query) or ""
+
+    def guard_query(self, state: State):
+        """Reject invalid, unsafe or too expensive SQL before it reaches the database."""
+        if self._skip_guard(state):
+            return self._guard_query_result(state, None)
+        error = self._validate_query(state)
+        if error is not None:
+            return self._guard_query_result(state, error)
+        rollup_query = self._rollup_query(state)
+        if Config.GUARD_ENABLED:
+            error = self.guard.check(rollup_query or state.sql_query)
+        return self._guard_query_result(state, error, rollup_query)
+
+    async def aguard_query(self, state: State):
+        if self._skip_guard(state):
+            return self._guard_query_result(state, None)
+        error = self._validate_query(state)
+        if error is not None:
+            return self._guard_query_result(state, error)
+        rollup_query = self._rollup_query(state)
+        if Config.GUARD_ENABLED:
+            error = await self.guard.acheck(rollup_query or state.sql_query)
+        return self._guard_query_result(state, error, rollup_query)
+
+    def _execute_query_result(self, state: State, result: QueryResult):
+        return {
+            "sql_result": result.to_text(Config.RESULT_TEXT_ROWS),
+            "query_result": result,
+            "sql_query_execution_status": "success",
+            "sql_query_error": "",
+            "sql_error_count": 0,
+        }
+
+    def _execute_query_error(self, state: State, error: str):
+        if self.query_cache is not None:
+            # the cached SQL is broken, the retry has to ask the LLM again
+            self.query_cache.invalidate_sql(state.sql_query)
+        return {
+            "sql_result": "",
+            "query_result": None,
+            "sql_query_execution_status": "failure",
+            "sql_query_error": error,
+            "sql_error_count": state.sql_error_count + 1,
+        }
+
+    def _cached_result(self, state: State) -> QueryResult | None:
+        if self.result_cache is None:
+            return None
+        return self.result_cache.get(
+            state.sql_query, self.schema_cache.get_data_version()
+        )
+
+    async def _acached_result(self, state: State) -> QueryResult | None:
+        if self.result_cache is None:
+            return None
+        return await self.result_cache.aget(
+            state.sql_query, self.schema_cache.get_data_version()
+        )
+
+    def _cache_result(self, state: State, result: QueryResult):
+        if self.result_cache is not None:
+            self.result_cache.put(
+                state.sql_query, self.schema_cache.get_data_version(), result
+            )
+
+    async def _acache_result(self, state: State, result: QueryResult):
+        if self.result_cache is not None:
+            await self.result_cache.aput(
+                state.sql_query, self.schema_cache.get_data_version(), result
+            )
+
+    def _rollup_failed(self, state: State, e: SQLAlchemyError):
+        # a rollup swapped out under the query, the original still answers
+        self.rollup_rewriter.fallbacks += 1
+        print(f"⚠️ Rollup query failed, running the original: {e}")
+
+    def _run_rollup_query(self, state: State) -> QueryResult | None:
+        if not state.rollup_query:
+            return None
+        try:
+            return self.executor.run(state.rollup_query)
+        except SQLAlchemyError as e:
+            self._rollup_failed(state, e)
+            return None
+
+    async def _arun_rollup_query(self, state: State) -> QueryResult | None:
+        if not state.rollup_query:
+            return None
+        try:
+            if self.async_engine is None:
+                return await asyncio.to_thread(self.executor.run, state.rollup_query)
+            return await self.executor.arun(state.rollup_query)
+        except SQLAlchemyError as e:
+            self._rollup_failed(state, e)
+            return None
+
+    def execute_query(self, state: State):
+        """Execute SQL query and set query_execution_status."""
+        # Check if SQL query is empty
+        if not state.sql_query or state.sql_query.strip() == "":
+            return self._execute_query_error(
+                state, "Error: Cannot execute an empty SQL query"
+            )
+
+        result = self._cached_result(state)
+        if result is None:
+            start = time.perf_counter()
+            try:
+                result = self._run_rollup_query(state)
+                if result is None:
+                    result = self.executor.run(state.sql_query)
+            except SQLAlchemyError as e:
+                return self._execute_query_error(state, f"Error: {e}")
+            metrics.record_sql(time.perf_counter() - start, result.total_rows)
+            self._cache_result(state, result)
+
+        return self._execute_query_result(state, result)
+
+    async def _arun_query(self, state: State) -> QueryResult:
+        result = await self._arun_rollup_query(state)
+        if result is None and self.async_engine is None:
+            result = await asyncio.to_thread(self.executor.run, state.sql_query)
+        elif result is None:
+            result = await self.executor.arun(state.sql_query)
+        return result
+
+    async def aexecute_query(self, state: State):
+        """Async execute_query, runs on the async engine when there is one."""
+        if not state.sql_query or state.sql_query.strip() == "":
+            return self._execute_query_error(
+                state, "Error: Cannot execute an empty SQL query"
+            )
+
+        result = await self._acached_result(state)
+        if result is None:
+            start = time.perf_counter()
+            key = f"{self.schema_cache.get_data_version()}:{canonical_sql(state.sql_query)}"
+            try:
+                result, shared = await self.inflight_sql.run(
+                    key, lambda: self._arun_query(state)
+                )
+            except SQLAlchemyError as e:
+                return self._execute_query_error(state, f"Error: {e}")
+            if not shared:
+                metrics.record_sql(time.perf_counter() - start, result.total_rows)
+                await self._acache_result(state, result)
+
+        return self._execute_query_result(state, result)
+
+    def _retrieve_reviews_result(self, state: State, result: QueryResult | None):
+        if result is None:
+            # nothing indexed or matched, the SQL write_query wrote may still answer
+            return {"sql_query_execution_status": "failure", "review_search": ""}
+        return self._execute_query_result(state, result)
+
+    def _retrieval_failed(self, e: SQLAlchemyError):
+        print(f"⚠️ Review search failed, running the query instead: {e}")
+
+    def retrieve_reviews(self, state: State):
+        """Top-k review texts for review_search, with their franchise ids."""
+        try:
+            result = self.text_retriever.search(state.review_search)
+        except SQLAlchemyError as e:
+            self._retrieval_failed(e)
+            result = None
+        return self._retrieve_reviews_result(state, result)
+
+    async def aretrieve_reviews(self, state: State):
+        try:
+            result = await self.text_retriever.asearch(state.review_search)
+        except SQLAlchemyError as e:
+            self._retrieval_failed(e)
+            result = None
+        return self._retrieve_reviews_result(state, result)
+
+    def _result_data(self, state: State) -> str:
+        """A digest of a large result, else the tabular sql_result it replaces."""
+        if not needs_profile(state.query_result):
+            return state.sql_result
+        try:
+            return profile_result(state.query_result)
+        except Exception as e:
+            print(f"⚠️ Profiling the result failed, keeping the table: {e}")
+            return state.sql_result
+
+    def profile_result(self, state: State):
+        """Replace a large sql_result with a statistical digest before generate_answer."""
+        if not needs_profile(state.query_result):
+            return {}
+        return {"sql_result": self._result_data(state)}
+
+    async def aprofile_result(self, state: State):
+        # pandas work is CPU bound, keep it off the event loop
+        return await asyncio.to_thread(self.profile_result, state)
 
     def cannot_answer(self, state: State):
+        if state.llm_busy:
+            return {"sql_error_count": 0, **self._busy_answer(state)}
         return {
             "sql_error_count": 0,
-            # "agent_answer": "I'm sorry, but I cannot find the information you're looking for.", # fastapi approach
             "messages": [
                 AIMessage(
                     content="I'm sorry, but I cannot find the information you're looking for."
@@ -193,7 +737,10 @@ class Agent:
             ],
         }
 
-    def generate_answer(self, state: State):
+    async def acannot_answer(self, state: State):
+        return self.cannot_answer(state)
+
+    def _generate_answer_prompt(self, state: State):
         user_message = state.messages[-1].content  # langgraph approach
         system_prompt = """
             /no_think\n
@@ -217,35 +764,50 @@ class Agent:
             }
         )
         # Prepend history to the formatted messages
-        messages = (
-            list(state.messages) + formatted_prompt.messages
+        return (
+            self._history(state, "generate_answer") + formatted_prompt.messages
         )  # langgraph approach
-        # messages = state.history + formatted_prompt.messages # fastapi approach
 
-        llm = ChatGroq(model=GROQ_MODEL, groq_api_key=Config.groq_api_key)
-        response = llm.invoke(messages)
+    def generate_answer(self, state: State):
+        try:
+            response = self.scheduler.invoke(
+                self.llms.chat_model, self._generate_answer_prompt(state)
+            )
+        except BudgetExhausted:
+            return self._busy_answer(state)
 
         return {
-            # "agent_answer": response.content, # fastapi approach
             "messages": [AIMessage(content=response.content)],
         }
 
-    def plot_agent(self, state: State):
+    async def agenerate_answer(self, state: State):
+        try:
+            response = await self.scheduler.ainvoke(
+                self.llms.chat_model, self._generate_answer_prompt(state)
+            )
+        except BudgetExhausted:
+            return self._busy_answer(state)
+
+        return {
+            "messages": [AIMessage(content=response.content)],
+        }
+
+    def _chart_llm(self, model: str):
+        return self.llms.structured(ChartSpec, model)
+
+    def _plot_agent_prompt(self, state: State):
         user_message = state.messages[-1].content  # langgraph approach
+        result = state.query_result
         system_message = """
             /no_think
-            You are a data visualization expert and use your favourite graphing library Plotly only.
-            The full database schema is as follows: \n{table_info}\n
-            The data to be visualised is provided as \n{sql_result}.\n
+            You are a data visualization expert. The backend draws the chart with Plotly from the full query result, you only choose how.
+            The query result has these columns: {columns}
+            The data looks like this:\n{data}\n
 
             You will need to do the following tasks:
-            1. Follow the user's indications when creating the graph.
-            2. Analytically answer the question. (eg. point out potential insights, trends, annomalies, etc.)
-            3. Ensure you do NOT repeat any keyword arguments. 
-            4. Each parameter (like xaxis, yaxis, title, etc.) should only appear once in any function call.
-            5. Generate clean, syntactically correct Python code without duplicate arguments.
-            6. IMPORTANT: Always include ALL necessary imports at the top of your code (e.g., `import datetime`, `from datetime import datetime`, `import pandas as pd`, etc.). Never assume any module is pre-imported.
-            7. ONLY use table_info to see the columns and how data are related to each other. DONOT import database or use any other data source, use sql_resul as the source of data.
+            1. Follow the user's indications when choosing the chart type, axes and grouping.
+            2. Only use the result columns listed above, with their exact names.
+            3. Analytically answer the question in the insight. (eg. point out potential insights, trends, annomalies, etc.)
         """
         user_prompt = """
             User message: {user_message}
@@ -256,20 +818,71 @@ class Agent:
 
         formatted_prompt = plot_agent_prompt_template.invoke(
             {
-                "sql_result": state.sql_result,
-                "table_info": self.db.get_table_info(),
+                "columns": ", ".join(
+                    f"{column} ({result.dtypes.get(column, 'str')})"
+                    for column in result.columns
+                ),
+                # a digest of a large result, the prompt does not grow with the rows
+                "data": self._result_data(state),
                 "user_message": user_message,
             }
         )
 
-        prompt = list(state.messages) + formatted_prompt.messages  # langgraph approach
-        # prompt = state.history + formatted_prompt.messages # fastapi approach
-
-        llm = ChatGroq(model=GROQ_MODEL, groq_api_key=Config.groq_api_key)
-        response = llm.invoke(prompt)
-        result_output = response.content
+        return (
+            self._history(state, "plot_agent") + formatted_prompt.messages
+        )  # langgraph approach
 
+    def _plot_answer(self, spec: ChartSpec, chart: str):
+        # the history replays every message to the LLM, a figure would fill it
         return {
-            # "agent_answer": result_output, # fastapi approach
-            "messages": [AIMessage(content=result_output)],
+            "messages": [AIMessage(content=chart_caption(spec))],
+            "chart": chart_block(spec, chart, self.chart_renderer.fmt),
         }
+
+    def _plot_error(self, state: State, spec: ChartSpec, e: Exception):
+        """Answer with the insight and the data when the chart cannot be drawn."""
+        print(f"⚠️ Chart could not be drawn: {e!r}")
+        content = f"{spec.insight}\n\n(The chart could not be drawn: {e}.)"
+        if state.sql_result:
+            content += f"\nHere is the data for your question:\n{state.sql_result}"
+        return {"messages": [AIMessage(content=content)]}
+
+    def plot_agent(self, state: State):
+        try:
+            spec = self.scheduler.invoke(
+                self._chart_llm, self._plot_agent_prompt(state)
+            )
+        except BudgetExhausted:
+            return self._busy_answer(state)
+
+        try:
+            chart = self.chart_renderer.render(
+                spec,
+                state.query_result,
+                state.sql_query,
+                self.schema_cache.get_data_version(),
+            )
+        except Exception as e:
+            # a bad spec, a dead render worker or kaleido, the answer still stands
+            return self._plot_error(state, spec, e)
+        return self._plot_answer(spec, chart)
+
+    async def aplot_agent(self, state: State):
+        # the digest in the prompt is pandas work, keep it off the event loop
+        prompt = await asyncio.to_thread(self._plot_agent_prompt, state)
+        try:
+            spec = await self.scheduler.ainvoke(self._chart_llm, prompt)
+        except BudgetExhausted:
+            return self._busy_answer(state)
+
+        try:
+            chart = await self.chart_renderer.arender(
+                spec,
+                state.query_result,
+                state.sql_query,
+                self.schema_cache.get_data_version(),
+            )
+        except Exception as e:
+            # a bad spec, a dead render worker or kaleido, the answer still stands
+            return self._plot_error(state, spec, e)
+        return self._plot_answer(spec, chart)
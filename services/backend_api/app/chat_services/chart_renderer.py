@@ -0,0 +1,266 @@
+import asyncio
+import base64
+import hashlib
+import json
+import multiprocessing
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+import plotly.express as px
+import plotly.graph_objects as go
+from app.chat_services.result_cache import canonical_sql
+from app.config import Config
+from app.models.chat_models import ChartSpec
+from app.models.query_result import QueryResult
+
+HISTOGRAM_BINS = 50
+
+
+def lttb_indices(x: np.ndarray, y: np.ndarray, n_out: int) -> np.ndarray:
+    """Indices of the points Largest-Triangle-Three-Buckets keeps, in x order.
+
+    The first and last points are kept and the rest split into `n_out - 2`
+    buckets, each keeps the point spanning the largest triangle with the
+    neighbouring buckets. The triangles anchor on the mean of the previous
+    bucket instead of its chosen point, so every bucket is independent and
+    the whole pass is vectorized.
+    """
+    n = len(x)
+    if n <= n_out or n_out < 3:
+        return np.arange(n)
+    x = x.astype("float64")
+    y = y.astype("float64")
+    starts = np.linspace(1, n - 1, n_out - 1).astype(int)[:-1]
+    counts = np.diff(np.append(starts, n - 1))
+    mean_x = np.add.reduceat(x[: n - 1], starts) / counts
+    mean_y = np.add.reduceat(y[: n - 1], starts) / counts
+    prev_x = np.repeat(np.append(x[0], mean_x[:-1]), counts)
+    prev_y = np.repeat(np.append(y[0], mean_y[:-1]), counts)
+    next_x = np.repeat(np.append(mean_x[1:], x[-1]), counts)
+    next_y = np.repeat(np.append(mean_y[1:], y[-1]), counts)
+    points = slice(1, n - 1)
+    area = np.abs(
+        (prev_x - next_x) * (y[points] - prev_y)
+        - (prev_x - x[points]) * (next_y - prev_y)
+    )
+    # the first point reaching its bucket's maximum
+    bucket = np.repeat(np.arange(len(starts)), counts)
+    best = np.flatnonzero(
+        area == np.repeat(np.maximum.reduceat(area, starts - 1), counts)
+    )
+    _, first = np.unique(bucket[best], return_index=True)
+    return np.concatenate([[0], best[first] + 1, [n - 1]])
+
+
+def _positions(series: pd.Series) -> np.ndarray:
+    if pd.api.types.is_datetime64_any_dtype(series):
+        return series.astype("int64").to_numpy()
+    if pd.api.types.is_numeric_dtype(series):
+        return series.to_numpy(dtype="float64")
+    return np.arange(len(series))
+
+
+def downsample(frame: pd.DataFrame, spec: ChartSpec, max_points: int) -> pd.DataFrame:
+    """Keep at most `max_points` per series and y column, chosen by LTTB."""
+    groups = frame.groupby(spec.color, sort=False) if spec.color else [(None, frame)]
+    kept = []
+    for _, group in groups:
+        x = _positions(group[spec.x])
+        rows = set()
+        for column in spec.y:
+            y = group[column].to_numpy(dtype="float64", na_value=np.nan)
+            y = np.nan_to_num(y)
+            rows.update(group.index[lttb_indices(x, y, max_points)])
+        kept.append(group.loc[sorted(rows)])
+    return pd.concat(kept) if kept else frame
+
+
+def top_categories(
+    frame: pd.DataFrame, spec: ChartSpec, max_categories: int
+) -> tuple[pd.DataFrame, int]:
+    """The `max_categories` largest x values by the first y column, and how many were cut."""
+    totals = frame.groupby(spec.x, sort=False)[spec.y[0]].sum()
+    if len(totals) <= max_categories:
+        return frame, 0
+    keep = totals.nlargest(max_categories).index
+    return frame[frame[spec.x].isin(keep)], len(totals) - max_categories
+
+
+def _check_columns(spec: ChartSpec, frame: pd.DataFrame):
+    wanted = [spec.x, *spec.y] + ([spec.color] if spec.color else [])
+    missing = [column for column in wanted if column not in frame.columns]
+    if missing:
+        raise ValueError(f"the result has no column {', '.join(missing)}")
+    if not spec.y and spec.chart_type != "histogram":
+        raise ValueError(f"a {spec.chart_type} chart needs a y column")
+
+
+def build_figure(
+    spec: ChartSpec,
+    result: QueryResult,
+    max_points: int = Config.PLOT_MAX_POINTS,
+    max_categories: int = Config.PLOT_MAX_CATEGORIES,
+) -> go.Figure:
+    """Bind a chart spec to the typed result, large series are downsampled first.
+
+    Raises ValueError when the spec names columns the result does not have.
+    """
+    frame = result.to_frame()
+    _check_columns(spec, frame)
+    title = spec.title
+    # px cannot split several y columns by color, keep the first
+    y = spec.y[0] if spec.color and spec.y else spec.y
+
+    if spec.chart_type == "histogram":
+        values = pd.to_numeric(frame[spec.x], errors="coerce").dropna()
+        counts, edges = np.histogram(
+            values, bins=min(HISTOGRAM_BINS, max(len(values), 1))
+        )
+        figure = go.Figure(go.Bar(x=(edges[:-1] + edges[1:]) / 2, y=counts))
+        figure.update_layout(
+            title=title, xaxis_title=spec.x, yaxis_title="count", bargap=0
+        )
+        return figure
+
+    if spec.chart_type in ("bar", "pie"):
+        frame, cut = top_categories(frame, spec, max_categories)
+        if cut:
+            title = f"{title} (top {max_categories}, {cut} more not shown)"
+        if spec.chart_type == "pie":
+            # one slice per label, not one per row
+            slices = frame.groupby(spec.x, as_index=False, sort=False)[spec.y[0]].sum()
+            return px.pie(slices, names=spec.x, values=spec.y[0], title=title)
+        return px.bar(frame, x=spec.x, y=y, color=spec.color, title=title)
+
+    frame = frame.sort_values(spec.x, kind="stable")
+    frame = downsample(frame.reset_index(drop=True), spec, max_points)
+    plot = {"line": px.line, "area": px.area, "scatter": px.scatter}[spec.chart_type]
+    return plot(frame, x=spec.x, y=y, color=spec.color, title=title)
+
+
+def render_chart(spec: ChartSpec, result: QueryResult, fmt: str) -> str:
+    """Figure JSON, or a base64 PNG through kaleido. Runs in the render workers."""
+    figure = build_figure(spec, result)
+    if fmt == "png":
+        return base64.b64encode(figure.to_image(format="png")).decode()
+    return figure.to_json()
+
+
+def chart_caption(spec: ChartSpec) -> str:
+    """The answer kept in the conversation: the insight and which chart it had."""
+    return f"{spec.insight}\n\n(Chart: {spec.title or spec.chart_type})"
+
+
+def chart_block(spec: ChartSpec, chart: str, fmt: str) -> str:
+    """The rendered chart as markdown the frontend shows after the answer."""
+    if fmt == "png":
+        return f"![{spec.title}](data:image/png;base64,{chart})"
+    # a python block the frontend runs, it only loads the rendered figure
+    return (
+        f"```python\nimport plotly.io as pio\n\n"
+        f"fig = pio.from_json({json.dumps(chart)})\nfig.show()\n```"
+    )
+
+
+class ChartRenderer:
+    """Renders chart specs for `Agent.plot_agent` in a process pool.
+
+    Building and serializing a figure is CPU bound, so it runs in worker
+    processes instead of holding the GIL of the event loop. Rendered charts
+    are cached by (canonical SQL, data version, spec). `workers=0` renders in
+    the calling thread.
+    """
+
+    def __init__(
+        self,
+        workers: int = Config.PLOT_WORKERS,
+        fmt: str = Config.PLOT_FORMAT,
+        max_entries: int = Config.PLOT_CACHE_ENTRIES,
+    ):
+        self.workers = workers
+        self.fmt = fmt
+        self.max_entries = max_entries
+        self._pool: ProcessPoolExecutor | None = None
+        self._entries: OrderedDict[str, str] = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def pool(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            with self._lock:
+                if self._pool is None:
+                    # spawned, forking a process that runs threads is unsafe
+                    self._pool = ProcessPoolExecutor(
+                        max_workers=self.workers,
+                        mp_context=multiprocessing.get_context("spawn"),
+                    )
+        return self._pool
+
+    def make_key(self, sql_query: str, data_version: int, spec: ChartSpec) -> str:
+        key = f"{data_version}:{self.fmt}:{canonical_sql(sql_query)}:{spec.model_dump_json()}"
+        return hashlib.sha256(key.encode()).hexdigest()
+
+    def _cached(self, key: str) -> str | None:
+        with self._lock:
+            chart = self._entries.get(key)
+            if chart is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return chart
+
+    def _store(self, key: str, chart: str):
+        with self._lock:
+            self._entries[key] = chart
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def render(
+        self, spec: ChartSpec, result: QueryResult, sql_query: str, data_version: int
+    ) -> str:
+        key = self.make_key(sql_query, data_version, spec)
+        chart = self._cached(key)
+        if chart is None:
+            if self.workers:
+                chart = (
+                    self.pool().submit(render_chart, spec, result, self.fmt).result()
+                )
+            else:
+                chart = render_chart(spec, result, self.fmt)
+            self._store(key, chart)
+        return chart
+
+    async def arender(
+        self, spec: ChartSpec, result: QueryResult, sql_query: str, data_version: int
+    ) -> str:
+        key = self.make_key(sql_query, data_version, spec)
+        chart = self._cached(key)
+        if chart is None:
+            if self.workers:
+                chart = await asyncio.get_running_loop().run_in_executor(
+                    self.pool(), render_chart, spec, result, self.fmt
+                )
+            else:
+                chart = await asyncio.to_thread(render_chart, spec, result, self.fmt)
+            self._store(key, chart)
+        return chart
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown(cancel_futures=True)
+            self._pool = None
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
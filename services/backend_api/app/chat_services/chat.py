@@ -1,22 +1,213 @@
+import asyncio
+import statistics
+import time
+from collections import deque
+
 from app.chat_services.chat_history import ChatHistory
-from app.chat_services.graph import GraphBuilder
+from app.chat_services.conversation import ConversationMemory
+from app.chat_services.inflight import InFlight
+from app.chat_services.llm_scheduler import BATCH, turn_priority
+from app.chat_services.metrics import metrics
+from app.chat_services.query_cache import normalize_question
 from app.models.chat_models import History
 from app.models.state import State
-from fastapi import Depends
+from langchain_core.messages import AIMessageChunk, HumanMessage
+
+# nodes whose LLM output is the answer, their tokens are streamed to the client
+STREAMED_NODES = {"generate_answer", "chat_agent"}
 
 
 class ChatService:
     def __init__(
         self,
-        history: ChatHistory = Depends(ChatHistory),
-        graph_builder: GraphBuilder = Depends(GraphBuilder),
+        graph,
+        history: ChatHistory | None = None,
+        memory: ConversationMemory | None = None,
+    ):
+        # graph is compiled once at startup and shared by every request
+        self.graph = graph
+        self.history = history or ChatHistory()
+        # server side history for requests with a session_id
+        self.memory = memory
+        # recent streamed turns, time to first token is what users wait for
+        self.ttft_ms: deque[float] = deque(maxlen=1000)
+        self.total_ms: deque[float] = deque(maxlen=1000)
+        # batch questions asked again while the first is still running wait for it
+        self.inflight_questions = InFlight()
+
+    @staticmethod
+    def answer(result: dict) -> str:
+        """The answer for the client, with the chart the conversation keeps out."""
+        message = result["messages"][-1].content
+        chart = result.get("chart")
+        return f"{message}\n\n{chart}" if chart else message
+
+    def _uses_memory(self, session_id: str | None) -> bool:
+        return bool(session_id) and self.memory is not None
+
+    def _initial_state(
+        self, message: str, history: list[History], session_id: str | None = None
+    ) -> State:
+        if self._uses_memory(session_id):
+            # the store replaces the history the client sent
+            return State(messages=self.memory.load(session_id, message))
+        messages = self.history.build_chat_history(history)
+        messages.append(HumanMessage(content=message))
+        return State(messages=messages)
+
+    async def _ainitial_state(
+        self, message: str, history: list[History], session_id: str | None = None
+    ) -> State:
+        return await asyncio.to_thread(
+            self._initial_state, message, history, session_id
+        )
+
+    def chat_flow(
+        self, message: str, history: list[History], session_id: str | None = None
+    ):
+        turn = metrics.start_turn()
+        try:
+            result = self.graph.invoke(
+                self._initial_state(message, history, session_id)
+            )
+        finally:
+            metrics.finish_turn(turn, message)
+        if self._uses_memory(session_id):
+            self.memory.record(session_id, message, result["messages"][-1].content)
+        return result
+
+    async def achat_flow(
+        self, message: str, history: list[History], session_id: str | None = None
     ):
-        self.graph = graph_builder.build_graph()
-        self.history = history
-
-    def chat_flow(self, message: str, history: list[History]):
-        history = self.history.build_chat_history(history)
-        state = State(message=message, history=history)
-        result = self.graph.invoke(state)
-        print(result)
+        turn = metrics.start_turn()
+        try:
+            result = await self.graph.ainvoke(
+                await self._ainitial_state(message, history, session_id)
+            )
+        finally:
+            metrics.finish_turn(turn, message)
+        if self._uses_memory(session_id):
+            await self.memory.arecord(
+                session_id, message, result["messages"][-1].content
+            )
         return result
+
+    async def _abatch_item(
+        self, question: str, limit: asyncio.Semaphore, start: float
+    ) -> dict:
+        async def answer():
+            async with limit:
+                # set in the shared task's own context, live chat keeps going first
+                turn_priority.set(BATCH)
+                return await self.achat_flow(question, [])
+
+        key = normalize_question(question)
+        item = {"question": question, "shared": self.inflight_questions.running(key)}
+        try:
+            result, _ = await self.inflight_questions.run(key, answer)
+        except Exception as e:
+            item.update(status="error", error=str(e) or type(e).__name__)
+        else:
+            item.update(
+                status="success",
+                message=self.answer(result),
+                sql_query=result.get("sql_query", ""),
+            )
+        item["elapsed_ms"] = round((time.perf_counter() - start) * 1000, 1)
+        return item
+
+    async def abatch_flow(self, questions: list[str], concurrency: int) -> list[dict]:
+        """Answer independent questions concurrently, `concurrency` graph runs at a time.
+
+        Questions that normalize the same, in this batch or another one in
+        flight, run the graph once. Their LLM calls queue for the token budget
+        at `BATCH` priority, behind interactive turns. A failed question is
+        reported in its item and does not fail the others. Items come back in
+        the order asked.
+        """
+        limit = asyncio.Semaphore(concurrency)
+        start = time.perf_counter()
+        return await asyncio.gather(
+            *(self._abatch_item(question, limit, start) for question in questions)
+        )
+
+    async def astream_flow(
+        self, message: str, history: list[History], session_id: str | None = None
+    ):
+        """Yield `(event, data)` pairs as the graph runs.
+
+        A `node` event when each node finishes, `token` events as an answer
+        node generates, then one `done` event with the answer and timings.
+        """
+        start = time.perf_counter()
+        first_token_ms = None
+        answer, answer_node, chart = "", "", ""
+        turn = metrics.start_turn()
+        try:
+            async for mode, chunk in self.graph.astream(
+                await self._ainitial_state(message, history, session_id),
+                stream_mode=["updates", "messages"],
+            ):
+                elapsed_ms = (time.perf_counter() - start) * 1000
+                if mode == "messages":
+                    token, metadata = chunk
+                    node = metadata.get("langgraph_node")
+                    if (
+                        node in STREAMED_NODES
+                        and isinstance(token, AIMessageChunk)
+                        and isinstance(token.content, str)
+                        and token.content
+                    ):
+                        if first_token_ms is None:
+                            first_token_ms = elapsed_ms
+                        yield "token", {"node": node, "content": token.content}
+                    continue
+
+                for node, update in chunk.items():
+                    values = update or {}  # nodes may return nothing
+                    event = {"node": node, "elapsed_ms": round(elapsed_ms, 1)}
+                    if "sql_query_execution_status" in values:
+                        event["status"] = values["sql_query_execution_status"]
+                    yield "node", event
+                    if values.get("messages"):
+                        answer, answer_node = values["messages"][-1].content, node
+                    chart = values.get("chart", chart)
+
+            if first_token_ms is None and answer:
+                # cannot_answer and non-streaming models still deliver the text as a token
+                first_token_ms = (time.perf_counter() - start) * 1000
+                yield "token", {"node": answer_node, "content": answer}
+        finally:
+            first_token = None if first_token_ms is None else first_token_ms / 1000
+            metrics.finish_turn(turn, message, first_token)
+
+        if self._uses_memory(session_id):
+            await self.memory.arecord(session_id, message, answer)
+        total_ms = (time.perf_counter() - start) * 1000
+        if first_token_ms is not None:
+            self.ttft_ms.append(first_token_ms)
+        self.total_ms.append(total_ms)
+        print(
+            f"⏱️ {answer_node}: first token {first_token_ms or 0:.0f} ms, total {total_ms:.0f} ms"
+        )
+        yield (
+            "done",
+            {
+                "message": f"{answer}\n\n{chart}" if chart else answer,
+                "ttft_ms": round(first_token_ms or total_ms, 1),
+                "total_ms": round(total_ms, 1),
+            },
+        )
+
+    def latency_stats(self) -> dict:
+        def percentiles(values) -> dict:
+            if len(values) < 2:
+                return {"p50": values[0] if values else None, "p95": None}
+            cuts = statistics.quantiles(values, n=20, method="inclusive")
+            return {"p50": statistics.median(values), "p95": cuts[-1]}
+
+        return {
+            "turns": len(self.total_ms),
+            "ttft_ms": percentiles(list(self.ttft_ms)),
+            "total_ms": percentiles(list(self.total_ms)),
+        }
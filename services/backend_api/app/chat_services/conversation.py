@@ -0,0 +1,288 @@
+import asyncio
+import sqlite3
+import threading
+import time
+from collections import defaultdict
+
+from app.chat_services.llm_pool import LLMRegistry
+from app.chat_services.llm_scheduler import (
+    BACKGROUND,
+    BudgetExhausted,
+    LLMScheduler,
+    llm_scheduler,
+)
+from app.config import Config
+from langchain_core.messages import (
+    AIMessage,
+    BaseMessage,
+    HumanMessage,
+    SystemMessage,
+    trim_messages,
+)
+from langchain_core.messages.utils import count_tokens_approximately
+from langchain_core.prompts import ChatPromptTemplate
+
+SUMMARY_PREFIX = "Summary of the earlier conversation:"
+
+
+def trim_history(messages: list[BaseMessage], max_tokens: int) -> list[BaseMessage]:
+    """Keep the latest messages that fit `max_tokens`, the current one always stays."""
+    if not messages:
+        return []
+    *history, current = messages
+    budget = max(max_tokens - count_tokens_approximately([current]), 0)
+    kept = trim_messages(
+        history,
+        max_tokens=budget,
+        token_counter=count_tokens_approximately,
+        strategy="last",
+        start_on="human",
+        include_system=True,
+    )
+    return kept + [current]
+
+
+class HistoryMetrics:
+    """Tokens of history that would have been replayed versus what was sent."""
+
+    def __init__(self):
+        self.calls: dict[str, int] = defaultdict(int)
+        self.full_tokens: dict[str, int] = defaultdict(int)
+        self.sent_tokens: dict[str, int] = defaultdict(int)
+
+    def record(self, scope: str, full_tokens: int, sent_tokens: int):
+        self.calls[scope] += 1
+        self.full_tokens[scope] += full_tokens
+        self.sent_tokens[scope] += sent_tokens
+
+    def stats(self) -> dict:
+        stats = {}
+        for scope, calls in self.calls.items():
+            full, sent = self.full_tokens[scope], self.sent_tokens[scope]
+            stats[scope] = {
+                "calls": calls,
+                "full_tokens": full,
+                "sent_tokens": sent,
+                "saved_per_call": (full - sent) / calls,
+                "saved_ratio": (full - sent) / full if full else 0.0,
+            }
+        return stats
+
+
+class ConversationStore:
+    """Session keyed conversation turns and their running summary in a SQLite file."""
+
+    def __init__(self, path: str):
+        self.path = path
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS conversation_messages (
+                    session_id TEXT NOT NULL,
+                    seq INTEGER NOT NULL,
+                    role TEXT NOT NULL,
+                    content TEXT NOT NULL,
+                    tokens INTEGER NOT NULL,
+                    created_at REAL NOT NULL,
+                    PRIMARY KEY (session_id, seq)
+                )
+                """
+            )
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS conversation_summaries (
+                    session_id TEXT PRIMARY KEY,
+                    summary TEXT NOT NULL,
+                    summarized_seq INTEGER NOT NULL
+                )
+                """
+            )
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=5)
+
+    def append(self, session_id: str, messages: list[BaseMessage]):
+        with self._connect() as conn:
+            # write lock before reading MAX(seq), two turns of a session would
+            # otherwise number their messages the same
+            conn.execute("BEGIN IMMEDIATE")
+            seq = conn.execute(
+                "SELECT COALESCE(MAX(seq), 0) FROM conversation_messages WHERE session_id = ?",
+                (session_id,),
+            ).fetchone()[0]
+            conn.executemany(
+                "INSERT INTO conversation_messages VALUES (?, ?, ?, ?, ?, ?)",
+                [
+                    (
+                        session_id,
+                        seq + i,
+                        message.type,
+                        message.content,
+                        count_tokens_approximately([message]),
+                        time.time(),
+                    )
+                    for i, message in enumerate(messages, start=1)
+                ],
+            )
+
+    def summary(self, session_id: str) -> tuple[str, int]:
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT summary, summarized_seq FROM conversation_summaries WHERE session_id = ?",
+                (session_id,),
+            ).fetchone()
+        return row or ("", 0)
+
+    def set_summary(self, session_id: str, summary: str, summarized_seq: int):
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO conversation_summaries VALUES (?, ?, ?)",
+                (session_id, summary, summarized_seq),
+            )
+
+    def messages(
+        self, session_id: str, after_seq: int = 0
+    ) -> list[tuple[int, BaseMessage]]:
+        with self._connect() as conn:
+            rows = conn.execute(
+                """
+                SELECT seq, role, content FROM conversation_messages
+                WHERE session_id = ? AND seq > ?
+                ORDER BY seq
+                """,
+                (session_id, after_seq),
+            ).fetchall()
+        return [
+            (seq, HumanMessage(content) if role == "human" else AIMessage(content))
+            for seq, role, content in rows
+        ]
+
+    def total_tokens(self, session_id: str) -> int:
+        with self._connect() as conn:
+            return conn.execute(
+                "SELECT COALESCE(SUM(tokens), 0) FROM conversation_messages WHERE session_id = ?",
+                (session_id,),
+            ).fetchone()[0]
+
+
+class ConversationMemory:
+    """Builds each turn's history from the store instead of the client's full replay.
+
+    Messages not yet summarized are replayed verbatim after the running summary.
+    Once `summary_batch` of them fall out of the last `window` messages they are
+    merged into the summary in one LLM call, off the request path for async
+    turns, so the replayed history stays between `window` and
+    `window + summary_batch` messages however long the session gets.
+    """
+
+    def __init__(
+        self,
+        store: ConversationStore,
+        llms: LLMRegistry,
+        scheduler: LLMScheduler | None = None,
+    ):
+        self.store = store
+        self.llms = llms
+        # summaries wait behind interactive calls for the shared token budget
+        self.scheduler = scheduler or llm_scheduler
+        self.window = Config.HISTORY_WINDOW_MESSAGES
+        self.summary_batch = Config.HISTORY_SUMMARY_BATCH
+        self.metrics = HistoryMetrics()
+        self._summarizing: set[str] = set()
+        self._lock = threading.Lock()
+        self._tasks: set[asyncio.Task] = set()
+
+    def load(self, session_id: str, message: str) -> list[BaseMessage]:
+        """Summary, recent window and the new human message for one turn."""
+        summary, summarized_seq = self.store.summary(session_id)
+        recent = [m for _, m in self.store.messages(session_id, summarized_seq)]
+        messages = [SystemMessage(f"{SUMMARY_PREFIX} {summary}")] if summary else []
+        messages += recent + [HumanMessage(content=message)]
+
+        # what replaying the whole conversation would have cost
+        full_tokens = self.store.total_tokens(session_id) + count_tokens_approximately(
+            messages[-1:]
+        )
+        self.metrics.record("turn", full_tokens, count_tokens_approximately(messages))
+        return messages
+
+    def _pending(self, session_id: str) -> tuple[str, list[tuple[int, BaseMessage]]]:
+        """The summary and the messages that left the window but are not in it yet."""
+        summary, summarized_seq = self.store.summary(session_id)
+        unsummarized = self.store.messages(session_id, summarized_seq)
+        outside = unsummarized[: max(len(unsummarized) - self.window, 0)]
+        if len(outside) < self.summary_batch:
+            return summary, []
+        return summary, outside
+
+    def _claim(self, session_id: str) -> bool:
+        with self._lock:
+            if session_id in self._summarizing:
+                return False
+            self._summarizing.add(session_id)
+            return True
+
+    def _release(self, session_id: str):
+        with self._lock:
+            self._summarizing.discard(session_id)
+
+    def _summary_prompt(self, summary: str, messages: list[BaseMessage]):
+        system_message = """
+            /no_think
+            You keep a running summary of a conversation between a manager and a business data assistant.
+            Merge the new turns into the current summary. Keep the entities, filters, time ranges, figures and open questions the manager may refer back to. Drop greetings and small talk.
+            Answer with the updated summary only, at most 150 words.
+        """
+        user_prompt = "Current summary: {summary}\nNew turns:\n{turns}"
+        prompt_template = ChatPromptTemplate(
+            [("system", system_message), ("user", user_prompt)]
+        )
+        turns = "\n".join(
+            f"{'Manager' if m.type == 'human' else 'Assistant'}: {m.content}"
+            for m in messages
+        )
+        return prompt_template.invoke(
+            {"summary": summary or "None", "turns": turns}
+        ).messages
+
+    def record(self, session_id: str, message: str, answer: str):
+        self.store.append(session_id, [HumanMessage(message), AIMessage(answer)])
+        summary, pending = self._pending(session_id)
+        if not pending or not self._claim(session_id):
+            return
+        try:
+            prompt = self._summary_prompt(summary, [m for _, m in pending])
+            response = self.scheduler.invoke(self.llms.chat_model, prompt, BACKGROUND)
+            self.store.set_summary(session_id, response.content, pending[-1][0])
+        except BudgetExhausted:
+            # the turns stay unsummarized and are retried after the next turn
+            print(f"⚠️ No token budget to summarize session {session_id}")
+        finally:
+            self._release(session_id)
+
+    async def arecord(self, session_id: str, message: str, answer: str):
+        await asyncio.to_thread(
+            self.store.append, session_id, [HumanMessage(message), AIMessage(answer)]
+        )
+        summary, pending = await asyncio.to_thread(self._pending, session_id)
+        if not pending or not self._claim(session_id):
+            return
+        # the next turn reads whichever summary is stored, never wait for this one
+        task = asyncio.create_task(self._asummarize(session_id, summary, pending))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _asummarize(self, session_id: str, summary: str, pending):
+        try:
+            prompt = self._summary_prompt(summary, [m for _, m in pending])
+            response = await self.scheduler.ainvoke(
+                self.llms.chat_model, prompt, BACKGROUND
+            )
+            await asyncio.to_thread(
+                self.store.set_summary, session_id, response.content, pending[-1][0]
+            )
+        except Exception as e:
+            print(f"⚠️ Could not summarize session {session_id}: {e}")
+        finally:
+            self._release(session_id)
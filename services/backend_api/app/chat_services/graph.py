@@ -1,60 +1,151 @@
 from app.chat_services.agents import (
     Agent,
 )
+from app.chat_services.metrics import instrument
 from app.models.state import State
-from fastapi import Depends
+from langchain_core.runnables import RunnableLambda
 from langgraph.graph import END, StateGraph
 
 
 class GraphBuilder:
-    def __init__(self, agent: Agent = Depends(Agent)) -> None:
+    def __init__(self, agent: Agent) -> None:
         self.agent = agent
+        # with SQL candidates the first attempt races them, retries stay sequential
+        self.racing = agent.sql_race is not None
+        self.first_sql_node = "race_query" if self.racing else "write_query"
 
         self.workflow = StateGraph(State)
 
-        self.workflow.add_node("write_query", agent.write_query)
-        self.workflow.add_node("execute_query", agent.execute_query)
-        self.workflow.add_node("generate_answer", agent.generate_answer)
-        self.workflow.add_node("cannot_answer", agent.cannot_answer)
-        self.workflow.add_node("plot_agent", agent.plot_agent)
-        self.workflow.add_node("chat_agent", agent.chat_agent)
+        # each node pairs the sync and async implementation, so the compiled
+        # graph runs the sync one on graph.invoke and the async one on graph.ainvoke
+        for name in [
+            "pre_route",
+            "write_query",
+            "guard_query",
+            "retrieve_reviews",
+            "execute_query",
+            "profile_result",
+            "generate_answer",
+            "cannot_answer",
+            "plot_agent",
+            "chat_agent",
+        ]:
+            self.workflow.add_node(name, self.node(name))
+        if self.racing:
+            self.workflow.add_node("race_query", self.node("race_query"))
 
         # flow start here
-        self.workflow.set_entry_point("write_query")
+        self.workflow.set_entry_point("pre_route")
+        self.workflow.add_conditional_edges(
+            "pre_route",
+            self.pre_router,
+            ["chat_agent", self.first_sql_node, "cannot_answer"],
+        )
+        if self.racing:
+            self.workflow.add_conditional_edges(
+                "race_query",
+                self.race_router,
+                [
+                    "chat_agent",
+                    "retrieve_reviews",
+                    "profile_result",
+                    "plot_agent",
+                    "write_query",
+                    "cannot_answer",
+                ],
+            )
         self.workflow.add_conditional_edges(
             "write_query",
             self.chat_router,
-            ["chat_agent", "execute_query", "cannot_answer"],
+            ["chat_agent", "retrieve_reviews", "guard_query", "cannot_answer"],
+        )
+        self.workflow.add_conditional_edges(
+            "retrieve_reviews",
+            self.retrieval_router,
+            ["profile_result", "guard_query", "cannot_answer"],
+        )
+        self.workflow.add_conditional_edges(
+            "guard_query",
+            self.guard_router,
+            ["execute_query", "cannot_answer", "write_query"],
         )
         self.workflow.add_conditional_edges(
             "execute_query",
             self.query_router,
-            ["generate_answer", "cannot_answer", "plot_agent", "write_query"],
+            ["profile_result", "cannot_answer", "plot_agent", "write_query"],
         )
+        self.workflow.add_edge("profile_result", "generate_answer")
         # flow end here
         self.workflow.add_edge("chat_agent", END)
         self.workflow.add_edge("plot_agent", END)
         self.workflow.add_edge("generate_answer", END)
         self.workflow.add_edge("cannot_answer", END)
 
+    def node(self, name: str) -> RunnableLambda:
+        # timed per node, LLM calls made inside are attributed to it
+        func, afunc = instrument(
+            name, getattr(self.agent, name), getattr(self.agent, f"a{name}")
+        )
+        return RunnableLambda(func, afunc=afunc, name=name)
+
     def build_graph(self) -> StateGraph:
         return self.workflow.compile()
 
-    def chat_router(self, state: State):
+    def pre_router(self, state: State):
+        """Routes turns the pre-router was sure about, the rest go to write_query."""
         if state.chit_chat:
             return "chat_agent"
         elif state.out_of_policy:
             return "cannot_answer"
         else:
+            return self.first_sql_node
+
+    def chat_router(self, state: State):
+        if state.chit_chat:
+            return "chat_agent"
+        elif state.out_of_policy or state.llm_busy:
+            return "cannot_answer"
+        elif state.review_search:
+            return "retrieve_reviews"
+        else:
+            return "guard_query"
+
+    def race_router(self, state: State):
+        """Routes a routing decision like chat_router, a raced query like query_router."""
+        if (
+            state.chit_chat
+            or state.out_of_policy
+            or state.llm_busy
+            or state.review_search
+        ):
+            return self.chat_router(state)
+        return self.query_router(state)
+
+    def retrieval_router(self, state: State):
+        """Routes found review texts to the answer, a miss to the SQL write_query wrote."""
+        if state.sql_query_execution_status == "success":
+            return "profile_result"
+        elif state.sql_query.strip():
+            return "guard_query"
+        else:
+            return "cannot_answer"
+
+    def guard_router(self, state: State):
+        """Routes a rejected query back to write_query through the same retry budget."""
+        if state.sql_query_execution_status == "success":
             return "execute_query"
+        elif state.sql_error_count < 2:
+            return "write_query"
+        else:
+            return "cannot_answer"
 
     def query_router(self, state: State):
-        """Routes to generate_answer, cannot_answer, plot_agent or write_query based on query_execution_status."""
+        """Routes to profile_result, cannot_answer, plot_agent or write_query based on query_execution_status."""
         if state.sql_query_execution_status == "success":
             if state.need_visualise:
                 return "plot_agent"
             else:
-                return "generate_answer"
+                return "profile_result"
 
         elif state.sql_query_execution_status == "failure":
             if state.sql_error_count < 2:
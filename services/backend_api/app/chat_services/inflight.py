@@ -0,0 +1,62 @@
+import asyncio
+from collections import Counter
+from collections.abc import Awaitable, Callable
+from typing import Any
+
+
+class InFlight:
+    """Coalesces concurrent async calls with the same key into one run.
+
+    The first caller starts the call as a task, callers arriving before it
+    finishes await the same task and share its result or exception. The task
+    is shielded, a cancelled caller only cancels it when nobody else waits.
+    Nothing is kept once it finishes, caching is left to the result caches.
+    """
+
+    def __init__(self):
+        self._tasks: dict[str, asyncio.Task] = {}
+        self._waiters: Counter[str] = Counter()
+        self.calls = 0
+        self.shared = 0
+
+    def _done(self, key: str, task: asyncio.Task):
+        self._tasks.pop(key, None)
+        if not task.cancelled():
+            # retrieved, so an error nobody waits for any more is not logged
+            task.exception()
+
+    def running(self, key: str) -> bool:
+        return key in self._tasks
+
+    async def run(
+        self, key: str, call: Callable[[], Awaitable[Any]]
+    ) -> tuple[Any, bool]:
+        """Result of `call()`, and whether it was shared with an earlier caller."""
+        self.calls += 1
+        task = self._tasks.get(key)
+        shared = task is not None
+        if shared:
+            self.shared += 1
+        else:
+            task = asyncio.ensure_future(call())
+            self._tasks[key] = task
+            task.add_done_callback(lambda done: self._done(key, done))
+        self._waiters[key] += 1
+        try:
+            return await asyncio.shield(task), shared
+        except asyncio.CancelledError:
+            if self._waiters[key] == 1:
+                task.cancel()
+            raise
+        finally:
+            self._waiters[key] -= 1
+            if not self._waiters[key]:
+                del self._waiters[key]
+
+    def stats(self) -> dict:
+        return {
+            "in_flight": len(self._tasks),
+            "calls": self.calls,
+            "shared": self.shared,
+            "shared_rate": self.shared / self.calls if self.calls else 0.0,
+        }
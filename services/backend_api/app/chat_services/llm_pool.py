@@ -0,0 +1,69 @@
+import threading
+
+import httpx
+from app.config import GROQ_MODEL, Config
+from langchain_groq import ChatGroq
+
+
+class LLMRegistry:
+    """Process-wide pool of ChatGroq clients.
+
+    Every client shares one sync and one async HTTP/2 connection pool, so the
+    nodes of a turn reuse the keep-alive connections instead of each paying the
+    TLS setup. Clients and structured-output runnables are built once per
+    (model, temperature) and handed out on every call.
+    """
+
+    def __init__(self, api_key: str | None = None):
+        self.api_key = api_key or Config.groq_api_key
+        limits = httpx.Limits(
+            max_connections=Config.LLM_MAX_CONNECTIONS,
+            max_keepalive_connections=Config.LLM_MAX_CONNECTIONS,
+            keepalive_expiry=Config.LLM_KEEPALIVE_SECONDS,
+        )
+        timeout = httpx.Timeout(Config.LLM_TIMEOUT_SECONDS)
+        self.http_client = httpx.Client(http2=True, limits=limits, timeout=timeout)
+        self.http_async_client = httpx.AsyncClient(
+            http2=True, limits=limits, timeout=timeout
+        )
+        self._chat_models: dict[tuple, ChatGroq] = {}
+        self._structured = {}
+        self._lock = threading.Lock()
+
+    def chat_model(
+        self, model: str = GROQ_MODEL, temperature: float | None = None
+    ) -> ChatGroq:
+        key = (model, temperature)
+        if key not in self._chat_models:
+            with self._lock:
+                if key not in self._chat_models:
+                    kwargs = {} if temperature is None else {"temperature": temperature}
+                    self._chat_models[key] = ChatGroq(
+                        model=model,
+                        groq_api_key=self.api_key,
+                        http_client=self.http_client,
+                        http_async_client=self.http_async_client,
+                        **kwargs,
+                    )
+        return self._chat_models[key]
+
+    def structured(
+        self, schema, model: str = GROQ_MODEL, temperature: float | None = None
+    ):
+        key = (schema, model, temperature)
+        if key not in self._structured:
+            llm = self.chat_model(model, temperature)
+            with self._lock:
+                if key not in self._structured:
+                    self._structured[key] = llm.with_structured_output(schema)
+        return self._structured[key]
+
+    def close(self):
+        self.http_client.close()
+
+    async def aclose(self):
+        self.http_client.close()
+        await self.http_async_client.aclose()
+
+
+llm_registry = LLMRegistry()
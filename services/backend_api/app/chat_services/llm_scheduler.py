@@ -0,0 +1,313 @@
+import asyncio
+import contextvars
+import heapq
+import itertools
+import threading
+import time
+
+from app.chat_services.metrics import metrics
+from app.config import GROQ_FALLBACK_MODELS, GROQ_MODEL, GROQ_MODEL_LIMITS, Config
+from groq import RateLimitError
+from langchain_core.callbacks import get_usage_metadata_callback
+from langchain_core.messages.utils import count_tokens_approximately
+
+# lower runs first
+INTERACTIVE = 0
+BATCH = 5
+BACKGROUND = 10
+# priority of the LLM calls made in this context, the batch flow lowers it
+turn_priority: contextvars.ContextVar[int] = contextvars.ContextVar(
+    "turn_priority", default=INTERACTIVE
+)
+
+
+class BudgetExhausted(Exception):
+    """Every model is out of budget for longer than the caller may wait."""
+
+
+class TokenBucket:
+    """Holds up to `capacity` tokens and refills them evenly over `period` seconds."""
+
+    def __init__(self, capacity: int, period: float):
+        self.capacity = capacity
+        self.rate = capacity / period
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+
+    def refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, tokens: int, now: float) -> float:
+        self.refill(now)
+        # a call bigger than the bucket only waits for a full one
+        missing = min(tokens, self.capacity) - self.tokens
+        return max(missing, 0) / self.rate
+
+    def take(self, tokens: float):
+        # may go negative when a call used more than reserved, later calls wait it off
+        self.tokens -= tokens
+
+
+class ModelBudget:
+    def __init__(self, model: str, per_minute: int, per_day: int):
+        self.model = model
+        self.minute = TokenBucket(per_minute, 60)
+        self.day = TokenBucket(per_day, 24 * 60 * 60)
+        self.cooldown_until = 0.0
+        self.waiting: list[tuple[int, int]] = []  # heap of (priority, ticket)
+        self.calls = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.rate_limited = 0
+
+    def wait_time(self, tokens: int, now: float) -> float:
+        return max(
+            self.cooldown_until - now,
+            self.minute.wait_time(tokens, now),
+            self.day.wait_time(tokens, now),
+        )
+
+    def state(self, now: float) -> dict:
+        self.minute.refill(now)
+        self.day.refill(now)
+        return {
+            "minute_available": int(self.minute.tokens),
+            "minute_capacity": self.minute.capacity,
+            "day_available": int(self.day.tokens),
+            "day_capacity": self.day.capacity,
+            "cooldown_seconds": round(max(self.cooldown_until - now, 0), 1),
+            "queued": len(self.waiting),
+            "calls": self.calls,
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "rate_limited": self.rate_limited,
+        }
+
+
+class LLMScheduler:
+    """Paces every LLM call of the process against per-model token budgets.
+
+    Each model has a per-minute and a per-day token bucket sized from
+    `GROQ_MODEL_LIMITS`. A call reserves its estimated tokens (approximate
+    prompt tokens plus `LLM_COMPLETION_ESTIMATE`) and the reservation is
+    corrected with the usage the API reports. Calls waiting for a model are
+    served by priority, then arrival. When a model cannot serve a call within
+    `max_wait` seconds, or answers 429, the next model in the fallback list is
+    tried, and `BudgetExhausted` is raised once every model is out.
+    """
+
+    def __init__(
+        self,
+        models: list[str] | None = None,
+        limits: dict[str, tuple[int, int]] | None = None,
+        max_wait: float | None = None,
+    ):
+        self.models = models or [GROQ_MODEL, *GROQ_FALLBACK_MODELS]
+        limits = limits or GROQ_MODEL_LIMITS
+        self.budgets = {
+            model: ModelBudget(model, *limits[model])
+            for model in self.models
+            if model in limits
+        }
+        self.max_wait = Config.LLM_MAX_QUEUE_SECONDS if max_wait is None else max_wait
+        self.enabled = Config.LLM_BUDGET_ENABLED
+        self.fallbacks = 0
+        self.exhausted = 0
+        self._tickets = itertools.count()
+        self._lock = threading.Lock()
+
+    def estimate(self, prompt) -> int:
+        return count_tokens_approximately(prompt) + Config.LLM_COMPLETION_ESTIMATE
+
+    def _poll(self, budget: ModelBudget, ticket, tokens: int, deadline: float):
+        """Take the tokens if it is this ticket's turn: 0 when taken, else seconds to wait, None to give up."""
+        with self._lock:
+            now = time.monotonic()
+            wait = budget.wait_time(tokens, now)
+            if budget.waiting[0] == ticket and wait == 0:
+                heapq.heappop(budget.waiting)
+                budget.minute.take(tokens)
+                budget.day.take(tokens)
+                return 0.0
+            if now + wait > deadline:
+                self._leave(budget, ticket)
+                return None
+            # behind a higher priority call, check again shortly
+            return wait if budget.waiting[0] == ticket else min(max(wait, 0.05), 0.5)
+
+    def _enqueue(self, budget: ModelBudget, priority: int):
+        ticket = (priority, next(self._tickets))
+        with self._lock:
+            heapq.heappush(budget.waiting, ticket)
+        return ticket
+
+    def _leave(self, budget: ModelBudget, ticket):
+        """Drop a ticket that gave up, called with the lock held."""
+        if ticket in budget.waiting:
+            budget.waiting.remove(ticket)
+            heapq.heapify(budget.waiting)
+
+    def _abandon(self, budget: ModelBudget, ticket):
+        # a cancelled or interrupted waiter would block the queue head for good
+        with self._lock:
+            self._leave(budget, ticket)
+
+    def acquire(self, budget: ModelBudget, tokens: int, priority: int) -> bool:
+        deadline = time.monotonic() + self.max_wait
+        ticket = self._enqueue(budget, priority)
+        try:
+            while True:
+                wait = self._poll(budget, ticket, tokens, deadline)
+                if wait is None:
+                    return False
+                if wait == 0:
+                    return True
+                time.sleep(wait)
+        except BaseException:
+            self._abandon(budget, ticket)
+            raise
+
+    async def aacquire(self, budget: ModelBudget, tokens: int, priority: int) -> bool:
+        deadline = time.monotonic() + self.max_wait
+        ticket = self._enqueue(budget, priority)
+        try:
+            while True:
+                wait = self._poll(budget, ticket, tokens, deadline)
+                if wait is None:
+                    return False
+                if wait == 0:
+                    return True
+                await asyncio.sleep(wait)
+        except BaseException:
+            # CancelledError: a lost SQL race candidate or a closed stream
+            self._abandon(budget, ticket)
+            raise
+
+    def _settle(self, budget: ModelBudget, reserved: int, usage: dict):
+        """Replace the reservation with the tokens the call really used."""
+        used = usage.get("total_tokens", reserved) if usage else reserved
+        with self._lock:
+            budget.calls += 1
+            if usage:
+                budget.prompt_tokens += usage.get("input_tokens", 0)
+                budget.completion_tokens += usage.get("output_tokens", 0)
+            budget.minute.take(used - reserved)
+            budget.day.take(used - reserved)
+
+    def _rate_limited(self, budget: ModelBudget, error: RateLimitError):
+        retry_after = error.response.headers.get("retry-after")
+        cooldown = (
+            float(retry_after)
+            if retry_after
+            else Config.LLM_RATE_LIMIT_COOLDOWN_SECONDS
+        )
+        with self._lock:
+            budget.rate_limited += 1
+            budget.cooldown_until = time.monotonic() + cooldown
+        print(f"⚠️ {budget.model} rate limited, skipping it for {cooldown:.0f}s")
+
+    def _candidates(self, models: list[str]):
+        for i, model in enumerate(models):
+            if i:
+                self.fallbacks += 1
+            yield model, self.budgets.get(model)
+
+    def _exhausted(self):
+        self.exhausted += 1
+        return BudgetExhausted("Every model is out of token budget, try again later.")
+
+    def _call(self, build, model: str, prompt):
+        """One LLM call and the usage it reported."""
+        start = time.perf_counter()
+        with get_usage_metadata_callback() as callback:
+            result = build(model).invoke(prompt)
+        usage = next(iter(callback.usage_metadata.values()), {})
+        metrics.record_llm(model, usage, time.perf_counter() - start)
+        return result, usage
+
+    async def _acall(self, build, model: str, prompt):
+        start = time.perf_counter()
+        with get_usage_metadata_callback() as callback:
+            result = await build(model).ainvoke(prompt)
+        usage = next(iter(callback.usage_metadata.values()), {})
+        metrics.record_llm(model, usage, time.perf_counter() - start)
+        return result, usage
+
+    def invoke(
+        self,
+        build,
+        prompt,
+        priority: int | None = None,
+        models: list[str] | None = None,
+    ):
+        """Run `build(model).invoke(prompt)` on the first model with budget for it.
+
+        `priority` defaults to the turn's, see `turn_priority`. `models`
+        replaces the fallback order, e.g. to call one model only.
+        """
+        priority = turn_priority.get() if priority is None else priority
+        models = models or self.models
+        if not self.enabled:
+            return self._call(build, models[0], prompt)[0]
+        tokens = self.estimate(prompt)
+        for model, budget in self._candidates(models):
+            if budget is None:
+                return self._call(build, model, prompt)[0]
+            if not self.acquire(budget, tokens, priority):
+                continue
+            usage = {}
+            try:
+                result, usage = self._call(build, model, prompt)
+                return result
+            except RateLimitError as e:
+                # a rejected call used nothing, hand the reservation back
+                usage = {"total_tokens": 0}
+                self._rate_limited(budget, e)
+            finally:
+                self._settle(budget, tokens, usage)
+        raise self._exhausted()
+
+    async def ainvoke(
+        self,
+        build,
+        prompt,
+        priority: int | None = None,
+        models: list[str] | None = None,
+    ):
+        priority = turn_priority.get() if priority is None else priority
+        models = models or self.models
+        if not self.enabled:
+            return (await self._acall(build, models[0], prompt))[0]
+        tokens = self.estimate(prompt)
+        for model, budget in self._candidates(models):
+            if budget is None:
+                return (await self._acall(build, model, prompt))[0]
+            if not await self.aacquire(budget, tokens, priority):
+                continue
+            usage = {}
+            try:
+                result, usage = await self._acall(build, model, prompt)
+                return result
+            except RateLimitError as e:
+                # a rejected call used nothing, hand the reservation back
+                usage = {"total_tokens": 0}
+                self._rate_limited(budget, e)
+            finally:
+                self._settle(budget, tokens, usage)
+        raise self._exhausted()
+
+    def state(self) -> dict:
+        now = time.monotonic()
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "models": {
+                    model: budget.state(now) for model, budget in self.budgets.items()
+                },
+                "fallbacks": self.fallbacks,
+                "exhausted": self.exhausted,
+            }
+
+
+llm_scheduler = LLMScheduler()
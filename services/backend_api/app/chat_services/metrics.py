@@ -0,0 +1,341 @@
+import contextvars
+import json
+import random
+import threading
+import time
+from bisect import bisect_left
+from collections import defaultdict
+from contextlib import suppress
+
+from app.config import Config
+
+PREFIX = "sql_agent"
+SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+TOKEN_BUCKETS = (50, 100, 250, 500, 1000, 2000, 4000, 8000, 16000)
+ROW_BUCKETS = (0, 1, 10, 100, 1000, 10000, 100000)
+
+HISTOGRAMS = {
+    "node_duration_seconds": ("Wall time of one graph node.", SECONDS_BUCKETS),
+    "turn_duration_seconds": ("Wall time of one chat turn.", SECONDS_BUCKETS),
+    "turn_first_token_seconds": (
+        "Time to the first streamed answer token.",
+        SECONDS_BUCKETS,
+    ),
+    "llm_duration_seconds": ("Wall time of one LLM call.", SECONDS_BUCKETS),
+    "llm_prompt_tokens": ("Prompt tokens of one LLM call.", TOKEN_BUCKETS),
+    "llm_completion_tokens": ("Completion tokens of one LLM call.", TOKEN_BUCKETS),
+    "sql_execution_seconds": ("Database time of one executed query.", SECONDS_BUCKETS),
+    "sql_rows": ("Rows returned by one executed query.", ROW_BUCKETS),
+}
+COUNTERS = {
+    "node_errors_total": "Graph nodes that raised.",
+    "sql_retries_total": "write_query runs that retry a failed query.",
+    "turns_total": "Chat turns served.",
+    "slow_turns_total": "Turns slower than SLOW_TURN_SECONDS.",
+}
+
+# the node running in this context, LLM calls are attributed to it
+current_node: contextvars.ContextVar[str] = contextvars.ContextVar(
+    "current_node", default=""
+)
+# per-turn trace for the slow-turn log
+current_turn: contextvars.ContextVar["TurnTrace | None"] = contextvars.ContextVar(
+    "current_turn", default=None
+)
+
+
+class Histogram:
+    def __init__(self, buckets: tuple):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # the last one is +Inf
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+
+class TurnTrace:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.events: list[dict] = []
+        self.token: contextvars.Token | None = None
+
+    def node(self, name: str, seconds: float):
+        self.events.append({"node": name, "ms": round(seconds * 1000, 1)})
+
+    def llm(self, node: str, model: str, prompt_tokens: int, completion_tokens: int):
+        self.events.append(
+            {
+                "llm": node,
+                "model": model,
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+            }
+        )
+
+
+def escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def labels_text(labels: tuple) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{escape(value)}"' for key, value in labels) + "}"
+
+
+class Metrics:
+    """In-process histograms and counters, rendered in the Prometheus text format.
+
+    Recording is a dict lookup and a bisect under one lock, cheap next to any
+    LLM or database call. Each worker process keeps its own numbers, scrape
+    every worker or run a single one.
+    """
+
+    def __init__(self):
+        self.histograms: dict[tuple, Histogram] = {}
+        self.counters: dict[tuple, float] = defaultdict(float)
+        self._lock = threading.Lock()
+
+    def observe(self, name: str, value: float, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram(HISTOGRAMS[name][1])
+            histogram.observe(value)
+
+    def inc(self, name: str, value: float = 1, **labels):
+        with self._lock:
+            self.counters[(name, tuple(sorted(labels.items())))] += value
+
+    def record_node(self, name: str, state, update, seconds: float):
+        self.observe("node_duration_seconds", seconds, node=name)
+        if name == "write_query" and state.sql_error_count:
+            self.inc("sql_retries_total")
+        turn = current_turn.get()
+        if turn is not None:
+            turn.node(name, seconds)
+
+    def record_llm(self, model: str, usage: dict, seconds: float):
+        node = current_node.get() or "other"
+        self.observe("llm_duration_seconds", seconds, node=node, model=model)
+        prompt_tokens = usage.get("input_tokens", 0)
+        completion_tokens = usage.get("output_tokens", 0)
+        if usage:
+            self.observe("llm_prompt_tokens", prompt_tokens, node=node)
+            self.observe("llm_completion_tokens", completion_tokens, node=node)
+        turn = current_turn.get()
+        if turn is not None:
+            turn.llm(node, model, prompt_tokens, completion_tokens)
+
+    def record_sql(self, seconds: float, rows: int):
+        self.observe("sql_execution_seconds", seconds)
+        self.observe("sql_rows", rows)
+
+    def start_turn(self) -> TurnTrace:
+        turn = TurnTrace()
+        turn.token = current_turn.set(turn)
+        return turn
+
+    def finish_turn(
+        self, turn: TurnTrace, message: str, first_token_seconds: float | None = None
+    ):
+        """Record the turn and log it when it was slow or sampled."""
+        # a stream closed from another task cannot reset, its context goes with it
+        with suppress(ValueError):
+            current_turn.reset(turn.token)
+        seconds = time.perf_counter() - turn.started
+        self.inc("turns_total")
+        self.observe("turn_duration_seconds", seconds)
+        if first_token_seconds is not None:
+            self.observe("turn_first_token_seconds", first_token_seconds)
+
+        slow = seconds >= Config.SLOW_TURN_SECONDS
+        if slow:
+            self.inc("slow_turns_total")
+        elif random.random() >= Config.SLOW_TURN_SAMPLE_RATE:
+            return
+        self._log_turn(
+            {
+                "at": time.time(),
+                "slow": slow,
+                "total_ms": round(seconds * 1000, 1),
+                "message": message[:200],
+                "trace": turn.events,
+            }
+        )
+
+    def _log_turn(self, record: dict):
+        line = json.dumps(record)
+        if not Config.SLOW_TURN_LOG_PATH:
+            print(f"🐢 {line}")
+            return
+        with self._lock, open(Config.SLOW_TURN_LOG_PATH, "a") as log:
+            log.write(line + "\n")
+
+    def render(self, service: list[tuple[str, str, dict, float]] = ()) -> str:
+        """Everything recorded plus `(name, type, labels, value)` read at scrape time."""
+        lines = []
+        with self._lock:
+            histograms = sorted(self.histograms.items())
+            counters = sorted(self.counters.items())
+            histograms = [
+                (key, histogram.buckets, list(histogram.counts), histogram.sum)
+                for key, histogram in histograms
+            ]
+
+        typed = set()
+        for (name, labels), buckets, counts, total in histograms:
+            metric = f"{PREFIX}_{name}"
+            if name not in typed:
+                typed.add(name)
+                lines.append(f"# HELP {metric} {HISTOGRAMS[name][0]}")
+                lines.append(f"# TYPE {metric} histogram")
+            cumulative = 0
+            for bound, count in zip((*buckets, "+Inf"), counts, strict=True):
+                cumulative += count
+                text = labels_text((*labels, ("le", bound)))
+                lines.append(f"{metric}_bucket{text} {cumulative}")
+            lines.append(f"{metric}_sum{labels_text(labels)} {total}")
+            lines.append(f"{metric}_count{labels_text(labels)} {cumulative}")
+
+        for (name, labels), value in counters:
+            metric = f"{PREFIX}_{name}"
+            if name not in typed:
+                typed.add(name)
+                lines.append(f"# HELP {metric} {COUNTERS[name]}")
+                lines.append(f"# TYPE {metric} counter")
+            lines.append(f"{metric}{labels_text(labels)} {value}")
+
+        # a metric's samples have to be contiguous, keep each name's first place
+        order = {name: i for i, name in enumerate(dict.fromkeys(m[0] for m in service))}
+        for name, kind, labels, value in sorted(service, key=lambda m: order[m[0]]):
+            if value is None:
+                continue
+            metric = f"{PREFIX}_{name}"
+            if name not in typed:
+                typed.add(name)
+                lines.append(f"# TYPE {metric} {kind}")
+            lines.append(f"{metric}{labels_text(tuple(labels.items()))} {value}")
+        return "\n".join(lines) + "\n"
+
+
+def instrument(name: str, func, afunc):
+    """Wrap a node's sync and async functions to time them and attribute LLM calls."""
+
+    def run(state):
+        token = current_node.set(name)
+        start = time.perf_counter()
+        try:
+            update = func(state)
+        except Exception:
+            metrics.inc("node_errors_total", node=name)
+            raise
+        finally:
+            current_node.reset(token)
+        metrics.record_node(name, state, update, time.perf_counter() - start)
+        return update
+
+    async def arun(state):
+        token = current_node.set(name)
+        start = time.perf_counter()
+        try:
+            update = await afunc(state)
+        except Exception:
+            metrics.inc("node_errors_total", node=name)
+            raise
+        finally:
+            current_node.reset(token)
+        metrics.record_node(name, state, update, time.perf_counter() - start)
+        return update
+
+    return run, arun
+
+
+def service_metrics(agent, chat_service) -> list[tuple[str, str, dict, float]]:
+    """Numbers the components already keep, read at scrape time.
+
+    Running totals such as hits and wins are counters, ratios, sizes, queue
+    depths and bucket levels are gauges.
+    """
+    gauges, counters = [], []
+
+    def gauge(name: str, value, **labels):
+        gauges.append((name, "gauge", labels, value))
+
+    def counter(name: str, value, **labels):
+        counters.append((f"{name}_total", "counter", labels, value))
+
+    if agent.query_cache is not None:
+        stats = agent.query_cache.stats()
+        gauge("query_cache_hit_rate", stats["hit_rate"])
+        gauge("query_cache_entries", stats["entries"])
+        counter("query_cache_hits", stats["exact_hits"], match="exact")
+        counter("query_cache_hits", stats["similar_hits"], match="similar")
+        counter("query_cache_misses", stats["misses"])
+    if agent.result_cache is not None:
+        stats = agent.result_cache.stats()
+        gauge("result_cache_hit_rate", stats["hit_rate"])
+        gauge("result_cache_entries", stats["entries"])
+        counter("result_cache_hits", stats["hits"], scope="local")
+        counter("result_cache_hits", stats["shared_hits"], scope="shared")
+        counter("result_cache_misses", stats["misses"])
+
+    figures = agent.chart_renderer.stats()
+    gauge("figure_cache_hit_rate", figures["hit_rate"])
+    counter("figure_cache_hits", figures["hits"])
+    counter("figure_cache_misses", figures["misses"])
+    if agent.rollup_rewriter is not None:
+        rollups = agent.rollup_rewriter.stats()
+        gauge("rollup_hit_rate", rollups["hit_rate"])
+        counter("rollup_checked", rollups["checked"])
+        counter("rollup_rewritten", rollups["rewritten"])
+        counter("rollup_fallbacks", rollups["fallbacks"])
+    if agent.text_retriever is not None:
+        search = agent.text_retriever.stats()
+        gauge("text_search_hit_rate", search["hit_rate"])
+        counter("text_searches", search["searches"])
+        counter("text_search_hits", search["hits"])
+    pre_router = agent.pre_router.stats()
+    gauge("pre_router_fast_path_rate", pre_router["fast_path_rate"])
+    for label, precision in pre_router["fallthrough_precision"].items():
+        gauge("pre_router_precision", precision, label=label)
+    for label, turns in pre_router["routed"].items():
+        counter("pre_router_turns", turns, route=label)
+    gauge("schema_pruning_saved_ratio", agent.schema_retriever.stats()["saved_ratio"])
+    for node, stats in agent.history_metrics.stats().items():
+        gauge("history_saved_ratio", stats["saved_ratio"], scope=node)
+    if chat_service.memory is not None:
+        for scope, stats in chat_service.memory.metrics.stats().items():
+            gauge("history_saved_ratio", stats["saved_ratio"], scope=scope)
+
+    for scope, inflight in (
+        ("question", chat_service.inflight_questions),
+        ("sql", agent.inflight_sql),
+    ):
+        stats = inflight.stats()
+        gauge("inflight_shared_rate", stats["shared_rate"], scope=scope)
+        gauge("inflight_running", stats["in_flight"], scope=scope)
+        counter("inflight_shared", stats["shared"], scope=scope)
+
+    if agent.sql_race is not None:
+        race = agent.sql_race.stats()
+        counter("sql_races", race["races"])
+        counter("sql_race_failed", race["failed"])
+        counter("sql_race_cancelled", race["cancelled"])
+        for candidate, wins in race["wins"].items():
+            counter("sql_race_wins", wins, candidate=candidate)
+
+    budget = agent.scheduler.state()
+    counter("llm_fallbacks", budget["fallbacks"])
+    counter("llm_budget_exhausted", budget["exhausted"])
+    for model, stats in budget["models"].items():
+        for key in ("minute_available", "day_available", "queued"):
+            gauge(f"llm_budget_{key}", stats[key], model=model)
+        counter("llm_rate_limited", stats["rate_limited"], model=model)
+    return gauges + counters
+
+
+metrics = Metrics()
@@ -0,0 +1,127 @@
+import re
+from collections import Counter
+
+from app.chat_services.schema_retriever import SchemaRetriever
+from app.config import Config
+
+CHIT_CHAT = "chit_chat"
+OUT_OF_POLICY = "out_of_policy"
+DATA = "data"
+
+# greetings, farewells, thanks and small talk
+CHIT_CHAT_WORDS = set(
+    """
+    hi hello hey hiya yo howdy greetings morning afternoon evening good bye goodbye
+    later night care thank thanks thx ty appreciate appreciated cheers great awesome
+    cool nice ok okay sure perfect got how are you doing whats up who your is im
+    fine well bot assistant there everyone again see so very much a lot for it that
+    all take i
+    """.split()
+)
+OFF_TOPIC_WORDS = set(
+    """
+    weather joke jokes poem song story recipe movie movies politics election
+    president bitcoin crypto translate homework football soccer horoscope news
+    """.split()
+)
+# a bare acknowledgement after an answer usually accepts its follow-up offer
+ACKNOWLEDGEMENT_WORDS = set(
+    """
+    ok okay sure yes yeah yep yup please go ahead do it that one alright right fine
+    sounds good great perfect
+    """.split()
+)
+# words that carry no topic, they count towards the off-topic rule
+FILLER_WORDS = set(
+    """
+    a an the me my i you your please can could tell write give about what is in of
+    on for today some to do will would it be and or
+    """.split()
+)
+# analytic wording means a data question even without a schema term
+DATA_WORDS = set(
+    """
+    many total sum average avg count top most least highest lowest list show compare
+    trend revenue sold sell sale sales spend spent per by chart plot graph visualise
+    visualize percentage share rank
+    """.split()
+)
+
+
+def words(text: str) -> list[str]:
+    return re.findall(r"[a-z0-9]+", text.lower().replace("'", ""))
+
+
+class PreRouter:
+    """Keyword rules that route obvious chit-chat and off-topic turns ahead of write_query.
+
+    A turn with any schema term, value or analytic word is a data question and
+    always goes to write_query. Otherwise the confidence of a rule is the share
+    of the message's words its vocabulary explains, and only a confidence at or
+    above `threshold` skips the LLM router.
+
+    Turns that fall through keep the rule's guess in `State.pre_route` so
+    write_query can record whether the LLM agreed, which is the live precision
+    estimate in `stats()`.
+    """
+
+    def __init__(
+        self, schema_retriever: SchemaRetriever, threshold: float | None = None
+    ):
+        self.schema_retriever = schema_retriever
+        self.threshold = Config.PRE_ROUTER_THRESHOLD if threshold is None else threshold
+        self.max_words = Config.PRE_ROUTER_MAX_WORDS
+        self.routed: Counter = Counter()
+        self.agreed: Counter = Counter()
+        self.disagreed: Counter = Counter()
+
+    def classify(self, message: str, follow_up: bool = False) -> tuple[str, float]:
+        """The rule's label and confidence, `follow_up` when earlier turns exist."""
+        tokens = words(message)
+        if not tokens or len(tokens) > self.max_words:
+            return DATA, 0.0
+        if follow_up and all(token in ACKNOWLEDGEMENT_WORDS for token in tokens):
+            # "sure" may accept a chart or a drill-down, only the LLM sees the history
+            return CHIT_CHAT, 0.0
+        if DATA_WORDS & set(tokens) or any(token.isdigit() for token in tokens):
+            return DATA, 1.0
+        if self.schema_retriever.select_tables(message):
+            return DATA, 1.0
+
+        off_topic = sum(token in OFF_TOPIC_WORDS for token in tokens)
+        if off_topic:
+            explained = sum(
+                token in OFF_TOPIC_WORDS or token in FILLER_WORDS for token in tokens
+            )
+            return OUT_OF_POLICY, explained / len(tokens)
+        chit_chat = sum(token in CHIT_CHAT_WORDS for token in tokens)
+        return CHIT_CHAT, chit_chat / len(tokens)
+
+    def route(self, message: str, follow_up: bool = False) -> tuple[str, bool]:
+        """The rule's label and whether it is confident enough to skip the LLM."""
+        label, confidence = self.classify(message, follow_up)
+        confident = label != DATA and confidence >= self.threshold
+        self.routed[label if confident else "llm"] += 1
+        return label, confident
+
+    def record(self, guess: str, llm_label: str):
+        """Compare a fall-through guess with the LLM router's decision."""
+        if not guess:
+            return
+        if guess == llm_label:
+            self.agreed[guess] += 1
+        else:
+            self.disagreed[guess] += 1
+
+    def stats(self) -> dict:
+        total = sum(self.routed.values())
+        precision = {}
+        for label in (CHIT_CHAT, OUT_OF_POLICY, DATA):
+            checked = self.agreed[label] + self.disagreed[label]
+            precision[label] = self.agreed[label] / checked if checked else None
+        return {
+            "turns": total,
+            "routed": dict(self.routed),
+            "fast_path_rate": (total - self.routed["llm"]) / total if total else 0.0,
+            "fallthrough_precision": precision,
+        }
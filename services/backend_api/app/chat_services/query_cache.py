@@ -0,0 +1,200 @@
+import math
+import re
+import threading
+import time
+from collections import Counter, OrderedDict
+from dataclasses import dataclass, field
+
+from app.config import Config
+from app.models.chat_models import QueryOutput
+
+NGRAM_SIZE = 3
+# question wording that does not change the SQL, every other word must match.
+# words such as and/or, by, from/to or all/any change the query and are kept
+FILLER_WORDS = set(
+    """
+    a an the what which who whats is are was were do does did can could would will
+    you please me us our we i my show tell give list find get display see know
+    about of in on for at with much many there how want like need
+    """.split()
+)
+
+
+def normalize_question(question: str) -> str:
+    question = re.sub(r"[^\w\s]", " ", question.lower())
+    return " ".join(question.split())
+
+
+def key_terms(normalized: str) -> frozenset[str]:
+    """Words that name what is asked: entities, months, cities, products, numbers.
+
+    Plural "s" is cut so "products" and "product" agree.
+    """
+    return frozenset(
+        w[:-1] if len(w) > 3 and w.endswith("s") else w
+        for w in normalized.split()
+        if w not in FILLER_WORDS
+    )
+
+
+def char_ngrams(text: str, n: int = NGRAM_SIZE) -> Counter:
+    padded = f" {text} "
+    return Counter(padded[i : i + n] for i in range(max(len(padded) - n + 1, 1)))
+
+
+@dataclass
+class CacheEntry:
+    question: str
+    fingerprint: str
+    output: QueryOutput
+    ngrams: Counter
+    terms: frozenset[str]
+    created_at: float = field(default_factory=time.monotonic)
+
+
+class QueryCache:
+    """NL-to-SQL cache in front of `Agent.write_query`.
+
+    Entries are keyed by the normalized question and the schema fingerprint.
+    A lookup first tries an exact match, then the most similar cached question
+    by TF-IDF weighted character n-gram cosine similarity. A similar question
+    only matches if all its words apart from question filler are the same, so
+    "top 5 franchises" never reuses the SQL written for "top 10 franchises"
+    and "sales in May" never the SQL for "sales in March". Similar matching
+    is off with `QUERY_CACHE_SIMILARITY_ENABLED=false`.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = Config.QUERY_CACHE_MAX_ENTRIES,
+        ttl_seconds: float = Config.QUERY_CACHE_TTL_SECONDS,
+        similarity_threshold: float = Config.QUERY_CACHE_SIMILARITY,
+        similar_matches: bool = Config.QUERY_CACHE_SIMILARITY_ENABLED,
+    ):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.similarity_threshold = similarity_threshold
+        self.similar_matches = similar_matches
+        self._entries: OrderedDict[tuple[str, str], CacheEntry] = OrderedDict()
+        self._document_frequency: Counter = Counter()
+        self._lock = threading.Lock()
+        self.exact_hits = 0
+        self.similar_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, question: str, fingerprint: str) -> QueryOutput | None:
+        normalized = normalize_question(question)
+        with self._lock:
+            self._expire()
+            entry = self._entries.get((normalized, fingerprint))
+            if entry is not None:
+                self._entries.move_to_end((normalized, fingerprint))
+                self.exact_hits += 1
+                return entry.output
+
+            entry = (
+                self._most_similar(normalized, fingerprint)
+                if self.similar_matches
+                else None
+            )
+            if entry is not None:
+                self._entries.move_to_end((entry.question, fingerprint))
+                self.similar_hits += 1
+                return entry.output
+
+            self.misses += 1
+            return None
+
+    def put(self, question: str, fingerprint: str, output: QueryOutput):
+        normalized = normalize_question(question)
+        key = (normalized, fingerprint)
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            entry = CacheEntry(
+                question=normalized,
+                fingerprint=fingerprint,
+                output=output,
+                ngrams=char_ngrams(normalized),
+                terms=key_terms(normalized),
+            )
+            self._entries[key] = entry
+            self._document_frequency.update(entry.ngrams.keys())
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def invalidate_sql(self, sql_query: str) -> int:
+        """Drop every entry that produced `sql_query`, e.g. after it failed to run."""
+        with self._lock:
+            keys = [
+                key
+                for key, entry in self._entries.items()
+                if entry.output.generated_sql_query.strip() == sql_query.strip()
+            ]
+            for key in keys:
+                self._remove(key)
+            self.invalidations += len(keys)
+            return len(keys)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._document_frequency.clear()
+
+    def stats(self) -> dict:
+        hits = self.exact_hits + self.similar_hits
+        total = hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "exact_hits": self.exact_hits,
+            "similar_hits": self.similar_hits,
+            "misses": self.misses,
+            "hit_rate": hits / total if total else 0.0,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+        }
+
+    def _remove(self, key):
+        entry = self._entries.pop(key)
+        for gram in entry.ngrams:
+            self._document_frequency[gram] -= 1
+            if self._document_frequency[gram] <= 0:
+                del self._document_frequency[gram]
+
+    def _expire(self):
+        now = time.monotonic()
+        expired = [
+            key
+            for key, entry in self._entries.items()
+            if now - entry.created_at > self.ttl_seconds
+        ]
+        for key in expired:
+            self._remove(key)
+            self.evictions += 1
+
+    def _weights(self, ngrams: Counter) -> dict[str, float]:
+        n_docs = len(self._entries) + 1
+        weights = {
+            gram: count
+            * (math.log(n_docs / (1 + self._document_frequency.get(gram, 0))) + 1)
+            for gram, count in ngrams.items()
+        }
+        norm = math.sqrt(sum(w * w for w in weights.values())) or 1.0
+        return {gram: w / norm for gram, w in weights.items()}
+
+    def _most_similar(self, normalized: str, fingerprint: str) -> CacheEntry | None:
+        query = self._weights(char_ngrams(normalized))
+        terms = key_terms(normalized)
+        best, best_score = None, self.similarity_threshold
+        for entry in self._entries.values():
+            # n-grams barely tell "may" from "march", the words have to agree
+            if entry.fingerprint != fingerprint or entry.terms != terms:
+                continue
+            candidate = self._weights(entry.ngrams)
+            score = sum(w * candidate.get(gram, 0.0) for gram, w in query.items())
+            if score >= best_score:
+                best, best_score = entry, score
+        return best
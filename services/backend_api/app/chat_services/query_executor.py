@@ -0,0 +1,137 @@
+from app.chat_services.sql_guard import prepare_read_only
+from app.config import Config
+from app.models.query_result import QueryResult, dtype_of, to_python
+from sqlalchemy import text
+
+
+def unique_columns(columns) -> list[str]:
+    """Column names with repeats suffixed, `a, a` becomes `a, a_1`.
+
+    Results are stored by column name, a join selecting the same name twice
+    would otherwise merge both columns into one list.
+    """
+    unique, names = [], set(columns)
+    for column in columns:
+        name, n = column, 0
+        while name in unique or (n and name in names):
+            n += 1
+            name = f"{column}_{n}"
+        unique.append(name)
+    return unique
+
+
+class ResultBuilder:
+    """Collects streamed rows into a QueryResult until a row or byte cap is hit.
+
+    Past the caps rows are only counted (up to `count_limit`) so the result can
+    report how much was cut off without holding it in memory.
+    """
+
+    def __init__(
+        self, columns: list[str], max_rows: int, max_bytes: int, count_limit: int
+    ):
+        self.columns = unique_columns(columns)
+        self.max_rows = max_rows
+        self.max_bytes = max_bytes
+        self.count_limit = count_limit
+        self.data: dict[str, list] = {column: [] for column in self.columns}
+        self.dtypes: dict[str, str] = {}
+        self.kept = 0
+        self.seen = 0
+        self.byte_count = 0
+        self.full = False
+
+    def add(self, rows) -> bool:
+        """Add a batch of rows, returns False once there is no need to read more."""
+        for row in rows:
+            self.seen += 1
+            if self.full:
+                continue
+            size = sum(len(str(value)) for value in row)
+            if self.kept >= self.max_rows or self.byte_count + size > self.max_bytes:
+                self.full = True
+                continue
+            for column, value in zip(self.columns, row, strict=True):
+                if value is not None and column not in self.dtypes:
+                    self.dtypes[column] = dtype_of(value)
+                self.data[column].append(to_python(value))
+            self.kept += 1
+            self.byte_count += size
+        return self.seen < self.count_limit
+
+    def build(self, exhausted: bool) -> QueryResult:
+        return QueryResult(
+            columns=self.columns,
+            dtypes={column: self.dtypes.get(column, "str") for column in self.columns},
+            data=self.data,
+            row_count=self.kept,
+            total_rows=self.seen,
+            total_rows_exact=exhausted,
+            byte_count=self.byte_count,
+            truncated=self.kept < self.seen or not exhausted,
+        )
+
+
+class QueryExecutor:
+    """Runs SQL through a server-side cursor and returns a bounded QueryResult.
+
+    Every query runs in a read-only transaction with a statement timeout.
+
+    Raises the SQLAlchemy error on failure, callers turn it into
+    `sql_query_error` for the retry loop.
+    """
+
+    def __init__(self, engine, async_engine=None):
+        self.engine = engine
+        self.async_engine = async_engine
+        self.max_rows = Config.RESULT_MAX_ROWS
+        self.max_bytes = Config.RESULT_MAX_BYTES
+        self.count_limit = Config.RESULT_COUNT_LIMIT
+        self.fetch_size = Config.RESULT_FETCH_SIZE
+        self.timeout_ms = Config.STATEMENT_TIMEOUT_MS
+
+    def _builder(self, columns) -> ResultBuilder:
+        return ResultBuilder(columns, self.max_rows, self.max_bytes, self.count_limit)
+
+    def run(self, sql_query: str) -> QueryResult:
+        with self.engine.connect() as conn:
+            cleanup = prepare_read_only(conn, self.timeout_ms)
+            try:
+                result = conn.execution_options(
+                    stream_results=True, max_row_buffer=self.fetch_size
+                ).execute(text(sql_query))
+                if not result.returns_rows:
+                    return QueryResult()
+
+                builder = self._builder(result.keys())
+                exhausted = True
+                for rows in result.partitions(self.fetch_size):
+                    if not builder.add(rows):
+                        exhausted = False
+                        break
+                result.close()
+            finally:
+                conn.rollback()
+                if cleanup:
+                    conn.execute(text(cleanup))
+                    conn.commit()
+        return builder.build(exhausted)
+
+    async def arun(self, sql_query: str) -> QueryResult:
+        async with self.async_engine.connect() as conn:
+            cleanup = await conn.run_sync(prepare_read_only, self.timeout_ms)
+            try:
+                result = await conn.stream(text(sql_query))
+                builder = self._builder(result.keys())
+                exhausted = True
+                async for rows in result.partitions(self.fetch_size):
+                    if not builder.add(rows):
+                        exhausted = False
+                        break
+                await result.close()
+            finally:
+                await conn.rollback()
+                if cleanup:
+                    await conn.execute(text(cleanup))
+                    await conn.commit()
+        return builder.build(exhausted)
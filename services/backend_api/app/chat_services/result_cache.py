@@ -0,0 +1,200 @@
+import asyncio
+import hashlib
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from app.config import Config
+from app.models.query_result import QueryResult
+
+# quoted literals and identifiers are case sensitive, keep them as they are
+QUOTED = re.compile(r"('(?:[^']|'')*'|\"(?:[^\"]|\"\")*\")")
+
+
+def canonical_sql(sql_query: str) -> str:
+    parts = QUOTED.split(sql_query.strip().rstrip(";"))
+    return "".join(
+        part if i % 2 else re.sub(r"\s+", " ", part.lower())
+        for i, part in enumerate(parts)
+    ).strip()
+
+
+class SqliteResultBackend:
+    """Result store in a SQLite file, shared by every uvicorn worker on the host."""
+
+    def __init__(self, path: str, max_bytes: int):
+        self.path = path
+        self.max_bytes = max_bytes
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS query_results (
+                    key TEXT PRIMARY KEY,
+                    value BLOB NOT NULL,
+                    size INTEGER NOT NULL,
+                    accessed_at REAL NOT NULL
+                )
+                """
+            )
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=5)
+
+    def get(self, key: str) -> bytes | None:
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT value FROM query_results WHERE key = ?", (key,)
+            ).fetchone()
+            if row is not None:
+                conn.execute(
+                    "UPDATE query_results SET accessed_at = ? WHERE key = ?",
+                    (time.time(), key),
+                )
+        return row[0] if row else None
+
+    def put(self, key: str, value: bytes):
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO query_results VALUES (?, ?, ?, ?)",
+                (key, value, len(value), time.time()),
+            )
+            # evict least recently used rows until the file is back under budget
+            conn.execute(
+                """
+                DELETE FROM query_results WHERE key IN (
+                    SELECT key FROM (
+                        SELECT key, SUM(size) OVER (ORDER BY accessed_at DESC) AS running
+                        FROM query_results
+                    ) WHERE running > ?
+                )
+                """,
+                (self.max_bytes,),
+            )
+
+
+class ResultCache:
+    """Cache of query results for `Agent.execute_query`.
+
+    Keyed by the canonical SQL (whitespace and case normalized outside quoted
+    literals) plus the data version the loader publishes, so a reload makes
+    every older entry unreachable. Results are held as JSON in a local LRU
+    bounded by `max_bytes`, and optionally in a shared backend that other
+    workers read. The async methods run the backend's file IO in a thread.
+    """
+
+    def __init__(
+        self,
+        max_bytes: int = Config.RESULT_CACHE_MAX_BYTES,
+        backend: SqliteResultBackend | None = None,
+    ):
+        self.max_bytes = max_bytes
+        self.backend = backend
+        self.size = 0
+        self._entries: OrderedDict[str, bytes] = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @classmethod
+    def from_config(cls) -> "ResultCache":
+        backend = None
+        if Config.RESULT_CACHE_SHARED_PATH:
+            backend = SqliteResultBackend(
+                Config.RESULT_CACHE_SHARED_PATH, Config.RESULT_CACHE_SHARED_MAX_BYTES
+            )
+        return cls(backend=backend)
+
+    @staticmethod
+    def make_key(sql_query: str, data_version: int) -> str:
+        canonical = canonical_sql(sql_query)
+        return hashlib.sha256(f"{data_version}:{canonical}".encode()).hexdigest()
+
+    def contains(self, sql_query: str, data_version: int) -> bool:
+        """Whether the local cache holds the result, without touching the stats."""
+        return self.make_key(sql_query, data_version) in self._entries
+
+    def _local(self, key: str) -> QueryResult | None:
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+        return QueryResult.model_validate_json(value)
+
+    def _shared(self, key: str, value: bytes | None) -> QueryResult | None:
+        with self._lock:
+            if value is None:
+                self.misses += 1
+                return None
+            self.shared_hits += 1
+            self._store(key, value)
+        return QueryResult.model_validate_json(value)
+
+    def get(self, sql_query: str, data_version: int) -> QueryResult | None:
+        key = self.make_key(sql_query, data_version)
+        result = self._local(key)
+        if result is not None:
+            return result
+        return self._shared(key, self.backend.get(key) if self.backend else None)
+
+    async def aget(self, sql_query: str, data_version: int) -> QueryResult | None:
+        key = self.make_key(sql_query, data_version)
+        result = self._local(key)
+        if result is not None:
+            return result
+        value = await asyncio.to_thread(self.backend.get, key) if self.backend else None
+        return self._shared(key, value)
+
+    def _put_local(self, key: str, result: QueryResult) -> bytes | None:
+        value = result.model_dump_json().encode()
+        if len(value) > self.max_bytes:
+            return None
+        with self._lock:
+            self._store(key, value)
+        return value
+
+    def put(self, sql_query: str, data_version: int, result: QueryResult):
+        key = self.make_key(sql_query, data_version)
+        value = self._put_local(key, result)
+        if value is not None and self.backend:
+            self.backend.put(key, value)
+
+    async def aput(self, sql_query: str, data_version: int, result: QueryResult):
+        key = self.make_key(sql_query, data_version)
+        value = self._put_local(key, result)
+        if value is not None and self.backend:
+            await asyncio.to_thread(self.backend.put, key, value)
+
+    def _store(self, key: str, value: bytes):
+        if key in self._entries:
+            self.size -= len(self._entries.pop(key))
+        self._entries[key] = value
+        self.size += len(value)
+        while self.size > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self.size -= len(evicted)
+            self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+    def stats(self) -> dict:
+        hits = self.hits + self.shared_hits
+        total = hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "bytes": self.size,
+            "hits": self.hits,
+            "shared_hits": self.shared_hits,
+            "misses": self.misses,
+            "hit_rate": hits / total if total else 0.0,
+            "evictions": self.evictions,
+        }
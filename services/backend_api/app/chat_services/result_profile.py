@@ -0,0 +1,145 @@
+import re
+
+import pandas as pd
+from app.config import Config
+from app.models.query_result import QueryResult
+
+QUANTILES = [0.05, 0.25, 0.5, 0.75, 0.95]
+
+
+def needs_profile(result: QueryResult | None) -> bool:
+    if result is None or not result.columns:
+        return False
+    return (
+        result.row_count > Config.PROFILE_ROW_THRESHOLD
+        or result.byte_count > Config.PROFILE_BYTE_THRESHOLD
+    )
+
+
+def _format(value) -> str:
+    if isinstance(value, float):
+        if value.is_integer():
+            return f"{value:,.0f}"
+        return f"{value:,.2f}" if abs(value) >= 1000 else f"{value:.4g}"
+    return str(value)
+
+
+def _datetime_columns(frame: pd.DataFrame, result: QueryResult) -> dict[str, pd.Series]:
+    """Datetime columns, including text columns that parse as timestamps."""
+    columns = {}
+    for column in frame.columns:
+        series = frame[column]
+        if result.dtypes.get(column) in ("datetime", "date"):
+            columns[column] = pd.to_datetime(series, utc=True)
+        elif result.dtypes.get(column) == "str":
+            parsed = pd.to_datetime(series, errors="coerce", utc=True, format="ISO8601")
+            if parsed.notna().mean() > 0.9:
+                columns[column] = parsed
+    return columns
+
+
+def _bucket(span: pd.Timedelta) -> tuple[str, str]:
+    if span <= pd.Timedelta(days=2):
+        return "h", "hour"
+    if span <= pd.Timedelta(days=90):
+        return "D", "day"
+    if span <= pd.Timedelta(days=730):
+        return "W", "week"
+    return "M", "month"
+
+
+def profile_result(result: QueryResult) -> str:
+    """Statistical digest of a query result plus a small sample, for the LLM.
+
+    Every statistic is computed column-wise with pandas, no per-row Python.
+    """
+    frame = result.to_frame()
+    datetimes = _datetime_columns(frame, result)
+    # `_1` suffixed copies come from joins selecting the same id twice
+    identifiers = [c for c in frame.columns if re.search(r"(^|_)id(_\d+)?$", c.lower())]
+    numeric = frame.select_dtypes("number").drop(
+        columns=list(datetimes) + identifiers, errors="ignore"
+    )
+    categorical = [
+        column
+        for column in frame.columns
+        if column not in numeric.columns
+        and column not in datetimes
+        and column not in identifiers
+    ]
+
+    lines = [f"Result digest: {result.row_count} rows, {len(frame.columns)} columns"]
+    if result.truncated:
+        lines[0] += f" ({result.truncation_note()})"
+
+    if not numeric.empty:
+        lines.append("Numeric columns:")
+        stats = numeric.quantile(QUANTILES).T
+        summary = pd.DataFrame(
+            {
+                "min": numeric.min(),
+                "max": numeric.max(),
+                "mean": numeric.mean(),
+                "sum": numeric.sum(),
+            }
+        )
+        q1, q3 = stats[0.25], stats[0.75]
+        low, high = q1 - 1.5 * (q3 - q1), q3 + 1.5 * (q3 - q1)
+        outliers = (numeric.lt(low) | numeric.gt(high)).sum()
+        for column in numeric.columns:
+            row = summary.loc[column]
+            quantiles = ", ".join(
+                f"p{int(q * 100)}={_format(stats.at[column, q])}" for q in QUANTILES
+            )
+            line = (
+                f"- {column}: min={_format(row['min'])}, max={_format(row['max'])}, "
+                f"mean={_format(row['mean'])}, sum={_format(row['sum'])}, {quantiles}"
+            )
+            if outliers[column]:
+                line += (
+                    f", outliers={int(outliers[column])} "
+                    f"(outside {_format(low[column])}..{_format(high[column])})"
+                )
+            lines.append(line)
+
+    if identifiers:
+        distinct = frame[identifiers].nunique()
+        lines.append(
+            "Identifier columns: "
+            + ", ".join(f"{c} ({distinct[c]} distinct)" for c in identifiers)
+        )
+
+    if categorical:
+        lines.append("Categorical columns:")
+        for column in categorical:
+            counts = frame[column].value_counts()
+            top = ", ".join(
+                f"{value} ({count})"
+                for value, count in counts.head(Config.PROFILE_TOP_K).items()
+            )
+            lines.append(f"- {column}: {len(counts)} distinct, top: {top}")
+
+    for column, series in datetimes.items():
+        if series.isna().all():
+            continue
+        freq, name = _bucket(series.max() - series.min())
+        buckets = numeric.groupby(
+            series.dt.tz_localize(None).dt.to_period(freq).rename(column)
+        )
+        counts = buckets.size()
+        lines.append(
+            f"Time buckets for {column} by {name} "
+            f"({series.min():%Y-%m-%d %H:%M} to {series.max():%Y-%m-%d %H:%M}):"
+        )
+        sums = buckets.sum() if not numeric.empty else None
+        for period in counts.index[-Config.PROFILE_MAX_BUCKETS :]:
+            line = f"- {period}: rows={counts[period]}"
+            if sums is not None:
+                line += "".join(
+                    f", {c} sum={_format(sums.at[period, c])}" for c in sums.columns
+                )
+            lines.append(line)
+
+    lines.append(f"Sample rows (first {Config.PROFILE_SAMPLE_ROWS}):")
+    lines.append(result.to_text(Config.PROFILE_SAMPLE_ROWS))
+    return "\n".join(lines)
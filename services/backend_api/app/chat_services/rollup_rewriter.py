@@ -0,0 +1,467 @@
+import json
+import re
+import threading
+from collections import Counter
+
+import sqlglot
+from app.chat_services.schema_cache import SchemaCache
+from app.chat_services.sql_validator import DIALECTS
+from app.config import Config
+from sqlalchemy import inspect, text
+from sqlglot import exp
+from sqlglot.errors import ParseError, TokenError
+
+# clauses a rewritten query may keep, anything else (CTEs, windows, locks) is not tried
+SELECT_CLAUSES = {
+    "expressions",
+    "from_",
+    "joins",
+    "where",
+    "group",
+    "having",
+    "order",
+    "limit",
+    "offset",
+    "distinct",
+}
+# units that a date has as well as its timestamp
+DATE_UNITS = {
+    "YEAR",
+    "ISOYEAR",
+    "QUARTER",
+    "MONTH",
+    "WEEK",
+    "DAY",
+    "DOW",
+    "ISODOW",
+    "DOY",
+    "DAYOFWEEK",
+    "DAYOFYEAR",
+}
+DATE_LITERAL = re.compile(r"^\d{4}-\d{2}-\d{2}$")
+# strftime formats made of date fields only
+DATE_FORMAT = re.compile(r"^([^%]|%[YmdjwWUu%])*$")
+
+
+class Ineligible(Exception):
+    """A query the rollup cannot answer exactly, the message is the reason."""
+
+
+class RollupQuery:
+    """One parsed aggregate query matched against one rollup definition."""
+
+    def __init__(
+        self, rewriter: "RollupRewriter", select: exp.Select, definition: dict
+    ):
+        self.rewriter = rewriter
+        self.select = select
+        self.definition = definition
+        self.sources: dict[str, str] = {}  # alias -> table
+        self.inner_joins: list[str] = []
+        self.outputs: dict[
+            str, exp.Expression
+        ] = {}  # output name -> rewritten projection
+
+    def _table(self, table: exp.Expression) -> str:
+        if not isinstance(table, exp.Table) or table.args.get("db"):
+            raise Ineligible("table")
+        name = self.rewriter.name(table.this)
+        self.sources[self.rewriter.name(table.alias_or_name)] = name
+        return name
+
+    def _join(self, join: exp.Join):
+        table = self._table(join.this)
+        key = self.definition["joins"].get(table)
+        if key is None:
+            raise Ineligible("join")
+        side, kind = join.side.upper(), join.kind.upper()
+        if side == "LEFT" and not kind:
+            pass
+        elif not side and kind in ("", "INNER"):
+            if not self.definition["complete"].get(table):
+                raise Ineligible("join")
+            self.inner_joins.append(key)
+        else:
+            raise Ineligible("join")
+
+        using = [self.rewriter.name(c) for c in join.args.get("using") or []]
+        condition = join.args.get("on")
+        if using == [key] and condition is None:
+            return
+        if not isinstance(condition, exp.EQ):
+            raise Ineligible("join")
+        sides = [condition.this, condition.expression]
+        if not all(isinstance(side, exp.Column) for side in sides):
+            raise Ineligible("join")
+        resolved = {self._resolve(side) for side in sides}
+        if resolved != {f"{self.definition['base']}.{key}", f"{table}.{key}"}:
+            raise Ineligible("join")
+
+    def _resolve(self, column: exp.Column) -> str:
+        """The `table.column` a column reference reads."""
+        name = self.rewriter.name(column.this)
+        if column.table:
+            table = self.sources.get(self.rewriter.name(column.args["table"]))
+            if table is None:
+                raise Ineligible("column")
+            return f"{table}.{name}"
+        schema = self.rewriter.schema()
+        owners = [
+            table for table in self.sources.values() if name in schema.get(table, ())
+        ]
+        if len(owners) != 1:
+            raise Ineligible("column")
+        return f"{owners[0]}.{name}"
+
+    def _output_name(self, projection: exp.Expression) -> str:
+        """The column name the database gives an unaliased projection."""
+        if isinstance(projection, exp.Column):
+            return projection.name
+        if self.rewriter.dialect != "postgres":
+            # sqlite names a column after the expression text
+            return projection.sql(self.rewriter.dialect)
+        if isinstance(projection, exp.Cast):
+            return (
+                self._output_name(projection.this)
+                or projection.to.sql("postgres").lower()
+            )
+        match = re.match(r"(\w+)\s*\(", projection.sql("postgres"))
+        return match.group(1).lower() if match else "?column?"
+
+    def _rollup_column(self, name: str) -> exp.Column:
+        return exp.column(name, table="r")
+
+    def _dimension(self, column: exp.Column) -> exp.Column:
+        key = self._resolve(column)
+        if key not in self.definition["dimensions"]:
+            raise Ineligible(
+                "date_time" if key in self.definition["days"] else "column"
+            )
+        return self._rollup_column(self.definition["dimensions"][key])
+
+    def _measure(self, argument: exp.Expression) -> str:
+        if not isinstance(argument, exp.Column):
+            raise Ineligible("aggregate")
+        measure = self.definition["measures"].get(self._resolve(argument))
+        if measure is None:
+            raise Ineligible("aggregate")
+        return measure
+
+    def _count(self, column: str) -> exp.Expression:
+        # COUNT is 0 over no rows where SUM is NULL, and a bigint where SUM is numeric
+        total = exp.func("COALESCE", exp.Sum(this=self._rollup_column(column)), 0)
+        return exp.cast(total, "BIGINT")
+
+    def _aggregate(self, node: exp.AggFunc) -> exp.Expression:
+        argument = node.this
+        if isinstance(node, exp.Count):
+            if isinstance(argument, exp.Star) or (
+                isinstance(argument, exp.Literal) and not argument.is_string
+            ):
+                return self._count(self.definition["count"])
+            if isinstance(argument, exp.Distinct):
+                if len(argument.expressions) != 1:
+                    raise Ineligible("aggregate")
+                dimension = self._convert(argument.expressions[0])
+                return exp.Count(this=exp.Distinct(expressions=[dimension]))
+            if isinstance(argument, exp.Column):
+                key = self._resolve(argument)
+                if key in self.definition["measures"]:
+                    return self._count(f"{self.definition['measures'][key]}_count")
+                base, column = key.split(".")
+                if (
+                    base == self.definition["base"]
+                    and column in self.definition["not_null"]
+                ):
+                    return self._count(self.definition["count"])
+            raise Ineligible("aggregate")
+
+        if isinstance(node, (exp.Min, exp.Max)) and isinstance(argument, exp.Column):
+            key = self._resolve(argument)
+            if key in self.definition["dimensions"]:
+                return node.__class__(this=self._dimension(argument))
+        if isinstance(node, exp.Sum):
+            return exp.Sum(this=self._rollup_column(f"{self._measure(argument)}_sum"))
+        if isinstance(node, exp.Min):
+            return exp.Min(this=self._rollup_column(f"{self._measure(argument)}_min"))
+        if isinstance(node, exp.Max):
+            return exp.Max(this=self._rollup_column(f"{self._measure(argument)}_max"))
+        if isinstance(node, exp.Avg):
+            measure = self._measure(argument)
+            total = exp.Sum(this=self._rollup_column(f"{measure}_sum"))
+            count = exp.Sum(this=self._rollup_column(f"{measure}_count"))
+            return exp.Div(
+                this=exp.Mul(this=total, expression=exp.Literal.number("1.0")),
+                expression=exp.func("NULLIF", count, 0),
+                typed=True,  # kept as written, not cast to a float
+            )
+        raise Ineligible("aggregate")
+
+    def _day_column(self, node: exp.Expression) -> exp.Column | None:
+        """The rollup's day column for a timestamp column it keeps as a date."""
+        if not isinstance(node, exp.Column):
+            return None
+        day = self.definition["days"].get(self._resolve(node))
+        return None if day is None else self._rollup_column(day)
+
+    def _date_literal(self, node: exp.Expression) -> bool:
+        if isinstance(node, exp.Cast) and node.to.is_type("date"):
+            node = node.this
+        return isinstance(node, exp.Literal) and bool(DATE_LITERAL.match(node.this))
+
+    def _day(self, node: exp.Expression) -> exp.Expression | None:
+        """Rewrite a timestamp that only its date part is read from, None if not one."""
+        postgres = self.rewriter.dialect == "postgres"
+        if isinstance(node, exp.Date) and len(node.expressions) == 0:
+            return self._day_column(node.this)
+        if isinstance(node, exp.Cast) and node.to.is_type("date") and postgres:
+            # sqlite casts to a number, only postgres truncates
+            return self._day_column(node.this)
+        if isinstance(node, (exp.TimestampTrunc, exp.DateTrunc)):
+            unit = node.args.get("unit")
+            day = self._day_column(node.this)
+            if day is not None and unit is not None and unit.name.upper() in DATE_UNITS:
+                return node.__class__(this=day, unit=unit.copy())
+            return None
+        if isinstance(node, exp.Extract) and node.this.name.upper() in DATE_UNITS:
+            day = self._day_column(node.expression)
+            return (
+                None
+                if day is None
+                else exp.Extract(this=node.this.copy(), expression=day)
+            )
+        if isinstance(node, exp.TimeToStr) and isinstance(
+            node.this, exp.TsOrDsToTimestamp
+        ):
+            day = self._day_column(node.this.this)
+            if day is not None and DATE_FORMAT.match(node.args["format"].name):
+                return exp.TimeToStr(
+                    this=exp.TsOrDsToTimestamp(this=day),
+                    format=node.args["format"].copy(),
+                )
+            return None
+        # from midnight on a date up to midnight of a later one
+        if isinstance(node, (exp.GTE, exp.LT)) and self._date_literal(node.expression):
+            day = self._day_column(node.this)
+            if day is not None:
+                return node.__class__(this=day, expression=node.expression.copy())
+        if isinstance(node, (exp.LTE, exp.GT)) and self._date_literal(node.this):
+            day = self._day_column(node.expression)
+            if day is not None:
+                return node.__class__(this=node.this.copy(), expression=day)
+        return None
+
+    def _output_column(self, column: exp.Column, order: bool) -> bool:
+        """Whether a bare name refers to an output column rather than a table column.
+
+        ORDER BY prefers the output column, elsewhere it is only a fallback.
+        """
+        if column.table or column.name not in self.outputs:
+            return False
+        if order:
+            return True
+        try:
+            self._resolve(column)
+        except Ineligible:
+            return True
+        return False
+
+    def _convert(self, node: exp.Expression, order: bool = False) -> exp.Expression:
+        """Rebuild an expression over the rollup, raises Ineligible when it cannot."""
+        if isinstance(node, exp.AggFunc):
+            return self._aggregate(node)
+        day = self._day(node)
+        if day is not None:
+            return day
+        if isinstance(node, exp.Column):
+            if self._output_column(node, order):
+                # ORDER BY names the output, GROUP BY gets the expression since
+                # the rollup may have a column of that name
+                return node.copy() if order else self.outputs[node.name].copy()
+            return self._dimension(node)
+        if isinstance(
+            node, (exp.Select, exp.Subquery, exp.Table, exp.Window, exp.Star)
+        ):
+            raise Ineligible(
+                "subquery" if isinstance(node, (exp.Select, exp.Subquery)) else "clause"
+            )
+        args = {}
+        for key, value in node.args.items():
+            if isinstance(value, exp.Expression):
+                args[key] = self._convert(value, order)
+            elif isinstance(value, list):
+                args[key] = [
+                    self._convert(item, order)
+                    if isinstance(item, exp.Expression)
+                    else item
+                    for item in value
+                ]
+            else:
+                args[key] = value
+        return node.__class__(**args)
+
+    def rewrite(self, rollup: str) -> exp.Select:
+        select = self.select
+        if any(
+            value for key, value in select.args.items() if key not in SELECT_CLAUSES
+        ):
+            raise Ineligible("clause")
+        if select.find(exp.Window):
+            raise Ineligible("clause")
+        if not select.args.get("group") and not select.find(exp.AggFunc):
+            raise Ineligible("not an aggregate")
+        if self._table(select.args["from_"].this) != self.definition["base"]:
+            raise Ineligible("table")
+        for join in select.args.get("joins") or []:
+            self._join(join)
+        if len(set(self.sources.values())) != len(self.sources):
+            raise Ineligible("join")
+
+        projections = []
+        for projection in select.expressions:
+            if isinstance(projection, exp.Alias):
+                alias = projection.args["alias"].copy()
+                expression = projection.this
+            else:
+                alias = exp.to_identifier(self._output_name(projection), quoted=True)
+                expression = projection
+            self.outputs[alias.name] = self._convert(expression)
+            projections.append(exp.alias_(self.outputs[alias.name].copy(), alias))
+
+        rewritten = exp.select(*projections).from_(exp.to_table(rollup).as_("r"))
+        conditions = [
+            exp.Not(
+                this=exp.Is(
+                    this=self._rollup_column(
+                        self.definition["dimensions"][
+                            f"{self.definition['base']}.{key}"
+                        ]
+                    ),
+                    expression=exp.Null(),
+                )
+            )
+            for key in self.inner_joins
+        ]
+        if select.args.get("where"):
+            conditions.insert(0, self._convert(select.args["where"].this))
+        if conditions:
+            rewritten.set("where", exp.Where(this=exp.and_(*conditions)))
+        for key in ("group", "having", "distinct"):
+            if select.args.get(key):
+                rewritten.set(key, self._convert(select.args[key]))
+        if select.args.get("order"):
+            rewritten.set("order", self._convert(select.args["order"], order=True))
+        for key in ("limit", "offset"):
+            if select.args.get(key):
+                rewritten.set(key, select.args[key].copy())
+        return rewritten
+
+
+class RollupRewriter:
+    """Sends generated aggregate queries to the rollup tables built by the loader.
+
+    `services/database/rollups.py` keeps GROUP BY summaries of the transactions
+    and describes them in a catalog table. A single SELECT over the base table,
+    optionally joined to the rollup's dimension tables on their key, whose
+    filters, groups and aggregates only read what a rollup kept, is rebuilt to
+    read the rollup instead. Anything else runs as written. The catalog is
+    re-read when the data version changes.
+    """
+
+    def __init__(self, schema_cache: SchemaCache):
+        self.schema_cache = schema_cache
+        self.dialect = DIALECTS.get(schema_cache.engine.dialect.name)
+        self._rollups: dict[str, dict] = {}
+        self._version: int | None = None
+        self._lock = threading.Lock()
+        self.checked = 0
+        self.rewritten = 0
+        self.fallbacks = 0
+        self.reasons: Counter[str] = Counter()
+
+    def name(self, identifier: exp.Identifier | str) -> str:
+        # the same folding as SQLValidator
+        if isinstance(identifier, str):
+            return identifier.lower()
+        if self.dialect == "postgres" and identifier.quoted:
+            return identifier.this
+        return identifier.this.lower()
+
+    def schema(self) -> dict[str, list[str]]:
+        return self.schema_cache.get_columns()
+
+    def _read_catalog(self) -> dict[str, dict]:
+        table = Config.ROLLUP_CATALOG_TABLE
+        with self.schema_cache.engine.connect() as conn:
+            if not inspect(conn).has_table(table):
+                return {}
+            rows = conn.execute(
+                text(f"SELECT name, definition FROM {table}")
+            ).fetchall()
+            timezone = (
+                conn.execute(text("SELECT current_setting('TimeZone')")).scalar()
+                if self.dialect == "postgres"
+                else None
+            )
+        rollups = {}
+        for name, catalog_entry in rows:
+            definition = json.loads(catalog_entry)
+            if definition["days"] and definition["timezone"] != timezone:
+                # its days were cut in another time zone than this session's
+                print(
+                    f"⚠️ Rollup {name} was built in {definition['timezone']}, skipping it"
+                )
+                continue
+            rollups[name] = definition
+        # the smallest rollup that can answer is the fastest
+        return dict(sorted(rollups.items(), key=lambda item: item[1]["rows"]))
+
+    def rollups(self) -> dict[str, dict]:
+        version = self.schema_cache.get_data_version()
+        if version != self._version:
+            with self._lock:
+                if version != self._version:
+                    self._rollups = self._read_catalog()
+                    self._version = version
+        return self._rollups
+
+    def _rewrite(self, sql_query: str) -> str:
+        try:
+            statements = sqlglot.parse(sql_query, read=self.dialect)
+        except (ParseError, TokenError):
+            raise Ineligible("unparsed")
+        statements = [statement for statement in statements if statement is not None]
+        if len(statements) != 1 or not isinstance(statements[0], exp.Select):
+            raise Ineligible("not a select")
+        rollups = self.rollups()
+        if not rollups:
+            raise Ineligible("no rollups")
+        reason = "no rollups"
+        for name, definition in rollups.items():
+            try:
+                query = RollupQuery(self, statements[0], definition)
+                return query.rewrite(name).sql(self.dialect)
+            except Ineligible as e:
+                reason = str(e)
+        raise Ineligible(reason)
+
+    def rewrite(self, sql_query: str) -> str | None:
+        """The same query over a rollup, None when no rollup can answer it."""
+        self.checked += 1
+        try:
+            rewritten = self._rewrite(sql_query)
+        except Ineligible as e:
+            self.reasons[str(e)] += 1
+            return None
+        self.rewritten += 1
+        return rewritten
+
+    def stats(self) -> dict:
+        return {
+            "checked": self.checked,
+            "rewritten": self.rewritten,
+            "hit_rate": self.rewritten / self.checked if self.checked else 0.0,
+            "fallbacks": self.fallbacks,
+            "reasons": dict(self.reasons),
+            "rollups": list(self._rollups),
+        }
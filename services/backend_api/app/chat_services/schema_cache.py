@@ -0,0 +1,160 @@
+import hashlib
+import threading
+import time
+
+from app.config import Config
+from langchain_community.utilities.sql_database import SQLDatabase
+from sqlalchemy import inspect, text
+
+# one round trip per dialect to read the catalog, used to fingerprint the schema
+CATALOG_QUERIES = {
+    "postgresql": """
+        SELECT table_name, column_name, data_type
+        FROM information_schema.columns
+        WHERE table_schema = current_schema()
+        ORDER BY table_name, ordinal_position
+    """,
+    "sqlite": """
+        SELECT name, sql
+        FROM sqlite_master
+        WHERE type IN ('table', 'view')
+        ORDER BY name
+    """,
+}
+
+
+class SchemaCache:
+    """Caches the schema context (DDL + sample rows) injected into the prompts.
+
+    The context is built once and reused until the schema fingerprint changes.
+    The fingerprint is a checksum of the catalog plus the data version bumped by
+    `load_data_to_db.load_data`, and it is only re-read every `refresh_interval`
+    seconds. A stale fingerprint is re-read in a background thread while lookups
+    keep serving the cached context, so building a prompt never goes to the
+    database, not even from the async nodes.
+    """
+
+    def __init__(self, engine, refresh_interval: float | None = None):
+        self.engine = engine
+        self.refresh_interval = (
+            Config.SCHEMA_CACHE_REFRESH_SECONDS
+            if refresh_interval is None
+            else refresh_interval
+        )
+        self.db: SQLDatabase | None = None
+        self.fingerprint = ""
+        self.table_names: list[str] = []
+        self.table_info = ""
+        self.columns: dict[str, list[str]] = {}
+        self.data_version = 0
+        self.hits = 0
+        self.misses = 0
+        self._checked_at = 0.0
+        self._refreshing = False
+        self._lock = threading.Lock()
+        self.refresh()
+
+    def _is_fresh(self) -> bool:
+        return time.monotonic() - self._checked_at < self.refresh_interval
+
+    def _revalidate(self):
+        """Start a background refresh when stale, at most one at a time."""
+        if self._is_fresh() or self._refreshing:
+            return
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+        threading.Thread(
+            target=self._background_refresh, name="schema-cache-refresh", daemon=True
+        ).start()
+
+    def _background_refresh(self):
+        try:
+            self.refresh()
+        except Exception as e:
+            # keep serving the cached context, try again after the interval
+            self._checked_at = time.monotonic()
+            print(f"⚠️ Schema refresh failed, keeping the cached schema: {e}")
+        finally:
+            self._refreshing = False
+
+    def get_table_info(self) -> str:
+        self._revalidate()
+        self.hits += 1
+        return self.table_info
+
+    def get_data_version(self) -> int:
+        """Data version published by the loader, 0 if it never ran."""
+        self._revalidate()
+        return self.data_version
+
+    def get_columns(self) -> dict[str, list[str]]:
+        """Column names per usable table, for validating generated SQL."""
+        self._revalidate()
+        return self.columns
+
+    def refresh(self):
+        """Re-read the fingerprint and rebuild the context only if it changed."""
+        with self._lock:
+            fingerprint, data_version = self.compute_fingerprint()
+            self._checked_at = time.monotonic()
+            if self.db is not None and fingerprint == self.fingerprint:
+                self.data_version = data_version
+                return
+
+            self.misses += 1
+            # a new SQLDatabase re-reflects tables that were created by a reload
+            self.db = SQLDatabase(self.engine)
+            self.table_names = [
+                name
+                for name in self.db.get_usable_table_names()
+                if not name.startswith(Config.INTERNAL_TABLE_PREFIX)
+            ]
+            self.table_info = self.db.get_table_info(table_names=self.table_names)
+            inspector = inspect(self.engine)
+            self.columns = {
+                table: [column["name"] for column in inspector.get_columns(table)]
+                for table in self.table_names
+            }
+            # published last, readers that see the new fingerprint see its context
+            self.data_version = data_version
+            self.fingerprint = fingerprint
+
+    def invalidate(self):
+        """Make the next lookup start a rebuild of the context."""
+        with self._lock:
+            self.fingerprint = ""
+            self._checked_at = 0.0
+
+    def compute_fingerprint(self) -> tuple[str, int]:
+        digest = hashlib.sha256()
+        version = 0
+        with self.engine.connect() as conn:
+            query = CATALOG_QUERIES.get(self.engine.dialect.name)
+            if query:
+                rows = conn.execute(text(query)).fetchall()
+            else:
+                inspector = inspect(conn)
+                rows = [
+                    (table, column["name"], str(column["type"]))
+                    for table in sorted(inspector.get_table_names())
+                    for column in inspector.get_columns(table)
+                ]
+            digest.update(repr(rows).encode())
+
+            if inspect(conn).has_table(Config.DATA_VERSION_TABLE):
+                version = conn.execute(
+                    text(f"SELECT version FROM {Config.DATA_VERSION_TABLE}")
+                ).scalar()
+                digest.update(f"data_version={version}".encode())
+        return digest.hexdigest(), version
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "fingerprint": self.fingerprint,
+        }
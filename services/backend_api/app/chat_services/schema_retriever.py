@@ -0,0 +1,224 @@
+import math
+import re
+import threading
+from collections import defaultdict, deque
+
+from app.chat_services.schema_cache import SchemaCache
+from app.config import Config
+from langchain_core.messages.utils import count_tokens_approximately
+from sqlalchemy import String, column, inspect, select, table
+
+# a table name matches more strongly than one of its columns or values
+NAME_WEIGHT = 3.0
+COLUMN_WEIGHT = 2.0
+VALUE_WEIGHT = 2.0
+MAX_VALUE_LENGTH = 40
+
+
+def terms(text: str) -> list[str]:
+    """Lower case word stems, `sales_transactions` -> ["sale", "transaction"]."""
+    words = re.findall(r"[a-z0-9]+", text.lower())
+    return [w[:-1] if len(w) > 3 and w.endswith("s") else w for w in words]
+
+
+class SchemaRetriever:
+    """Picks the tables a question needs so prompts carry only their schema.
+
+    Indexes each table's name, column names and the distinct values of its
+    short text columns, not free text such as reviews, plus the foreign keys
+    `setup_foreign_keys` created. A question selects the tables whose terms it mentions, weighted by how
+    rare the term is across tables, then the tables on the join paths between
+    them. When nothing matches the full schema is used.
+
+    The index is built up front and rebuilt in a background thread whenever
+    the SchemaCache fingerprint changes, questions use the previous index
+    until the new one is ready.
+    """
+
+    def __init__(self, schema_cache: SchemaCache):
+        self.schema_cache = schema_cache
+        self.max_tables = Config.SCHEMA_PRUNING_MAX_TABLES
+        self.min_score = Config.SCHEMA_PRUNING_MIN_SCORE
+        self.fingerprint = ""
+        self.table_infos: dict[str, str] = {}
+        self.index: dict[str, dict[str, float]] = {}
+        self.values: dict[str, list[set[str]]] = {}
+        self.links: dict[str, set[str]] = {}
+        self.requests = 0
+        self.full_tokens = 0
+        self.pruned_tokens = 0
+        self._rebuilding = False
+        self._lock = threading.Lock()
+        self._build()
+
+    def _build(self):
+        cache = self.schema_cache
+        inspector = inspect(cache.engine)
+        index = defaultdict(dict)
+        values = defaultdict(list)
+        links = defaultdict(set)
+        table_infos = {}
+
+        for name in cache.table_names:
+            table_infos[name] = cache.db.get_table_info(table_names=[name])
+            for term in terms(name):
+                index[term][name] = NAME_WEIGHT
+            columns = inspector.get_columns(name)
+            for col in columns:
+                for term in terms(col["name"]):
+                    index[term].setdefault(name, COLUMN_WEIGHT)
+            for col in columns:
+                if isinstance(col["type"], String):
+                    values[name] += self._sample_values(name, col["name"])
+            for fk in inspector.get_foreign_keys(name):
+                if fk["referred_table"] in cache.table_names:
+                    links[name].add(fk["referred_table"])
+                    links[fk["referred_table"]].add(name)
+
+        if not links:
+            # no declared keys, link tables the way setup_foreign_keys would:
+            # through an id column with the same name
+            id_columns = defaultdict(set)
+            for name in cache.table_names:
+                for col in cache.columns.get(name, []):
+                    if col.lower().endswith("id"):
+                        id_columns[col.lower()].add(name)
+            for tables in id_columns.values():
+                for name in tables:
+                    links[name] |= tables - {name}
+
+        self.table_infos = table_infos
+        self.index = dict(index)
+        self.values = dict(values)
+        self.links = dict(links)
+        self.fingerprint = cache.fingerprint
+
+    def _sample_values(self, table_name: str, column_name: str):
+        """Terms of each distinct value of a low cardinality, short text column."""
+        limit = Config.SCHEMA_VALUE_SAMPLES
+        source = select(column(column_name)).select_from(table(table_name))
+        with self.schema_cache.engine.connect() as conn:
+            # free text such as reviews is skipped before the costly DISTINCT
+            head = conn.execute(source.limit(limit)).scalars().all()
+            if any(isinstance(v, str) and len(v) > MAX_VALUE_LENGTH for v in head):
+                return []
+            rows = conn.execute(source.distinct().limit(limit + 1)).scalars().all()
+        if len(rows) > limit:
+            return []
+        samples = []
+        for value in rows:
+            if not isinstance(value, str) or len(value) > MAX_VALUE_LENGTH:
+                continue
+            # dates and codes would match any number in the question
+            value_terms = {term for term in terms(value) if term.isalpha()}
+            if value_terms:
+                samples.append(value_terms)
+        return samples
+
+    def _refresh(self):
+        self.schema_cache.get_table_info()  # re-reads a stale fingerprint in the background
+        if self.fingerprint == self.schema_cache.fingerprint or self._rebuilding:
+            return
+        with self._lock:
+            if self._rebuilding:
+                return
+            self._rebuilding = True
+        threading.Thread(
+            target=self._background_build, name="schema-index-build", daemon=True
+        ).start()
+
+    def _background_build(self):
+        try:
+            self._build()
+        except Exception as e:
+            # the old index keeps answering, the next question tries again
+            print(f"⚠️ Rebuilding the schema index failed: {e}")
+        finally:
+            self._rebuilding = False
+
+    def score(self, text: str) -> dict[str, float]:
+        found = set(terms(text))
+        n_tables = len(self.table_infos)
+        scores = defaultdict(float)
+        for term in found:
+            for name, weight in self.index.get(term, {}).items():
+                idf = math.log(1 + n_tables / len(self.index[term]))
+                scores[name] += weight * idf
+        # a value such as a product or a city points at the tables holding it
+        holders = [
+            name
+            for name, table_values in self.values.items()
+            if any(value_terms <= found for value_terms in table_values)
+        ]
+        for name in holders:
+            scores[name] += VALUE_WEIGHT * math.log(1 + n_tables / len(holders))
+        return dict(scores)
+
+    def _join_path(self, start: str, goal: str) -> list[str]:
+        parents = {start: None}
+        queue = deque([start])
+        while queue:
+            node = queue.popleft()
+            if node == goal:
+                path = []
+                while node is not None:
+                    path.append(node)
+                    node = parents[node]
+                return path
+            for neighbour in self.links.get(node, ()):
+                if neighbour not in parents:
+                    parents[neighbour] = node
+                    queue.append(neighbour)
+        return [goal]
+
+    def select_tables(self, text: str) -> list[str]:
+        """Tables relevant to `text` plus the tables joining them, [] if none match."""
+        self._refresh()
+        lowered = text.lower()
+        # a table named outright, e.g. in a previous query or error, always stays
+        named = [name for name in self.table_infos if name.lower() in lowered]
+        scores = self.score(text)
+        if not scores and not named:
+            return []
+
+        best = max(scores.values(), default=0.0)
+        # on a tie the shorter name is the more specific match
+        ranked = sorted(scores, key=lambda name: (-scores[name], len(terms(name))))
+        selected = list(named)
+        for name in ranked:
+            if len(selected) >= self.max_tables:
+                break
+            if scores[name] >= best * self.min_score and name not in selected:
+                selected.append(name)
+
+        tables = [selected[0]]
+        for name in selected[1:]:
+            for step in self._join_path(selected[0], name):
+                if step not in tables:
+                    tables.append(step)
+        return [name for name in self.table_infos if name in tables]
+
+    def table_info(self, text: str) -> str:
+        """Schema context for the prompt, pruned to the tables `text` needs."""
+        tables = self.select_tables(text)
+        full = self.schema_cache.table_info
+        pruned = (
+            "\n\n".join(self.table_infos[name] for name in tables) if tables else full
+        )
+
+        full_tokens = count_tokens_approximately([full])
+        pruned_tokens = count_tokens_approximately([pruned])
+        self.requests += 1
+        self.full_tokens += full_tokens
+        self.pruned_tokens += pruned_tokens
+        return pruned
+
+    def stats(self) -> dict:
+        saved = self.full_tokens - self.pruned_tokens
+        return {
+            "requests": self.requests,
+            "full_tokens": self.full_tokens,
+            "pruned_tokens": self.pruned_tokens,
+            "saved_tokens": saved,
+            "saved_ratio": saved / self.full_tokens if self.full_tokens else 0.0,
+        }
@@ -0,0 +1,110 @@
+import asyncio
+import json
+import re
+
+from app.config import Config
+from sqlalchemy import text
+from sqlalchemy.exc import SQLAlchemyError
+
+# strip comments and literals before looking at keywords
+COMMENTS_AND_LITERALS = re.compile(
+    r"--[^\n]*|/\*.*?\*/|'(?:[^']|'')*'|\"(?:[^\"]|\"\")*\"", re.DOTALL
+)
+READ_ONLY_START = ("select", "with")
+WRITE_KEYWORDS = re.compile(
+    r"\b(insert|update|delete|merge|drop|alter|create|truncate|grant|revoke|copy|vacuum|call|do)\b"
+)
+
+
+def prepare_read_only(conn, timeout_ms: int):
+    """Make the current transaction read-only with a statement timeout.
+
+    Must run first in the transaction. Returns a cleanup statement for dialects
+    where the setting outlives the transaction, or None.
+    """
+    dialect = conn.dialect.name
+    if dialect == "postgresql":
+        conn.execute(text("SET TRANSACTION READ ONLY"))
+        conn.execute(text(f"SET LOCAL statement_timeout = {int(timeout_ms)}"))
+    elif dialect == "sqlite":
+        # per connection, the pool hands the connection to the next user
+        conn.execute(text("PRAGMA query_only = ON"))
+        return "PRAGMA query_only = OFF"
+    return None
+
+
+class SQLGuard:
+    """Checks generated SQL before execute_query runs it.
+
+    Rejects anything that is not a single read-only statement, and on Postgres
+    rejects plans whose EXPLAIN estimate is above GUARD_MAX_COST or
+    GUARD_MAX_PLAN_ROWS. A rejection is returned as an error string for
+    `sql_query_error` so write_query can ask for a cheaper query.
+    """
+
+    def __init__(self, engine, async_engine=None):
+        self.engine = engine
+        self.async_engine = async_engine
+        self.max_cost = Config.GUARD_MAX_COST
+        self.max_plan_rows = Config.GUARD_MAX_PLAN_ROWS
+        self.rejections = 0
+
+    def check_statement(self, sql_query: str) -> str | None:
+        stripped = COMMENTS_AND_LITERALS.sub(" ", sql_query).strip().rstrip(";").lower()
+        if ";" in stripped:
+            return "Error: Only one SQL statement can be run at a time."
+        if not stripped.startswith(READ_ONLY_START) or WRITE_KEYWORDS.search(stripped):
+            return "Error: Only read-only SELECT queries are allowed."
+        return None
+
+    def _explain_sql(self, sql_query: str) -> str | None:
+        if self.engine.dialect.name != "postgresql":
+            # only Postgres reports cost and row estimates we can compare
+            return None
+        return f"EXPLAIN (FORMAT JSON) {sql_query.strip().rstrip(';')}"
+
+    def _check_plan(self, plan) -> str | None:
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        root = plan[0]["Plan"]
+        cost, rows = root["Total Cost"], root["Plan Rows"]
+        if cost > self.max_cost or rows > self.max_plan_rows:
+            return (
+                f"Error: Query rejected before execution, the planner estimates cost {cost:,.0f} "
+                f"and {rows:,} rows (limits {self.max_cost:,.0f} cost, {self.max_plan_rows:,} rows). "
+                "Write a cheaper query: filter, aggregate or LIMIT the rows, and avoid cross joins "
+                "or joins without a join condition."
+            )
+        return None
+
+    def _result(self, error: str | None) -> str | None:
+        if error:
+            self.rejections += 1
+        return error
+
+    def check(self, sql_query: str) -> str | None:
+        error = self.check_statement(sql_query)
+        explain = None if error else self._explain_sql(sql_query)
+        if explain:
+            try:
+                with self.engine.begin() as conn:
+                    prepare_read_only(conn, Config.STATEMENT_TIMEOUT_MS)
+                    error = self._check_plan(conn.execute(text(explain)).scalar())
+            except SQLAlchemyError as e:
+                error = f"Error: {e}"
+        return self._result(error)
+
+    async def acheck(self, sql_query: str) -> str | None:
+        if self.async_engine is None:
+            return await asyncio.to_thread(self.check, sql_query)
+        error = self.check_statement(sql_query)
+        explain = None if error else self._explain_sql(sql_query)
+        if explain:
+            try:
+                async with self.async_engine.begin() as conn:
+                    await conn.run_sync(prepare_read_only, Config.STATEMENT_TIMEOUT_MS)
+                    plan = (await conn.execute(text(explain))).scalar()
+                    error = self._check_plan(plan)
+            except SQLAlchemyError as e:
+                error = f"Error: {e}"
+        return self._result(error)
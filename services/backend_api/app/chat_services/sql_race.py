@@ -0,0 +1,89 @@
+import asyncio
+import contextvars
+from collections import Counter
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+
+def succeeded(attempt: tuple[dict, object]) -> bool:
+    return attempt[0].get("sql_query_execution_status") == "success"
+
+
+class SQLRace:
+    """Runs the SQL candidates of `Agent.race_query` side by side, the first success wins.
+
+    A candidate is a (model, temperature) pair. `attempt(i)` writes the SQL
+    with candidate i, then validates, guards and executes it, and returns the
+    state update with the LLM output. The first successful attempt wins and
+    the rest are cancelled. When every candidate fails, the first candidate's
+    failure goes on to the sequential retry loop. Sync attempts run in threads
+    that cannot be stopped, a lost one ends at the statement timeout at the latest.
+    """
+
+    def __init__(self, candidates: list[tuple[str, float | None]]):
+        self.candidates = list(candidates)
+        self.races = 0
+        self.failed = 0
+        self.cancelled = 0
+        self.wins: Counter[str] = Counter()
+
+    def label(self, index: int) -> str:
+        model, temperature = self.candidates[index]
+        return model if temperature is None else f"{model}@{temperature}"
+
+    def _finish(self, attempts: dict, winner: int | None) -> tuple[dict, object]:
+        self.races += 1
+        if winner is None:
+            self.failed += 1
+            return attempts[0]
+        self.wins[self.label(winner)] += 1
+        self.cancelled += len(self.candidates) - len(attempts)
+        return attempts[winner]
+
+    def run(self, attempt) -> tuple[dict, object]:
+        attempts, winner = {}, None
+        pool = ThreadPoolExecutor(max_workers=len(self.candidates))
+        try:
+            # each thread runs in a copy of the turn's context, for the metrics
+            pending = {
+                pool.submit(contextvars.copy_context().run, attempt, i): i
+                for i in range(len(self.candidates))
+            }
+            while pending and winner is None:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in sorted(done, key=pending.get):
+                    i = pending.pop(future)
+                    attempts[i] = future.result()
+                    if winner is None and succeeded(attempts[i]):
+                        winner = i
+        finally:
+            pool.shutdown(wait=False, cancel_futures=True)
+        return self._finish(attempts, winner)
+
+    async def arun(self, attempt) -> tuple[dict, object]:
+        tasks = {
+            asyncio.ensure_future(attempt(i)): i for i in range(len(self.candidates))
+        }
+        attempts, winner = {}, None
+        pending = set(tasks)
+        try:
+            while pending and winner is None:
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in sorted(done, key=tasks.get):
+                    i = tasks[task]
+                    attempts[i] = task.result()
+                    if winner is None and succeeded(attempts[i]):
+                        winner = i
+        finally:
+            for task in pending:
+                task.cancel()
+        return self._finish(attempts, winner)
+
+    def stats(self) -> dict:
+        return {
+            "races": self.races,
+            "failed": self.failed,
+            "cancelled": self.cancelled,
+            "wins": dict(self.wins),
+        }
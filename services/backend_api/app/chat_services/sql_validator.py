@@ -0,0 +1,225 @@
+import difflib
+
+import sqlglot
+from app.chat_services.schema_cache import SchemaCache
+from sqlglot import exp
+from sqlglot.errors import OptimizeError, ParseError, TokenError
+from sqlglot.optimizer.scope import Scope, traverse_scope
+
+# sqlalchemy dialect name -> sqlglot dialect
+DIALECTS = {"postgresql": "postgres", "sqlite": "sqlite", "mysql": "mysql"}
+
+
+def did_you_mean(name: str, candidates) -> str:
+    matches = difflib.get_close_matches(name, list(candidates), n=1, cutoff=0.6)
+    return f', did you mean "{matches[0]}"?' if matches else ""
+
+
+class SQLValidator:
+    """Parses generated SQL and resolves it against the cached schema, in process.
+
+    Catches syntax errors, unknown tables and columns, columns looked up in the
+    wrong table and unqualified columns that several joined tables have, without
+    a round trip to the database. Every problem found is reported in one error
+    string with "did you mean" suggestions, so one write_query retry can fix them
+    all. Anything it cannot resolve (table functions, `*` in subqueries) is left
+    to the database.
+    """
+
+    def __init__(self, schema_cache: SchemaCache):
+        self.schema_cache = schema_cache
+        self.dialect = DIALECTS.get(schema_cache.engine.dialect.name)
+        self.rejections = 0
+
+    def _name(self, identifier: exp.Identifier | str) -> str:
+        # postgres folds unquoted identifiers to lower case, sqlite ignores case
+        if isinstance(identifier, str):
+            return identifier.lower()
+        if self.dialect == "postgres" and identifier.quoted:
+            return identifier.this
+        return identifier.this.lower()
+
+    def _schema(self) -> dict[str, set[str]]:
+        columns = self.schema_cache.get_columns()
+        if self.dialect == "postgres":
+            return {table: set(names) for table, names in columns.items()}
+        return {
+            table.lower(): {name.lower() for name in names}
+            for table, names in columns.items()
+        }
+
+    def _source_columns(self, source, schema) -> set[str] | None:
+        """Columns a FROM source exposes, None when they cannot be known here."""
+        if isinstance(source, Scope):
+            names = source.expression.named_selects
+            return None if "*" in names else {self._name(name) for name in names}
+        if isinstance(source, exp.Table) and isinstance(source.this, exp.Identifier):
+            return schema.get(self._name(source.this))
+        return None
+
+    def _check_tables(self, scope: Scope, schema, errors: list[str]):
+        for source in scope.sources.values():
+            if not isinstance(source, exp.Table) or not isinstance(
+                source.this, exp.Identifier
+            ):
+                continue
+            table = self._name(source.this)
+            if table not in schema:
+                errors.append(
+                    f'table "{source.name}" does not exist{did_you_mean(table, schema)}'
+                )
+
+    def _visible_sources(self, scope: Scope):
+        # inner scope first, a correlated subquery can see its parents' sources
+        while scope is not None:
+            yield scope
+            scope = scope.parent
+
+    def _lookup(self, alias: str, scope: Scope):
+        for visible in self._visible_sources(scope):
+            for name, source in visible.sources.items():
+                if name == alias or name.lower() == alias.lower():
+                    return source
+        return None
+
+    def _own_columns(self, scope: Scope):
+        """Columns written in this scope's query, not in a nested subquery.
+
+        sqlglot also lists a subquery's unqualified columns in its parent, as
+        they might be correlated, the subquery's own scope checks them.
+        """
+        for column in scope.columns:
+            if column.find_ancestor(exp.Select, exp.SetOperation) is scope.expression:
+                yield column
+
+    def _using(self, scope: Scope) -> set[str]:
+        # a JOIN ... USING column is one merged column, never ambiguous
+        return {
+            self._name(identifier)
+            for join in scope.expression.args.get("joins") or []
+            for identifier in join.args.get("using") or []
+        }
+
+    def _check_set_column(self, column: exp.Column, scope: Scope, errors: list[str]):
+        # ORDER BY of a UNION sees the output columns of its first query
+        names = scope.expression.named_selects
+        if self._name(column.this) not in {self._name(name) for name in names}:
+            errors.append(
+                f'column "{column.name}" is not in the result of the '
+                f"{scope.expression.key.upper()}{did_you_mean(column.name, names)}"
+            )
+
+    def _check_column(
+        self, column: exp.Column, scope: Scope, schema, errors: list[str]
+    ):
+        if not isinstance(column.this, exp.Identifier):
+            return
+        if isinstance(scope.expression, exp.SetOperation):
+            self._check_set_column(column, scope, errors)
+            return
+        name = self._name(column.this)
+
+        if column.table:
+            alias = column.table
+            source = self._lookup(alias, scope)
+            if source is None:
+                errors.append(
+                    f'"{alias}.{column.name}" refers to "{alias}", which is not in the FROM clause'
+                    + did_you_mean(alias, scope.sources)
+                )
+                return
+            known = self._source_columns(source, schema)
+            if known is not None and name not in known:
+                errors.append(
+                    f'column "{column.name}" does not exist in "{alias}"'
+                    + self._suggest_column(name, known, schema)
+                )
+            return
+
+        for visible in self._visible_sources(scope):
+            owners, unknown = [], False
+            for alias, source in visible.sources.items():
+                known = self._source_columns(source, schema)
+                if known is None:
+                    unknown = True
+                elif name in known:
+                    owners.append(alias)
+            if len(owners) > 1 and name not in self._using(visible):
+                errors.append(
+                    f'column "{column.name}" is ambiguous, it exists in '
+                    + ", ".join(f'"{owner}"' for owner in owners)
+                    + f', qualify it like "{owners[0]}.{column.name}"'
+                )
+                return
+            if owners or unknown:
+                return
+
+        # ORDER BY and GROUP BY may name an aliased output column
+        aliases = {
+            self._name(select.alias)
+            for select in scope.expression.selects
+            if isinstance(select, exp.Alias)
+        }
+        if name in aliases:
+            return
+        known = set().union(
+            *(
+                self._source_columns(source, schema) or set()
+                for source in scope.sources.values()
+            )
+        )
+        errors.append(
+            f'column "{column.name}" does not exist in '
+            + (", ".join(f'"{alias}"' for alias in scope.sources) or "the query")
+            + self._suggest_column(name, known, schema)
+        )
+
+    def _suggest_column(self, name: str, known: set[str], schema) -> str:
+        suggestion = did_you_mean(name, known)
+        if suggestion:
+            return suggestion
+        # a column that lives in another table usually means a missing join
+        tables = sorted(table for table, columns in schema.items() if name in columns)
+        if tables:
+            return f", it exists in {', '.join(tables)}"
+        return ""
+
+    def _result(self, errors: list[str]) -> str | None:
+        if not errors:
+            return None
+        self.rejections += 1
+        return "Error: The SQL query is invalid:\n" + "\n".join(
+            f"- {error}" for error in dict.fromkeys(errors)
+        )
+
+    def validate(self, sql_query: str) -> str | None:
+        """Return an error for `sql_query_error`, or None if the query resolves."""
+        try:
+            statements = [
+                statement
+                for statement in sqlglot.parse(sql_query, read=self.dialect)
+                if statement is not None
+            ]
+        except TokenError as e:
+            return self._result([f"syntax error: {e}"])
+        except ParseError as e:
+            error = e.errors[0] if e.errors else {}
+            return self._result(
+                [
+                    f"syntax error at line {error.get('line')}, column {error.get('col')} "
+                    f'near "{error.get("highlight", "")}": {error.get("description", e)}'
+                ]
+            )
+
+        schema = self._schema()
+        errors = []
+        try:
+            for statement in statements:
+                for scope in traverse_scope(statement):
+                    self._check_tables(scope, schema, errors)
+                    for column in self._own_columns(scope):
+                        self._check_column(column, scope, schema, errors)
+        except OptimizeError:
+            # sqlglot could not scope the query, let the database judge it
+            return None
+        return self._result(errors)
@@ -0,0 +1,165 @@
+import asyncio
+import json
+import re
+import threading
+
+from app.chat_services.query_executor import QueryExecutor
+from app.chat_services.schema_cache import SchemaCache
+from app.config import Config
+from app.models.query_result import QueryResult
+from sqlalchemy import inspect, text
+
+WORD = re.compile(r"[a-z0-9]+")
+# the loader's text_index.py splits the indexed texts the same way
+STOPWORDS = set(
+    """
+    a an and are as at be but by for from had has have he her his i if in is it its
+    me my not of on or our she so that the their them they this to too was we were
+    what when which who will with you your
+    """.split()
+)
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+
+def words(search: str) -> list[str]:
+    """Search words without stopwords, only [a-z0-9] so they are safe to inline."""
+    return list(
+        dict.fromkeys(w for w in WORD.findall(search.lower()) if w not in STOPWORDS)
+    )
+
+
+def terms(search: str) -> list[str]:
+    return list(
+        dict.fromkeys(
+            w[:-1] if len(w) > 3 and w.endswith("s") else w for w in words(search)
+        )
+    )
+
+
+class TextRetriever:
+    """Top-k review texts for a keyword search, for `Agent.retrieve_reviews`.
+
+    Searches the index the loader built (see `services/database/text_index.py`):
+    the GIN indexed `to_tsvector` of each text column on Postgres, ranked with
+    `ts_rank_cd`, or the BM25 tables on other databases. Each hit comes back
+    with its source table, franchise id and date, the text cut to `max_chars`.
+    """
+
+    def __init__(
+        self,
+        schema_cache: SchemaCache,
+        executor: QueryExecutor,
+        top_k: int = Config.TEXT_SEARCH_TOP_K,
+        max_chars: int = Config.TEXT_SEARCH_MAX_CHARS,
+    ):
+        self.schema_cache = schema_cache
+        self.executor = executor
+        self.top_k = top_k
+        self.max_chars = max_chars
+        self.quote = schema_cache.engine.dialect.identifier_preparer.quote
+        self._catalog: dict[str, dict] = {}
+        self._version: int | None = None
+        self._lock = threading.Lock()
+        self.searches = 0
+        self.hits = 0
+
+    def _read_catalog(self) -> dict[str, dict]:
+        table = Config.TEXT_INDEX_CATALOG_TABLE
+        with self.schema_cache.engine.connect() as conn:
+            if not inspect(conn).has_table(table):
+                return {}
+            rows = conn.execute(
+                text(f"SELECT name, definition FROM {table}")
+            ).fetchall()
+        return {name: json.loads(definition) for name, definition in rows}
+
+    def catalog(self) -> dict[str, dict]:
+        version = self.schema_cache.get_data_version()
+        if version != self._version:
+            with self._lock:
+                if version != self._version:
+                    self._catalog = self._read_catalog()
+                    self._version = version
+        return self._catalog
+
+    def _tsvector_sql(self, catalog: dict[str, dict], search: str) -> str | None:
+        search_words = words(search)
+        if not search_words:
+            return None
+        selects = []
+        for name, source in catalog.items():
+            document = (
+                f"to_tsvector('{source['config']}', {self.quote(source['text'])})"
+            )
+            # any of the words, ts_rank_cd ranks texts matching more of them first and
+            # 1 divides by the log of the length so long texts do not win by size
+            query = f"to_tsquery('{source['config']}', '{' | '.join(search_words)}')"
+            selects.append(
+                f"SELECT '{name}' AS source, {self.quote(source['franchise'])} AS franchise_id, "
+                f"{self.quote(source['date'])} AS review_date, ts_rank_cd({document}, q, 1) AS score, "
+                f"SUBSTR({self.quote(source['text'])}, 1, {self.max_chars}) AS text "
+                f"FROM {self.quote(name)}, {query} q WHERE {document} @@ q"
+            )
+        return (
+            f"SELECT * FROM ({' UNION ALL '.join(selects)}) hits "
+            f"ORDER BY score DESC LIMIT {self.top_k}"
+        )
+
+    def _bm25_sql(self, catalog: dict[str, dict], search: str) -> str | None:
+        search_terms = terms(search)
+        if not search_terms:
+            return None
+        avg_length = max(next(iter(catalog.values()))["avg_length"], 1.0)
+        norm = f"{BM25_K1} * (1 - {BM25_B} + {BM25_B} * d.length / {avg_length})"
+        sources = ", ".join(f"'{name}'" for name in catalog)
+        quoted = ", ".join(f"'{term}'" for term in search_terms)
+        return (
+            f"SELECT d.source, d.franchise_id, d.review_date, "
+            f"SUM(t.idf * p.tf * {BM25_K1 + 1} / (p.tf + {norm})) AS score, "
+            f"SUBSTR(d.body, 1, {self.max_chars}) AS text "
+            "FROM _text_postings p JOIN _text_terms t ON t.term = p.term "
+            "JOIN _text_docs d ON d.doc_id = p.doc_id "
+            f"WHERE p.term IN ({quoted}) "
+            f"AND d.source IN ({sources}) "
+            "GROUP BY d.doc_id, d.source, d.franchise_id, d.review_date, d.body "
+            f"ORDER BY score DESC LIMIT {self.top_k}"
+        )
+
+    def search_sql(self, search: str) -> str | None:
+        """The ranking query, None without an index or search words."""
+        catalog = self.catalog()
+        if not catalog:
+            return None
+        if next(iter(catalog.values()))["method"] == "tsvector":
+            return self._tsvector_sql(catalog, search)
+        return self._bm25_sql(catalog, search)
+
+    def _record(self, result: QueryResult | None) -> QueryResult | None:
+        self.searches += 1
+        if result is None or not result.row_count:
+            return None
+        self.hits += 1
+        return result
+
+    def search(self, search: str) -> QueryResult | None:
+        """The best matching texts, None when nothing matched."""
+        sql_query = self.search_sql(search)
+        return self._record(self.executor.run(sql_query) if sql_query else None)
+
+    async def asearch(self, search: str) -> QueryResult | None:
+        sql_query = self.search_sql(search)
+        result = None
+        if sql_query and self.executor.async_engine is None:
+            result = await asyncio.to_thread(self.executor.run, sql_query)
+        elif sql_query:
+            result = await self.executor.arun(sql_query)
+        return self._record(result)
+
+    def stats(self) -> dict:
+        return {
+            "searches": self.searches,
+            "hits": self.hits,
+            "hit_rate": self.hits / self.searches if self.searches else 0.0,
+            "sources": list(self._catalog),
+        }
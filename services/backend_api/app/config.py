@@ -9,6 +9,27 @@ GROQ_MODEL = "openai/gpt-oss-120b"  # 200k tokens per day
 # GROQ_MODEL = "llama-3.3-70b-versatile"  # 100k tokens per day
 # GROQ_MODEL = "moonshotai/kimi-k2-instruct"  # 300k tokens per day
 
+# (tokens per minute, tokens per day) of each model on the groq free plan
+GROQ_MODEL_LIMITS = {
+    "openai/gpt-oss-120b": (8_000, 200_000),
+    "qwen/qwen3-32b": (6_000, 500_000),
+    "llama-3.3-70b-versatile": (12_000, 100_000),
+    "moonshotai/kimi-k2-instruct": (10_000, 300_000),
+}
+# tried in order once GROQ_MODEL is out of budget
+GROQ_FALLBACK_MODELS = [
+    "qwen/qwen3-32b",
+    "moonshotai/kimi-k2-instruct",
+    "llama-3.3-70b-versatile",
+]
+# (model, temperature) of each SQL candidate when SQL_CANDIDATES > 1, the first
+# ones are used. None keeps the model's default temperature
+SQL_CANDIDATE_MODELS = [
+    (GROQ_MODEL, None),
+    (GROQ_MODEL, 0.7),
+    *((model, None) for model in GROQ_FALLBACK_MODELS),
+]
+
 
 class Config:
     # agent
@@ -17,14 +38,146 @@ class Config:
     langsmith_project = os.getenv("LANGSMITH_PROJECT")
     langsmith_endpoint = os.getenv("LANGSMITH_ENDPOINT")
 
+    # llm http pool shared by every node
+    LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "20"))
+    LLM_KEEPALIVE_SECONDS = float(os.getenv("LLM_KEEPALIVE_SECONDS", "60"))
+    LLM_TIMEOUT_SECONDS = float(os.getenv("LLM_TIMEOUT_SECONDS", "60"))
+
+    # token budget scheduler in front of every llm call
+    LLM_BUDGET_ENABLED = os.getenv("LLM_BUDGET_ENABLED", "true").lower() == "true"
+    # completion tokens reserved per call until the real usage is known
+    LLM_COMPLETION_ESTIMATE = int(os.getenv("LLM_COMPLETION_ESTIMATE", "400"))
+    # longest a call queues for its model before falling back to the next one
+    LLM_MAX_QUEUE_SECONDS = float(os.getenv("LLM_MAX_QUEUE_SECONDS", "10"))
+    # how long a model is skipped after the api answers 429 without retry-after
+    LLM_RATE_LIMIT_COOLDOWN_SECONDS = float(
+        os.getenv("LLM_RATE_LIMIT_COOLDOWN_SECONDS", "60")
+    )
+
     # database
     DB_TYPE = os.getenv("DB_TYPE", "postgresql")
     DB_DRIVER = os.getenv("DB_DRIVER", "psycopg2")
+    ASYNC_DB_DRIVER = os.getenv("ASYNC_DB_DRIVER", "asyncpg")
     DB_USER = os.getenv("DB_USER", "postgres")
     DB_PASSWORD = os.getenv("DB_PASSWORD", "postgres")
     DB_HOST = os.getenv("DB_HOST", "localhost")
     DB_PORT = os.getenv("DB_PORT", "5432")
     DB_NAME = os.getenv("DB_NAME", "postgres")
 
+    # tables starting with this prefix are bookkeeping tables written by the loader
+    INTERNAL_TABLE_PREFIX = "_"
+    DATA_VERSION_TABLE = "_data_version"
+
+    # schema cache
+    SCHEMA_CACHE_REFRESH_SECONDS = float(
+        os.getenv("SCHEMA_CACHE_REFRESH_SECONDS", "300")
+    )
+
+    # question-aware pruning of the schema context in the prompts
+    SCHEMA_PRUNING_ENABLED = (
+        os.getenv("SCHEMA_PRUNING_ENABLED", "true").lower() == "true"
+    )
+    SCHEMA_PRUNING_MAX_TABLES = int(os.getenv("SCHEMA_PRUNING_MAX_TABLES", "4"))
+    # tables scoring below this share of the best table are dropped
+    SCHEMA_PRUNING_MIN_SCORE = float(os.getenv("SCHEMA_PRUNING_MIN_SCORE", "0.5"))
+    # the latest questions of the conversation the tables are picked for
+    SCHEMA_PRUNING_QUESTIONS = int(os.getenv("SCHEMA_PRUNING_QUESTIONS", "3"))
+    # distinct values indexed per text column, columns with more are skipped
+    SCHEMA_VALUE_SAMPLES = int(os.getenv("SCHEMA_VALUE_SAMPLES", "50"))
+
+    # keyword pre-router that answers obvious chit-chat without write_query
+    PRE_ROUTER_ENABLED = os.getenv("PRE_ROUTER_ENABLED", "true").lower() == "true"
+    PRE_ROUTER_THRESHOLD = float(os.getenv("PRE_ROUTER_THRESHOLD", "0.8"))
+    # longer messages always go to the llm router
+    PRE_ROUTER_MAX_WORDS = int(os.getenv("PRE_ROUTER_MAX_WORDS", "12"))
+
+    # server side conversation store, used when a request carries a session_id
+    CONVERSATION_DB_PATH = os.getenv("CONVERSATION_DB_PATH", "conversations.db")
+    HISTORY_WINDOW_MESSAGES = int(os.getenv("HISTORY_WINDOW_MESSAGES", "6"))
+    HISTORY_SUMMARY_BATCH = int(os.getenv("HISTORY_SUMMARY_BATCH", "4"))
+    # history tokens each node replays in its prompt, routing needs much less than answering
+    HISTORY_TOKEN_BUDGETS = {
+        "write_query": int(os.getenv("HISTORY_BUDGET_WRITE_QUERY", "400")),
+        "chat_agent": int(os.getenv("HISTORY_BUDGET_CHAT_AGENT", "1000")),
+        "generate_answer": int(os.getenv("HISTORY_BUDGET_GENERATE_ANSWER", "1500")),
+        "plot_agent": int(os.getenv("HISTORY_BUDGET_PLOT_AGENT", "600")),
+    }
+
+    # nl-to-sql cache in front of write_query
+    QUERY_CACHE_ENABLED = os.getenv("QUERY_CACHE_ENABLED", "true").lower() == "true"
+    QUERY_CACHE_MAX_ENTRIES = int(os.getenv("QUERY_CACHE_MAX_ENTRIES", "512"))
+    QUERY_CACHE_TTL_SECONDS = float(os.getenv("QUERY_CACHE_TTL_SECONDS", "3600"))
+    QUERY_CACHE_SIMILARITY = float(os.getenv("QUERY_CACHE_SIMILARITY", "0.9"))
+    # similar questions also need the same non-filler words, false for exact matches only
+    QUERY_CACHE_SIMILARITY_ENABLED = (
+        os.getenv("QUERY_CACHE_SIMILARITY_ENABLED", "true").lower() == "true"
+    )
+
+    # query result cache in execute_query, the shared path is a sqlite file all workers use
+    RESULT_CACHE_ENABLED = os.getenv("RESULT_CACHE_ENABLED", "true").lower() == "true"
+    RESULT_CACHE_MAX_BYTES = int(os.getenv("RESULT_CACHE_MAX_BYTES", str(64 * 2**20)))
+    RESULT_CACHE_SHARED_PATH = os.getenv("RESULT_CACHE_SHARED_PATH", "")
+    RESULT_CACHE_SHARED_MAX_BYTES = int(
+        os.getenv("RESULT_CACHE_SHARED_MAX_BYTES", str(512 * 2**20))
+    )
+
+    # bounds on what execute_query keeps from a result set
+    RESULT_MAX_ROWS = int(os.getenv("RESULT_MAX_ROWS", "1000"))
+    RESULT_MAX_BYTES = int(os.getenv("RESULT_MAX_BYTES", str(2**20)))
+    RESULT_COUNT_LIMIT = int(os.getenv("RESULT_COUNT_LIMIT", "100000"))
+    RESULT_FETCH_SIZE = int(os.getenv("RESULT_FETCH_SIZE", "500"))
+    RESULT_TEXT_ROWS = int(os.getenv("RESULT_TEXT_ROWS", "100"))
+
+    # results above these sizes reach generate_answer as a digest plus a sample
+    PROFILE_ROW_THRESHOLD = int(os.getenv("PROFILE_ROW_THRESHOLD", "50"))
+    PROFILE_BYTE_THRESHOLD = int(os.getenv("PROFILE_BYTE_THRESHOLD", "16384"))
+    PROFILE_SAMPLE_ROWS = int(os.getenv("PROFILE_SAMPLE_ROWS", "10"))
+    PROFILE_TOP_K = int(os.getenv("PROFILE_TOP_K", "5"))
+    PROFILE_MAX_BUCKETS = int(os.getenv("PROFILE_MAX_BUCKETS", "31"))
+
+    # plot_agent turns the llm's chart spec into a figure server side
+    PLOT_FORMAT = os.getenv("PLOT_FORMAT", "json")  # json or png
+    # points per series above which line, area and scatter charts are downsampled
+    PLOT_MAX_POINTS = int(os.getenv("PLOT_MAX_POINTS", "500"))
+    PLOT_MAX_CATEGORIES = int(os.getenv("PLOT_MAX_CATEGORIES", "30"))
+    # render processes, 0 renders in the calling thread
+    PLOT_WORKERS = int(os.getenv("PLOT_WORKERS", "2"))
+    PLOT_CACHE_ENTRIES = int(os.getenv("PLOT_CACHE_ENTRIES", "256"))
+
+    # guard between write_query and execute_query
+    GUARD_ENABLED = os.getenv("GUARD_ENABLED", "true").lower() == "true"
+    GUARD_MAX_COST = float(os.getenv("GUARD_MAX_COST", "1000000"))
+    GUARD_MAX_PLAN_ROWS = int(os.getenv("GUARD_MAX_PLAN_ROWS", "1000000"))
+    STATEMENT_TIMEOUT_MS = int(os.getenv("STATEMENT_TIMEOUT_MS", "15000"))
+    # parse and resolve generated SQL against the cached schema before the guard
+    VALIDATOR_ENABLED = os.getenv("VALIDATOR_ENABLED", "true").lower() == "true"
+    # write this many SQL candidates at once and keep the first that runs, 1 keeps
+    # the sequential retry loop only
+    SQL_CANDIDATES = int(os.getenv("SQL_CANDIDATES", "1"))
+    # run aggregate queries on the loader's rollup tables when one can answer them
+    ROLLUP_REWRITE_ENABLED = (
+        os.getenv("ROLLUP_REWRITE_ENABLED", "true").lower() == "true"
+    )
+    ROLLUP_CATALOG_TABLE = "_rollups"
+    # review questions search the loader's text index instead of scanning with ILIKE
+    TEXT_SEARCH_ENABLED = os.getenv("TEXT_SEARCH_ENABLED", "true").lower() == "true"
+    TEXT_INDEX_CATALOG_TABLE = "_text_index"
+    TEXT_SEARCH_TOP_K = int(os.getenv("TEXT_SEARCH_TOP_K", "5"))
+    # characters of each retrieved text passed to generate_answer
+    TEXT_SEARCH_MAX_CHARS = int(os.getenv("TEXT_SEARCH_MAX_CHARS", "1000"))
+
+    # POST /chat/batch, questions per request and graph runs at a time per batch
+    BATCH_MAX_QUESTIONS = int(os.getenv("BATCH_MAX_QUESTIONS", "50"))
+    BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "8"))
+
+    # turns slower than this are logged with their per-node trace, plus a sample of the rest
+    SLOW_TURN_SECONDS = float(os.getenv("SLOW_TURN_SECONDS", "15"))
+    SLOW_TURN_SAMPLE_RATE = float(os.getenv("SLOW_TURN_SAMPLE_RATE", "0"))
+    # jsonl file for the slow-turn log, printed when empty
+    SLOW_TURN_LOG_PATH = os.getenv("SLOW_TURN_LOG_PATH", "")
+
     def DATABASE_URI(self):
         return f"{self.DB_TYPE}+{self.DB_DRIVER}://{self.DB_USER}:{self.DB_PASSWORD}@{self.DB_HOST}:{self.DB_PORT}/{self.DB_NAME}"
+
+    def ASYNC_DATABASE_URI(self):
+        return f"{self.DB_TYPE}+{self.ASYNC_DB_DRIVER}://{self.DB_USER}:{self.DB_PASSWORD}@{self.DB_HOST}:{self.DB_PORT}/{self.DB_NAME}"
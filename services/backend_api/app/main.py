@@ -1,30 +1,58 @@
+import json
+import time
 from contextlib import asynccontextmanager
 
-from fastapi import Depends, FastAPI
+from fastapi import Depends, FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from sqlalchemy import create_engine, text
+from sqlalchemy.ext.asyncio import create_async_engine
 
+from app.chat_services.agents import Agent
 from app.chat_services.chat import ChatService
+from app.chat_services.conversation import ConversationMemory, ConversationStore
+from app.chat_services.graph import GraphBuilder
+from app.chat_services.llm_pool import llm_registry
+from app.chat_services.metrics import metrics, service_metrics
 from app.config import Config
-from app.models.chat_models import ChatRequest, ChatResponse
+from app.models.chat_models import (
+    BatchRequest,
+    BatchResponse,
+    ChatRequest,
+    ChatResponse,
+)
 
 # database
 config = Config()
 db_uri = config.DATABASE_URI()
 engine = create_engine(db_uri)
+async_engine = create_async_engine(config.ASYNC_DATABASE_URI())
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     try:
-        with engine.connect() as conn:
-            conn.execute(text("SELECT 1"))
+        async with async_engine.connect() as conn:
+            await conn.execute(text("SELECT 1"))
         print("Database connection established")
     except Exception as e:
         print(f"Database connection failed: {e}")
         raise
+
+    # build the agent and compile the graph once, every request shares them
+    agent = Agent(engine=engine, async_engine=async_engine)
+    graph = GraphBuilder(agent=agent).build_graph()
+    app.state.agent = agent
+    memory = ConversationMemory(
+        ConversationStore(Config.CONVERSATION_DB_PATH), agent.llms, agent.scheduler
+    )
+    app.state.chat_service = ChatService(graph=graph, memory=memory)
+    print("Agent and graph initialised")
     yield
+    agent.chart_renderer.close()
     engine.dispose()
+    await async_engine.dispose()
+    await llm_registry.aclose()
     print("Database connection closed")
 
 
@@ -39,12 +67,85 @@ app.add_middleware(
 )
 
 
+def get_chat_service(request: Request) -> ChatService:
+    return request.app.state.chat_service
+
+
 @app.post("/chat", response_model=ChatResponse)
 async def agent_chat(
-    request: ChatRequest, chat_service: ChatService = Depends(ChatService)
+    request: ChatRequest, chat_service: ChatService = Depends(get_chat_service)
+):
+    result = await chat_service.achat_flow(
+        request.message, request.history, request.session_id
+    )
+    return ChatResponse(
+        message=chat_service.answer(result), session_id=request.session_id
+    )
+
+
+@app.post("/chat/batch", response_model=BatchResponse)
+async def agent_chat_batch(
+    request: BatchRequest, chat_service: ChatService = Depends(get_chat_service)
 ):
-    result = chat_service.chat_flow(request.message, request.history)
-    return ChatResponse(message=result["agent_answer"])
+    """Answer many independent questions at once, e.g. one per dashboard tile.
+
+    Identical questions and identical generated SQL in flight are computed once.
+    """
+    if len(request.questions) > Config.BATCH_MAX_QUESTIONS:
+        raise HTTPException(
+            status_code=422,
+            detail=f"At most {Config.BATCH_MAX_QUESTIONS} questions per batch",
+        )
+    start = time.perf_counter()
+    concurrency = min(
+        request.concurrency or Config.BATCH_CONCURRENCY, Config.BATCH_CONCURRENCY
+    )
+    items = await chat_service.abatch_flow(request.questions, concurrency)
+    return BatchResponse(
+        items=items, elapsed_ms=round((time.perf_counter() - start) * 1000, 1)
+    )
+
+
+def sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+@app.post("/chat/stream")
+async def agent_chat_stream(
+    request: ChatRequest, chat_service: ChatService = Depends(get_chat_service)
+):
+    """Server-sent events: `node` as each node finishes, `token` while the answer is generated, then `done`."""
+
+    async def events():
+        try:
+            async for event, data in chat_service.astream_flow(
+                request.message, request.history, request.session_id
+            ):
+                yield sse(event, data)
+        except Exception as e:
+            yield sse("error", {"message": str(e)})
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        # keep proxies from buffering the stream
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.get("/budget")
+def llm_budget(request: Request):
+    """Token budget left per model, queued calls, fallbacks and 429s."""
+    return request.app.state.agent.scheduler.state()
+
+
+@app.get("/metrics")
+def prometheus_metrics(request: Request):
+    """Per-node latency, LLM tokens, SQL time and rows, retries and cache hit rates."""
+    service = service_metrics(request.app.state.agent, request.app.state.chat_service)
+    return PlainTextResponse(
+        metrics.render(service), media_type="text/plain; version=0.0.4"
+    )
 
 
 @app.get("/health")
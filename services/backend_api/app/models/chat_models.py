@@ -14,10 +14,54 @@ class ChatRequest(BaseModel):
     history: list[History] = []
     message: str
     # user_id: str
+    session_id: Annotated[
+        str | None,
+        Field(
+            description="Conversation key. When set the server keeps the history and `history` is ignored."
+        ),
+    ] = None
 
 
 class ChatResponse(BaseModel):
     message: str
+    session_id: str | None = None
+
+
+class BatchRequest(BaseModel):
+    questions: Annotated[
+        list[str],
+        Field(
+            min_length=1,
+            description="Independent questions, each answered without history.",
+        ),
+    ]
+    concurrency: Annotated[
+        int | None,
+        Field(
+            ge=1,
+            description="Questions answered at a time, at most BATCH_CONCURRENCY.",
+        ),
+    ] = None
+
+
+class BatchItem(BaseModel):
+    question: str
+    status: Literal["success", "error"]
+    message: str = ""
+    sql_query: str = ""
+    error: str | None = None
+    elapsed_ms: Annotated[
+        float, Field(description="From the start of the batch until this answer.")
+    ]
+    shared: Annotated[
+        bool,
+        Field(description="Answered by the run of an identical question in flight."),
+    ] = False
+
+
+class BatchResponse(BaseModel):
+    items: list[BatchItem]
+    elapsed_ms: float
 
 
 class QueryOutput(BaseModel):
@@ -42,3 +86,41 @@ class QueryOutput(BaseModel):
             description="Whether the query is not about query the data in database. Set to True if the query is not allowed to be executed."
         ),
     ]
+    review_search: Annotated[
+        str,
+        Field(
+            description="Search keywords when the question is about what customers say in their reviews, otherwise empty."
+        ),
+    ] = ""
+
+
+class ChartSpec(BaseModel):
+    chart_type: Annotated[
+        Literal["bar", "line", "area", "scatter", "pie", "histogram"],
+        Field(description="Kind of chart that best answers the request."),
+    ]
+    x: Annotated[
+        str,
+        Field(
+            description="Result column on the x axis, the labels of a pie, or the values of a histogram."
+        ),
+    ]
+    y: Annotated[
+        list[str],
+        Field(
+            description="Numeric result columns to plot, the values of a pie. Empty for a histogram."
+        ),
+    ] = []
+    color: Annotated[
+        str | None,
+        Field(
+            description="Result column that splits the data into one series per value, if any."
+        ),
+    ] = None
+    title: Annotated[str, Field(description="Short chart title.")] = ""
+    insight: Annotated[
+        str,
+        Field(
+            description="Two or three sentences pointing out trends, anomalies or other insights in the data."
+        ),
+    ] = ""
@@ -0,0 +1,99 @@
+import datetime
+import decimal
+
+import pandas as pd
+from pydantic import BaseModel
+
+
+class QueryResult(BaseModel):
+    """Typed, columnar and bounded result of one SQL query.
+
+    Values are stored per column as JSON friendly python values, `dtypes`
+    keeps the original type so `to_frame` can rebuild typed columns.
+    """
+
+    columns: list[str] = []
+    dtypes: dict[str, str] = {}
+    data: dict[str, list] = {}
+    row_count: int = 0  # rows kept in data
+    total_rows: int = 0  # rows the query returned, a lower bound if not exact
+    total_rows_exact: bool = True
+    byte_count: int = 0
+    truncated: bool = False
+
+    def to_frame(self) -> pd.DataFrame:
+        frame = pd.DataFrame(self.data, columns=self.columns)
+        for column, dtype in self.dtypes.items():
+            if dtype in ("datetime", "date"):
+                frame[column] = _to_datetime(frame[column])
+        return frame
+
+    def rows(self, limit: int | None = None) -> list[tuple]:
+        n = self.row_count if limit is None else min(limit, self.row_count)
+        return [tuple(self.data[c][i] for c in self.columns) for i in range(n)]
+
+    def truncation_note(self) -> str:
+        if not self.truncated:
+            return ""
+        total = (
+            f"{self.total_rows}"
+            if self.total_rows_exact
+            else f"at least {self.total_rows}"
+        )
+        return f"the query returned {total} rows, only the first {self.row_count} were kept"
+
+    def to_text(self, max_rows: int, max_string_length: int = 300) -> str:
+        """Compact text view of the result for the LLM prompts."""
+        if not self.columns:
+            return ""
+        lines = [" | ".join(self.columns)]
+        for row in self.rows(max_rows):
+            lines.append(
+                " | ".join(_shorten(value, max_string_length) for value in row)
+            )
+        notes = []
+        if self.row_count > max_rows:
+            notes.append(f"showing {max_rows} of {self.row_count} rows")
+        if self.truncated:
+            notes.append(self.truncation_note())
+        if notes:
+            lines.append(f"({'; '.join(notes)})")
+        return "\n".join(lines)
+
+
+def _to_datetime(series: pd.Series) -> pd.Series:
+    try:
+        return pd.to_datetime(series, format="ISO8601")
+    except ValueError:
+        # mixed UTC offsets, or naive next to aware values, only parse as UTC
+        return pd.to_datetime(series, format="ISO8601", utc=True)
+
+
+def _shorten(value, length: int) -> str:
+    text = "NULL" if value is None else str(value)
+    return text if len(text) <= length else text[:length] + "..."
+
+
+def dtype_of(value) -> str:
+    # bool before int, datetime before date: they are subclasses
+    for python_type, name in [
+        (bool, "bool"),
+        (int, "int"),
+        (float, "float"),
+        (decimal.Decimal, "float"),
+        (datetime.datetime, "datetime"),
+        (datetime.date, "date"),
+    ]:
+        if isinstance(value, python_type):
+            return name
+    return "str"
+
+
+def to_python(value):
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    if isinstance(value, decimal.Decimal):
+        return float(value)
+    if isinstance(value, (datetime.date, datetime.time)):
+        return value.isoformat()
+    return str(value)
@@ -1,5 +1,6 @@
 from typing import Annotated, Literal
 
+from app.models.query_result import QueryResult
 from langgraph.graph.message import add_messages
 from pydantic import BaseModel
 
@@ -13,8 +14,14 @@ class State(BaseModel):
     sql_query_execution_status: Literal["success", "failure"] = "failure"
     sql_error_count: int = 0
     sql_query_error: str = ""
-    sql_result: str = ""
+    rollup_query: str = ""  # sql_query over a rollup table, executed in its place
+    review_search: str = ""  # keywords retrieve_reviews searches the review texts for
+    sql_result: str = ""  # bounded text view of query_result for the prompts
+    query_result: QueryResult | None = None
     agent_answer: str = ""
     need_visualise: bool = False
+    chart: str = ""  # rendered chart of the answer, kept out of the messages
     chit_chat: bool = False
     out_of_policy: bool = False
+    pre_route: str = ""  # pre-router guess for a turn it left to write_query
+    llm_busy: bool = False  # every model was out of token budget
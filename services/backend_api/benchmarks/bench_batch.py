@@ -0,0 +1,127 @@
+"""A dashboard's questions one at a time against one `ChatService.abatch_flow`.
+
+Builds a batch from the bench_graph corpus the way a dashboard sends it:
+every tile's question, some asked by several tiles and some worded
+differently but writing the same SQL. The batch is answered once question
+by question, as separate `/chat` calls would, and once through the batch
+flow. Reports the wall time of both, how many graph runs and SQL executions
+the batch shared, and checks both gave the same answers.
+
+Run from `services/backend_api`:
+    python -m benchmarks.bench_batch --llm-latency-ms 200 --concurrency 8
+"""
+
+import argparse
+import asyncio
+import contextlib
+import io
+import os
+import tempfile
+import time
+
+from app.chat_services.agents import Agent
+from app.chat_services.chart_renderer import ChartRenderer
+from app.chat_services.chat import ChatService
+from app.chat_services.graph import GraphBuilder
+from app.chat_services.llm_scheduler import LLMScheduler
+from app.config import Config
+from benchmarks.bench_graph import CORPUS, build_database
+from benchmarks.fake_llm import CHIT_CHAT, OUT_OF_POLICY, Scenario, ScriptedLLMs
+from sqlalchemy import create_engine
+
+DATA_SCENARIOS = [s for s in CORPUS if s.kind not in (CHIT_CHAT, OUT_OF_POLICY)]
+# other wordings of the same tiles, the LLM writes the same SQL for them
+REWORDED = [
+    Scenario(f"{s.question} (tile {i})", s.kind, s.sql, s.bad_sql, s.review_search)
+    for i, s in enumerate(DATA_SCENARIOS)
+]
+
+
+def dashboard(tiles: int) -> list[str]:
+    """`tiles` questions, each next to its rewording, the corpus repeated to fill them."""
+    questions = [s.question for pair in zip(DATA_SCENARIOS, REWORDED) for s in pair]
+    return [questions[i % len(questions)] for i in range(tiles)]
+
+
+async def one_by_one(chat_service: ChatService, questions: list[str]) -> list[str]:
+    answers = []
+    for question in questions:
+        result = await chat_service.achat_flow(question, [])
+        answers.append(result["messages"][-1].content)
+    return answers
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument(
+        "--db-path", default=os.path.join(tempfile.gettempdir(), "sql_agent_bench.db")
+    )
+    parser.add_argument("--tiles", type=int, default=40)
+    parser.add_argument("--concurrency", type=int, default=Config.BATCH_CONCURRENCY)
+    parser.add_argument("--llm-latency-ms", type=float, default=200)
+    args = parser.parse_args()
+
+    # the caches would answer every repeat, leave only the in-flight sharing
+    Config.QUERY_CACHE_ENABLED = False
+    Config.RESULT_CACHE_ENABLED = False
+    Config.SLOW_TURN_SAMPLE_RATE = 0
+    Config.SLOW_TURN_SECONDS = float("inf")
+
+    engine = create_engine(build_database(args.db_path))
+    scheduler = LLMScheduler()
+    scheduler.enabled = False
+    agent = Agent(
+        engine=engine,
+        llms=ScriptedLLMs(CORPUS + REWORDED, args.llm_latency_ms),
+        scheduler=scheduler,
+        chart_renderer=ChartRenderer(workers=0, max_entries=0),
+    )
+    chat_service = ChatService(graph=GraphBuilder(agent=agent).build_graph())
+    questions = dashboard(args.tiles)
+
+    async def run():
+        start = time.perf_counter()
+        serial = await one_by_one(chat_service, questions)
+        serial_ms = (time.perf_counter() - start) * 1000
+        sql_before = agent.inflight_sql.stats()
+        start = time.perf_counter()
+        items = await chat_service.abatch_flow(questions, args.concurrency)
+        batch_ms = (time.perf_counter() - start) * 1000
+        return serial, serial_ms, items, batch_ms, sql_before
+
+    # nodes print progress on every turn
+    with contextlib.redirect_stdout(io.StringIO()):
+        serial, serial_ms, items, batch_ms, sql_before = asyncio.run(run())
+    engine.dispose()
+
+    sql = agent.inflight_sql.stats()
+    shared_questions = sum(item["shared"] for item in items)
+    errors = [item for item in items if item["status"] == "error"]
+    different = sum(
+        item["message"] != answer
+        for item, answer in zip(items, serial)
+        if item["status"] == "success"
+    )
+    latencies = sorted(item["elapsed_ms"] for item in items)
+    print(
+        f"{len(questions)} tiles, {len(set(questions))} distinct questions, "
+        f"fake LLM {args.llm_latency_ms:g} ms, concurrency {args.concurrency}\n"
+    )
+    print(f"one by one  {serial_ms:9,.0f} ms")
+    print(
+        f"batch       {batch_ms:9,.0f} ms  {serial_ms / batch_ms:.1f}x, "
+        f"slowest tile {latencies[-1]:,.0f} ms"
+    )
+    print(
+        f"shared      {shared_questions} questions, "
+        f"{sql['shared'] - sql_before['shared']} of "
+        f"{sql['calls'] - sql_before['calls']} SQL executions"
+    )
+    if errors or different:
+        print(f"\n{len(errors)} errors, {different} answers differ")
+
+
+if __name__ == "__main__":
+    main()
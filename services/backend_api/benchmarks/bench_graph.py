@@ -0,0 +1,377 @@
+"""End-to-end latency and throughput of the compiled graph, offline.
+
+Loads the cleaned CSVs into a local SQLite file, swaps Groq for the scripted
+fake in `benchmarks.fake_llm`, and replays a corpus covering the chit-chat,
+out-of-policy, SQL, plot, retry and review search paths through `GraphBuilder`. The corpus
+runs once serially on `graph.invoke` and once concurrently on `graph.ainvoke`.
+Each run reports p50/p95/p99 turn latency, throughput and the time spent per
+node. It also checks every turn ended on the node its path should end on.
+
+`--budget` keeps the token budget on, with the `GROQ_MODEL_LIMITS` buckets
+scaled by `--budget-scale`. The fake calls far faster than the free plan
+allows, so real sized buckets would only measure waiting.
+
+`--save` writes the numbers to a JSON file. `--baseline` compares against
+one and exits non-zero on a wrong path, or when p95 or throughput is more
+than `--tolerance` worse.
+
+Run from `services/backend_api`:
+    python -m benchmarks.bench_graph --llm-latency-ms 20 --concurrency 8
+    python -m benchmarks.bench_graph --save bench.json
+    python -m benchmarks.bench_graph --baseline bench.json
+"""
+
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+from collections import defaultdict
+
+import pandas as pd
+from app.chat_services.agents import Agent
+from app.chat_services.chart_renderer import ChartRenderer
+from app.chat_services.graph import GraphBuilder
+from app.chat_services.llm_scheduler import LLMScheduler
+from app.chat_services.metrics import metrics
+from app.config import GROQ_MODEL_LIMITS, Config
+from app.models.state import State
+from benchmarks.fake_llm import (
+    CHIT_CHAT,
+    OUT_OF_POLICY,
+    PLOT,
+    RETRY,
+    REVIEW,
+    SQL,
+    Scenario,
+    ScriptedLLMs,
+)
+from langchain_core.messages import HumanMessage
+from sqlalchemy import create_engine, text
+
+DATABASE_SERVICE = os.path.join(os.path.dirname(__file__), "..", "..", "database")
+DATA_FOLDER = os.path.join(DATABASE_SERVICE, "cleaned_resources")
+sys.path.insert(0, DATABASE_SERVICE)
+from text_index import refresh_text_index
+
+CORPUS = [
+    Scenario("hi", CHIT_CHAT),
+    Scenario("thanks a lot!", CHIT_CHAT),
+    Scenario("Hi, I'm Sam from the finance team", CHIT_CHAT),
+    Scenario("tell me a joke", OUT_OF_POLICY),
+    Scenario("what's the weather today?", OUT_OF_POLICY),
+    Scenario(
+        "What are the top 5 products by revenue?",
+        SQL,
+        "SELECT product, SUM(total_price) AS revenue FROM sales_transactions "
+        "GROUP BY product ORDER BY revenue DESC LIMIT 5",
+    ),
+    Scenario(
+        "how many customers do we have?",
+        SQL,
+        "SELECT COUNT(*) FROM sales_customers",
+    ),
+    Scenario(
+        "total quantity sold per franchise",
+        SQL,
+        "SELECT f.name, SUM(t.quantity) FROM sales_transactions t "
+        "JOIN sales_franchises f ON t.franchise_id = f.franchise_id GROUP BY f.name",
+    ),
+    Scenario(
+        "list every transaction in May 2024",
+        SQL,
+        "SELECT transaction_id, date_time, product, total_price FROM sales_transactions "
+        "WHERE date_time >= '2024-05-01' AND date_time < '2024-06-01'",
+    ),
+    Scenario(
+        "which suppliers are approved?",
+        SQL,
+        "SELECT name, ingredient FROM sales_suppliers WHERE approved = 1",
+    ),
+    Scenario(
+        "show sales by payment method as a bar chart",
+        PLOT,
+        "SELECT payment_method, SUM(total_price) FROM sales_transactions "
+        "GROUP BY payment_method",
+    ),
+    Scenario(
+        "plot daily revenue",
+        PLOT,
+        "SELECT DATE(date_time) AS day, SUM(total_price) FROM sales_transactions "
+        "GROUP BY day ORDER BY day",
+    ),
+    Scenario(
+        "average unit price per product",
+        RETRY,
+        "SELECT product, AVG(unit_price) FROM sales_transactions GROUP BY product",
+        "SELECT prodct, AVG(unit_prise) FROM sales_transactions GROUP BY prodct",
+    ),
+    Scenario(
+        "how many reviews does each franchise have?",
+        RETRY,
+        "SELECT franchise_id, COUNT(*) FROM media_customer_reviews GROUP BY franchise_id",
+        "SELECT franchise_id, COUNT(*) FROM media_customer_review GROUP BY franchise_id",
+    ),
+    Scenario(
+        "what do customers complain about with the oatmeal cookies?",
+        REVIEW,
+        "SELECT franchise_id, review FROM media_customer_reviews "
+        "WHERE review LIKE '%oatmeal%' LIMIT 20",
+        review_search="oatmeal cookies dry complaint",
+    ),
+]
+
+# the node each path has to end on
+LAST_NODE = {
+    CHIT_CHAT: "chat_agent",
+    OUT_OF_POLICY: "cannot_answer",
+    SQL: "generate_answer",
+    PLOT: "plot_agent",
+    RETRY: "generate_answer",
+    REVIEW: "generate_answer",
+}
+
+
+def build_database(path: str, rebuild: bool = False) -> str:
+    """SQLite copy of the cleaned CSVs, the stand-in for the Postgres service."""
+    if rebuild and os.path.exists(path):
+        os.remove(path)
+    url = f"sqlite:///{path}"
+    if os.path.exists(path):
+        return url
+    engine = create_engine(url)
+    for file_name in sorted(os.listdir(DATA_FOLDER)):
+        if file_name.endswith(".csv"):
+            frame = pd.read_csv(os.path.join(DATA_FOLDER, file_name))
+            frame.to_sql(file_name[:-4], engine, index=False)
+    with engine.begin() as conn:
+        conn.execute(
+            text(
+                f"CREATE TABLE {Config.DATA_VERSION_TABLE} (id INTEGER PRIMARY KEY, version INTEGER NOT NULL)"
+            )
+        )
+        conn.execute(text(f"INSERT INTO {Config.DATA_VERSION_TABLE} VALUES (1, 1)"))
+    with contextlib.redirect_stdout(io.StringIO()):
+        refresh_text_index(engine, [])
+    engine.dispose()
+    return url
+
+
+def turn_record(scenario: Scenario, trace, seconds: float) -> dict:
+    nodes = [event for event in trace.events if "node" in event]
+    return {
+        "kind": scenario.kind,
+        "seconds": seconds,
+        "nodes": nodes,
+        "last_node": nodes[-1]["node"] if nodes else "",
+        "retries": max(sum(n["node"] == "write_query" for n in nodes) - 1, 0),
+    }
+
+
+def run_turn(graph, scenario: Scenario) -> dict:
+    turn = metrics.start_turn()
+    start = time.perf_counter()
+    graph.invoke(State(messages=[HumanMessage(scenario.question)]))
+    seconds = time.perf_counter() - start
+    metrics.finish_turn(turn, scenario.question)
+    return turn_record(scenario, turn, seconds)
+
+
+async def arun_turn(graph, scenario: Scenario, limit: asyncio.Semaphore) -> dict:
+    async with limit:
+        turn = metrics.start_turn()
+        start = time.perf_counter()
+        await graph.ainvoke(State(messages=[HumanMessage(scenario.question)]))
+        seconds = time.perf_counter() - start
+        metrics.finish_turn(turn, scenario.question)
+        return turn_record(scenario, turn, seconds)
+
+
+def run_serial(graph, turns: list[Scenario]) -> tuple[list[dict], float]:
+    start = time.perf_counter()
+    records = [run_turn(graph, scenario) for scenario in turns]
+    return records, time.perf_counter() - start
+
+
+def run_concurrent(
+    graph, turns: list[Scenario], concurrency: int
+) -> tuple[list[dict], float]:
+    async def run():
+        limit = asyncio.Semaphore(concurrency)
+        return await asyncio.gather(
+            *(arun_turn(graph, scenario, limit) for scenario in turns)
+        )
+
+    start = time.perf_counter()
+    records = asyncio.run(run())
+    return records, time.perf_counter() - start
+
+
+def percentiles(values: list[float]) -> dict:
+    if len(values) < 2:
+        value = values[0] if values else 0.0
+        return {"p50": value, "p95": value, "p99": value}
+    cuts = statistics.quantiles(values, n=100, method="inclusive")
+    return {"p50": cuts[49], "p95": cuts[94], "p99": cuts[98]}
+
+
+def summarize(records: list[dict], wall_seconds: float) -> dict:
+    by_node = defaultdict(list)
+    for record in records:
+        for node in record["nodes"]:
+            by_node[node["node"]].append(node["ms"])
+    turn_ms = [record["seconds"] * 1000 for record in records]
+    return {
+        "turns": len(records),
+        "throughput": len(records) / wall_seconds,
+        "latency_ms": percentiles(turn_ms),
+        "retries": sum(record["retries"] for record in records),
+        "wrong_path": [
+            f"{record['kind']} ended on {record['last_node']}"
+            for record in records
+            if record["last_node"] != LAST_NODE[record["kind"]]
+        ],
+        "nodes": {
+            node: {
+                "calls": len(ms),
+                "p50_ms": percentiles(ms)["p50"],
+                "p95_ms": percentiles(ms)["p95"],
+                "share": sum(ms) / sum(turn_ms),
+            }
+            for node, ms in sorted(by_node.items())
+        },
+    }
+
+
+def report(name: str, summary: dict):
+    latency = summary["latency_ms"]
+    print(
+        f"{name:<12} {summary['turns']} turns  {summary['throughput']:7.1f} turns/s  "
+        f"p50={latency['p50']:8.1f} ms  p95={latency['p95']:8.1f} ms  "
+        f"p99={latency['p99']:8.1f} ms  retries={summary['retries']}"
+    )
+    for node, stats in summary["nodes"].items():
+        print(
+            f"  {node:<16} calls={stats['calls']:<4} p50={stats['p50_ms']:8.2f} ms  "
+            f"p95={stats['p95_ms']:8.2f} ms  share={stats['share']:6.1%}"
+        )
+    for problem in summary["wrong_path"]:
+        print(f"  ❌ {problem}")
+
+
+def regressions(results: dict, baseline: dict, tolerance: float) -> list[str]:
+    problems = []
+    for mode, summary in results.items():
+        problems += [f"{mode}: {problem}" for problem in summary["wrong_path"]]
+        if mode not in baseline:
+            continue
+        before = baseline[mode]
+        p95, p95_before = summary["latency_ms"]["p95"], before["latency_ms"]["p95"]
+        if p95 > p95_before * (1 + tolerance):
+            problems.append(f"{mode}: p95 {p95:.1f} ms, baseline {p95_before:.1f} ms")
+        throughput, throughput_before = summary["throughput"], before["throughput"]
+        if throughput < throughput_before * (1 - tolerance):
+            problems.append(
+                f"{mode}: {throughput:.1f} turns/s, baseline {throughput_before:.1f}"
+            )
+    return problems
+
+
+def progress(message: str):
+    print(f"... {message}", file=sys.stderr, flush=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument(
+        "--db-path", default=os.path.join(tempfile.gettempdir(), "sql_agent_bench.db")
+    )
+    parser.add_argument("--rebuild", action="store_true", help="reload the CSVs")
+    parser.add_argument("--rounds", type=int, default=5, help="corpus replays per run")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--llm-latency-ms", type=float, default=20)
+    parser.add_argument("--token-latency-ms", type=float, default=0)
+    parser.add_argument("--cache", action="store_true", help="keep the query caches on")
+    parser.add_argument(
+        "--budget", action="store_true", help="keep the token budget on"
+    )
+    parser.add_argument(
+        "--budget-scale",
+        type=float,
+        default=100,
+        help="multiplies the per-minute and per-day token limits under --budget",
+    )
+    parser.add_argument("--save", help="write the results to this JSON file")
+    parser.add_argument("--baseline", help="fail on regressions against this file")
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    args = parser.parse_args()
+
+    # repeated questions would otherwise be served from cache after the first round
+    Config.QUERY_CACHE_ENABLED = args.cache
+    Config.RESULT_CACHE_ENABLED = args.cache
+    Config.SLOW_TURN_SAMPLE_RATE = 0
+    Config.SLOW_TURN_SECONDS = float("inf")
+
+    engine = create_engine(build_database(args.db_path, args.rebuild))
+    scheduler = LLMScheduler(
+        limits={
+            model: (int(minute * args.budget_scale), int(day * args.budget_scale))
+            for model, (minute, day) in GROQ_MODEL_LIMITS.items()
+        }
+    )
+    scheduler.enabled = args.budget
+    llms = ScriptedLLMs(CORPUS, args.llm_latency_ms, args.token_latency_ms)
+    # rendered charts are cached too, the same switch turns that off
+    chart_renderer = ChartRenderer(
+        max_entries=Config.PLOT_CACHE_ENTRIES if args.cache else 0
+    )
+    agent = Agent(
+        engine=engine, llms=llms, scheduler=scheduler, chart_renderer=chart_renderer
+    )
+    graph = GraphBuilder(agent=agent).build_graph()
+    turns = CORPUS * args.rounds
+
+    # nodes print progress on every turn, the benchmark's own goes to stderr
+    with contextlib.redirect_stdout(io.StringIO()):
+        progress("warming up")
+        run_serial(graph, CORPUS)  # warm up the schema cache and retriever
+        progress(f"serial run, {len(turns)} turns")
+        serial = summarize(*run_serial(graph, turns))
+        progress(f"concurrent run, {len(turns)} turns")
+        concurrent = summarize(*run_concurrent(graph, turns, args.concurrency))
+    chart_renderer.close()
+    engine.dispose()
+
+    print(
+        f"{len(turns)} turns per run, fake LLM {args.llm_latency_ms:g} ms "
+        f"+ {args.token_latency_ms:g} ms/token, caches {'on' if args.cache else 'off'}\n"
+    )
+    report("serial", serial)
+    report(f"concurrent x{args.concurrency}", concurrent)
+    results = {"serial": serial, "concurrent": concurrent}
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"\nsaved to {args.save}")
+    if args.baseline:
+        with open(args.baseline) as f:
+            problems = regressions(results, json.load(f), args.tolerance)
+    else:
+        problems = regressions(results, {}, args.tolerance)
+    if problems:
+        print("\nregressions:")
+        for problem in problems:
+            print(f"  {problem}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""Precision of the keyword pre-router on a labelled set of turns.
+
+For each threshold prints the precision and recall of the turns the
+pre-router answers itself (the ones that skip the write_query LLM call) and
+the share of turns it saves. A wrong fast-path decision sends a data question
+to chat_agent or cannot_answer, so precision is the number to hold near 1.
+
+Run from `services/backend_api`:
+    python -m benchmarks.bench_pre_router --db-url sqlite:///data.db
+"""
+
+import argparse
+import statistics
+import time
+
+from app.chat_services.pre_router import CHIT_CHAT, DATA, OUT_OF_POLICY, PreRouter
+from app.chat_services.schema_cache import SchemaCache
+from app.chat_services.schema_retriever import SchemaRetriever
+from app.config import Config
+from sqlalchemy import create_engine
+
+LABELLED = [
+    ("hi", CHIT_CHAT),
+    ("Hello there!", CHIT_CHAT),
+    ("hey, how are you doing?", CHIT_CHAT),
+    ("good morning", CHIT_CHAT),
+    ("thanks!", CHIT_CHAT),
+    ("thank you so much", CHIT_CHAT),
+    ("ok great, thanks a lot", CHIT_CHAT),
+    ("bye, see you later", CHIT_CHAT),
+    ("who are you?", CHIT_CHAT),
+    ("cool", CHIT_CHAT),
+    ("Hi, I'm Sam from the finance team", CHIT_CHAT),
+    ("what can you do?", CHIT_CHAT),
+    ("tell me a joke", OUT_OF_POLICY),
+    ("what's the weather today?", OUT_OF_POLICY),
+    ("write a poem about the sea", OUT_OF_POLICY),
+    ("who won the election?", OUT_OF_POLICY),
+    ("can you give me a pasta recipe", OUT_OF_POLICY),
+    ("what is the price of bitcoin", OUT_OF_POLICY),
+    ("recommend me a movie", OUT_OF_POLICY),
+    ("What are the top 5 products by revenue?", DATA),
+    ("how many customers do we have?", DATA),
+    ("show me sales by franchise as a bar chart", DATA),
+    ("Which supplier is approved?", DATA),
+    ("total quantity sold in May 2024", DATA),
+    ("hi, which city has the most franchises?", DATA),
+    ("thanks, now list the suppliers from Asia", DATA),
+    ("what do the reviews say about Golden Gate Ginger", DATA),
+    ("average unit price per payment method", DATA),
+    ("how is the Tokyo store doing?", DATA),
+    ("any news on the Bondi Beach franchise reviews?", DATA),
+    ("what is the best selling cookie", DATA),
+    ("who are our best customers", DATA),
+    ("compare visa and mastercard usage", DATA),
+    ("great, and what about last week?", DATA),
+]
+
+
+def evaluate(router: PreRouter, threshold: float, classified):
+    fast = {CHIT_CHAT: [0, 0], OUT_OF_POLICY: [0, 0]}  # label -> [right, wrong]
+    for (_, truth), (label, confidence) in zip(LABELLED, classified, strict=True):
+        if label != DATA and confidence >= threshold:
+            fast[label][0 if label == truth else 1] += 1
+    return fast
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--db-url", default=Config().DATABASE_URI())
+    args = parser.parse_args()
+
+    engine = create_engine(args.db_url)
+    router = PreRouter(SchemaRetriever(SchemaCache(engine)))
+    router.classify("warm up the schema index")
+
+    timings, classified = [], []
+    for message, _ in LABELLED:
+        start = time.perf_counter()
+        classified.append(router.classify(message))
+        timings.append((time.perf_counter() - start) * 1000)
+    engine.dispose()
+
+    print(
+        f"{len(LABELLED)} labelled turns, classify median "
+        f"{statistics.median(timings):.3f} ms, max {max(timings):.3f} ms\n"
+    )
+    print(f"{'threshold':>9} {'precision':>10} {'recall':>8} {'llm calls saved':>16}")
+    positives = sum(truth != DATA for _, truth in LABELLED)
+    for threshold in (0.5, 0.6, 0.7, 0.8, 0.9, 1.0):
+        fast = evaluate(router, threshold, classified)
+        right = sum(r for r, _ in fast.values())
+        taken = right + sum(w for _, w in fast.values())
+        precision = right / taken if taken else 1.0
+        marker = "  <- configured" if threshold == router.threshold else ""
+        print(
+            f"{threshold:9.1f} {precision:10.2%} {right / positives:8.2%} "
+            f"{taken / len(LABELLED):16.2%}{marker}"
+        )
+
+    print("\nmistakes at the configured threshold:")
+    for (message, truth), (label, confidence) in zip(LABELLED, classified, strict=True):
+        if label != DATA and confidence >= router.threshold and label != truth:
+            print(f"  {message!r}: {label} ({confidence:.2f}), expected {truth}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""Per-request setup cost of the /chat path, before and after sharing singletons.
+
+Run from `services/backend_api`:
+    python -m benchmarks.bench_request_setup --db-url sqlite:///data.db
+"""
+
+import argparse
+import statistics
+import time
+
+from app.chat_services.agents import Agent
+from app.chat_services.chat import ChatService
+from app.chat_services.graph import GraphBuilder
+from app.config import Config
+from sqlalchemy import create_engine
+
+
+def per_request_setup(db_url: str):
+    # what each /chat request paid when ChatService was resolved through Depends
+    engine = create_engine(db_url)
+    agent = Agent(engine=engine)
+    ChatService(graph=GraphBuilder(agent=agent).build_graph())
+    engine.dispose()
+
+
+def shared_setup(chat_service: ChatService):
+    # what each /chat request pays now: a lookup on app.state
+    return chat_service
+
+
+def measure(fn, iterations: int) -> list[float]:
+    timings = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - start) * 1000)
+    return timings
+
+
+def report(name: str, timings: list[float]):
+    p95 = statistics.quantiles(timings, n=20)[-1]
+    print(
+        f"{name:<20} mean={statistics.mean(timings):9.3f} ms  p95={p95:9.3f} ms  total={sum(timings):9.1f} ms"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--db-url", default=Config().DATABASE_URI())
+    parser.add_argument("--iterations", type=int, default=50)
+    args = parser.parse_args()
+
+    engine = create_engine(args.db_url)
+    chat_service = ChatService(
+        graph=GraphBuilder(agent=Agent(engine=engine)).build_graph()
+    )
+
+    before = measure(lambda: per_request_setup(args.db_url), args.iterations)
+    after = measure(lambda: shared_setup(chat_service), args.iterations)
+    engine.dispose()
+
+    print(f"{args.iterations} simulated requests against {args.db_url}")
+    report("per-request setup", before)
+    report("shared singletons", after)
+    print(
+        f"overhead removed per request: {statistics.mean(before) - statistics.mean(after):.3f} ms"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,168 @@
+"""Aggregate queries on the base tables against the same queries rewritten to rollups.
+
+Writes `--rows` rows of sales_transactions (the cleaned file repeated with
+fresh transaction ids, each copy shifted by a week so the days keep growing)
+next to the franchises and customers, builds the loader's rollups with
+`rollups.refresh_rollups`, then runs a workload of generated-looking queries
+both ways through `QueryExecutor`. Each query reports its median time as
+written and on the rollup, or why `RollupRewriter` left it alone, and the
+rewritten results are checked against the originals.
+
+Run from `services/backend_api`, on a temporary SQLite file by default or on
+a scratch database whose sales tables it replaces:
+    python -m benchmarks.bench_rollups --rows 2000000
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+from decimal import Decimal
+
+import pandas as pd
+from app.chat_services.query_executor import QueryExecutor
+from app.chat_services.rollup_rewriter import RollupRewriter
+from app.chat_services.schema_cache import SchemaCache
+from sqlalchemy import create_engine
+
+DATABASE_SERVICE = os.path.join(os.path.dirname(__file__), "..", "..", "database")
+DATA_FOLDER = os.path.join(DATABASE_SERVICE, "cleaned_resources")
+sys.path.insert(0, DATABASE_SERVICE)
+from rollups import refresh_rollups
+
+WORKLOAD = [
+    "SELECT product, SUM(total_price) AS revenue FROM sales_transactions "
+    "GROUP BY product ORDER BY revenue DESC LIMIT 5",
+    "SELECT f.name, SUM(t.total_price) AS revenue FROM sales_transactions t "
+    "JOIN sales_franchises f ON t.franchise_id = f.franchise_id "
+    "GROUP BY f.name ORDER BY revenue DESC",
+    "SELECT f.country, COUNT(*) AS transactions, AVG(t.total_price) AS basket "
+    "FROM sales_transactions t JOIN sales_franchises f "
+    "ON t.franchise_id = f.franchise_id GROUP BY f.country",
+    "SELECT DATE(date_time) AS day, SUM(total_price) AS revenue "
+    "FROM sales_transactions GROUP BY day ORDER BY day",
+    "SELECT payment_method, COUNT(transaction_id), SUM(quantity) "
+    "FROM sales_transactions GROUP BY payment_method",
+    "SELECT c.continent, c.gender, SUM(t.total_price) FROM sales_transactions t "
+    "LEFT JOIN sales_customers c ON c.customer_id = t.customer_id "
+    "GROUP BY c.continent, c.gender ORDER BY 3 DESC",
+    "SELECT COUNT(DISTINCT customer_id) FROM sales_transactions "
+    "WHERE product = 'Golden Gate Ginger'",
+    "SELECT product, MAX(total_price), MIN(quantity) FROM sales_transactions "
+    "WHERE date_time >= '2024-05-01' AND date_time < '2024-06-01' GROUP BY product",
+    "SELECT franchise_id, SUM(total_price) FROM sales_transactions "
+    "GROUP BY franchise_id HAVING SUM(total_price) > 10000 ORDER BY 2 DESC",
+    # not answerable from a rollup, they run as written
+    "SELECT product, AVG(unit_price) FROM sales_transactions GROUP BY product",
+    "SELECT product, SUM(total_price) FROM sales_transactions "
+    "WHERE quantity > 10 GROUP BY product",
+    "SELECT transaction_id, total_price FROM sales_transactions "
+    "ORDER BY total_price DESC LIMIT 10",
+]
+
+
+def write_tables(engine, rows: int):
+    """The dimension tables as they are and a scaled-up sales_transactions."""
+    for table in ("sales_franchises", "sales_customers"):
+        frame = pd.read_csv(os.path.join(DATA_FOLDER, f"{table}.csv"))
+        frame.to_sql(table, engine, if_exists="replace", index=False)
+    source = pd.read_csv(os.path.join(DATA_FOLDER, "sales_transactions.csv"))
+    source["date_time"] = pd.to_datetime(
+        source["date_time"], utc=True, format="ISO8601"
+    )
+    offset = int(source["transaction_id"].max()) + 1
+    for i in range(-(-rows // len(source))):
+        part = source.head(rows - i * len(source)).copy()
+        part["transaction_id"] += i * offset
+        part["date_time"] += pd.Timedelta(weeks=i % 52)
+        part.to_sql(
+            "sales_transactions",
+            engine,
+            if_exists="replace" if i == 0 else "append",
+            index=False,
+            chunksize=50_000,
+        )
+
+
+def timed(executor: QueryExecutor, sql_query: str, iterations: int):
+    times = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        result = executor.run(sql_query)
+        times.append((time.perf_counter() - start) * 1000)
+    return result, statistics.median(times)
+
+
+def rows_of(result) -> list[tuple]:
+    def value(v):
+        if isinstance(v, (float, Decimal)):
+            return round(float(v), 6)
+        return v
+
+    return sorted(
+        (tuple(value(v) for v in row) for row in zip(*result.data.values())), key=repr
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--db-url", help="a scratch database, default a temporary SQLite file"
+    )
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--iterations", type=int, default=5)
+    args = parser.parse_args()
+
+    folder = tempfile.mkdtemp()
+    engine = create_engine(args.db_url or f"sqlite:///{folder}/bench_rollups.db")
+    try:
+        start = time.perf_counter()
+        write_tables(engine, args.rows)
+        print(
+            f"{args.rows:,} transactions written in {time.perf_counter() - start:.1f} s"
+        )
+        start = time.perf_counter()
+        refresh_rollups(engine, ["sales_transactions"])
+        print(f"rollups built in {time.perf_counter() - start:.1f} s\n")
+
+        rewriter = RollupRewriter(SchemaCache(engine))
+        executor = QueryExecutor(engine)
+        print(f"{'query':<60} {'base ms':>9} {'rollup ms':>10} {'speedup':>8}")
+        base_total = rewritten_total = 0.0
+        for sql_query in WORKLOAD:
+            result, base_ms = timed(executor, sql_query, args.iterations)
+            base_total += base_ms
+            rollup_query = rewriter.rewrite(sql_query)
+            label = sql_query if len(sql_query) <= 60 else sql_query[:57] + "..."
+            if rollup_query is None:
+                rewritten_total += base_ms
+                print(f"{label:<60} {base_ms:9.1f} {'-':>10} {'miss':>8}")
+                continue
+            rollup_result, rollup_ms = timed(executor, rollup_query, args.iterations)
+            rewritten_total += rollup_ms
+            same = rows_of(result) == rows_of(rollup_result)
+            print(
+                f"{label:<60} {base_ms:9.1f} {rollup_ms:10.1f} {base_ms / rollup_ms:7.0f}x"
+                + ("" if same else "  RESULTS DIFFER")
+            )
+
+        stats = rewriter.stats()
+        print(
+            f"\nhit rate {stats['hit_rate']:.0%} ({stats['rewritten']}/{stats['checked']}), "
+            f"misses {stats['reasons']}"
+        )
+        print(
+            f"workload {base_total:,.0f} ms as written, {rewritten_total:,.0f} ms "
+            f"with rewriting, {base_total / rewritten_total:.1f}x"
+        )
+    finally:
+        engine.dispose()
+        if not args.db_url:
+            os.remove(os.path.join(folder, "bench_rollups.db"))
+        os.rmdir(folder)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+"""Turn latency and write_query token cost of racing SQL candidates against the retry loop.
+
+Replays the bench_graph corpus concurrently on `graph.ainvoke`, once with
+the sequential loop (`SQL_CANDIDATES=1`) and once racing `--candidates`
+candidates from `SQL_CANDIDATE_MODELS`. In the scripted fake the default
+model writes bad SQL for the retry scenarios on its first try while the
+other candidates get it right, the way a second model or temperature often
+does. Reports p50/p95/p99 of all turns and of the retry turns, the p95 the
+race saves and the extra write_query tokens it spends.
+
+Run from `services/backend_api`:
+    python -m benchmarks.bench_sql_race --candidates 3 --llm-latency-ms 400
+"""
+
+import argparse
+import contextlib
+import io
+import os
+import tempfile
+
+from app.chat_services.agents import Agent
+from app.chat_services.chart_renderer import ChartRenderer
+from app.chat_services.graph import GraphBuilder
+from app.chat_services.llm_scheduler import LLMScheduler
+from app.config import Config
+from benchmarks.bench_graph import (
+    CORPUS,
+    build_database,
+    percentiles,
+    run_concurrent,
+    summarize,
+)
+from benchmarks.fake_llm import RETRY, ScriptedLLMs
+from sqlalchemy import create_engine
+
+
+def run_mode(engine, candidates: int, args) -> dict:
+    Config.SQL_CANDIDATES = candidates
+    scheduler = LLMScheduler()
+    scheduler.enabled = False
+    llms = ScriptedLLMs(CORPUS, args.llm_latency_ms)
+    agent = Agent(
+        engine=engine,
+        llms=llms,
+        scheduler=scheduler,
+        chart_renderer=ChartRenderer(workers=0, max_entries=0),
+    )
+    graph = GraphBuilder(agent=agent).build_graph()
+    turns = CORPUS * args.rounds
+    # nodes print progress on every turn
+    with contextlib.redirect_stdout(io.StringIO()):
+        run_concurrent(graph, CORPUS, args.concurrency)  # warm up
+        llms.structured_tokens = 0
+        records, wall_seconds = run_concurrent(graph, turns, args.concurrency)
+    summary = summarize(records, wall_seconds)
+    summary["retry_latency_ms"] = percentiles(
+        [r["seconds"] * 1000 for r in records if r["kind"] == RETRY]
+    )
+    summary["tokens_per_turn"] = llms.structured_tokens / len(turns)
+    summary["race"] = agent.sql_race.stats() if agent.sql_race else None
+    return summary
+
+
+def report(name: str, summary: dict):
+    latency, retry = summary["latency_ms"], summary["retry_latency_ms"]
+    print(
+        f"{name:<12} p50={latency['p50']:7.0f} ms  p95={latency['p95']:7.0f} ms  "
+        f"p99={latency['p99']:7.0f} ms  retry turns p95={retry['p95']:7.0f} ms  "
+        f"write_query tokens/turn={summary['tokens_per_turn']:7.0f}"
+    )
+    if summary["race"]:
+        race = summary["race"]
+        print(
+            f"{'':<12} wins {race['wins']}, all failed {race['failed']}, "
+            f"cancelled {race['cancelled']}"
+        )
+    for problem in summary["wrong_path"]:
+        print(f"  ❌ {problem}")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument(
+        "--db-path", default=os.path.join(tempfile.gettempdir(), "sql_agent_bench.db")
+    )
+    parser.add_argument("--candidates", type=int, default=3)
+    parser.add_argument("--rounds", type=int, default=5, help="corpus replays per run")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--llm-latency-ms", type=float, default=400)
+    args = parser.parse_args()
+
+    # every turn has to write its SQL, nothing may come from cache
+    Config.QUERY_CACHE_ENABLED = False
+    Config.RESULT_CACHE_ENABLED = False
+    Config.SLOW_TURN_SAMPLE_RATE = 0
+    Config.SLOW_TURN_SECONDS = float("inf")
+
+    engine = create_engine(build_database(args.db_path))
+    sequential = run_mode(engine, 1, args)
+    race = run_mode(engine, args.candidates, args)
+    engine.dispose()
+
+    print(
+        f"{len(CORPUS) * args.rounds} turns per run, fake LLM {args.llm_latency_ms:g} ms, "
+        f"concurrency {args.concurrency}\n"
+    )
+    report("sequential", sequential)
+    report(f"race x{args.candidates}", race)
+    p95, p95_race = sequential["latency_ms"]["p95"], race["latency_ms"]["p95"]
+    tokens, tokens_race = sequential["tokens_per_turn"], race["tokens_per_turn"]
+    print(
+        f"\np95 saved {p95 - p95_race:,.0f} ms ({(p95 - p95_race) / p95:.0%}), "
+        f"write_query tokens +{(tokens_race - tokens) / tokens:.0%}"
+    )
+
+
+if __name__ == "__main__":
+    main()
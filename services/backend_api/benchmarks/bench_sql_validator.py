@@ -0,0 +1,169 @@
+"""Catching bad generated SQL in process versus on the database.
+
+Runs a fixed set of broken queries through the database (what execute_query
+reports today) and through SQLValidator, and compares latency, how many of the
+mistakes each one reports per round, and whether the message names the fix.
+A set of valid queries checks the validator has no false positives.
+
+Run from `services/backend_api`:
+    python -m benchmarks.bench_sql_validator --db-url sqlite:///data.db
+"""
+
+import argparse
+import statistics
+import time
+
+from app.chat_services.query_executor import QueryExecutor
+from app.chat_services.schema_cache import SchemaCache
+from app.chat_services.sql_validator import SQLValidator
+from app.config import Config
+from sqlalchemy import create_engine
+from sqlalchemy.exc import SQLAlchemyError
+
+# (query, names the fixed query needs), every name is one mistake to report
+BAD_QUERIES = [
+    (
+        "SELECT prodct, SUM(total_price) FROM sales_transactions GROUP BY prodct",
+        ["product"],
+    ),
+    ("SELECT product, quantity FROM sales_transaction", ["sales_transactions"]),
+    (
+        "SELECT t.first_name, SUM(t.total_price) FROM sales_transactions t GROUP BY t.first_name",
+        ["sales_customers"],
+    ),
+    (
+        "SELECT customer_id, COUNT(*) FROM sales_transactions t "
+        "JOIN sales_customers c ON t.customer_id = c.customer_id GROUP BY customer_id",
+        ["t.customer_id"],
+    ),
+    (
+        "SELECT name, ingredient FROM sales_franchises f "
+        "JOIN sales_suppliers s ON f.supplier_id = s.supplierid",
+        ["f.name"],
+    ),
+    (
+        "SELECT quantty, unit_prise FROM sales_transactions WHERE paymet_method = 'visa'",
+        ["quantity", "unit_price", "payment_method"],
+    ),
+    (
+        "SELECT f.name, COUNT(*) FROM media_customer_review r "
+        "JOIN sales_franchise f ON r.franchise_id = f.franchise_id GROUP BY f.name",
+        ["media_customer_reviews", "sales_franchises"],
+    ),
+    (
+        "SELECT x.product FROM sales_transactions t WHERE t.quantity > 2",
+        ['"x"'],
+    ),
+    ("SELECT product, SUM(total_price FROM sales_transactions GROUP BY product", []),
+    (
+        "SELECT city, COUNT(*) FROM sales_customers c "
+        "JOIN sales_franchises f ON c.city = f.city GROUP BY city",
+        ["c.city"],
+    ),
+    (
+        "SELECT product FROM sales_transactions WHERE franchise_id IN "
+        "(SELECT franchise_id FROM sales_franchises WHERE cty = 'Tokyo')",
+        ["city"],
+    ),
+]
+
+GOOD_QUERIES = [
+    "SELECT product, SUM(total_price) AS revenue FROM sales_transactions GROUP BY product ORDER BY revenue DESC LIMIT 5",
+    "SELECT c.first_name, c.last_name, SUM(t.total_price) FROM sales_transactions t "
+    "JOIN sales_customers c ON t.customer_id = c.customer_id GROUP BY c.first_name, c.last_name",
+    "WITH r AS (SELECT franchise_id, COUNT(*) AS n FROM media_customer_reviews GROUP BY franchise_id) "
+    "SELECT f.name, r.n FROM r JOIN sales_franchises f ON f.franchise_id = r.franchise_id",
+    "SELECT name FROM sales_franchises f WHERE EXISTS "
+    "(SELECT 1 FROM sales_transactions t WHERE t.franchise_id = f.franchise_id AND t.quantity > 5)",
+    "SELECT s.name, s.ingredient, COUNT(f.franchise_id) FROM sales_suppliers s "
+    "LEFT JOIN sales_franchises f ON f.supplier_id = s.supplierid GROUP BY s.name, s.ingredient",
+    "SELECT payment_method, COUNT(*) FROM sales_transactions GROUP BY 1",
+    "SELECT product, SUM(total_price) FROM sales_transactions WHERE franchise_id IN "
+    "(SELECT franchise_id FROM sales_franchises WHERE city = 'Tokyo') GROUP BY product",
+    "SELECT product, SUM(total_price) / (SELECT SUM(total_price) FROM sales_transactions) AS share "
+    "FROM sales_transactions GROUP BY product",
+    "SELECT name FROM sales_franchises f WHERE NOT EXISTS "
+    "(SELECT 1 FROM sales_transactions WHERE franchise_id = f.franchise_id AND quantity > 5)",
+    "SELECT franchise_id, name, SUM(total_price) FROM sales_transactions "
+    "JOIN sales_franchises USING (franchise_id) GROUP BY franchise_id, name",
+    "SELECT city FROM sales_customers UNION SELECT city FROM sales_franchises ORDER BY city",
+    "SELECT city, COUNT(*) AS n FROM sales_customers GROUP BY city "
+    "UNION ALL SELECT city, COUNT(*) FROM sales_franchises GROUP BY city ORDER BY n DESC",
+]
+
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    value = fn(*args)
+    return value, (time.perf_counter() - start) * 1000
+
+
+def database_error(executor: QueryExecutor, sql_query: str) -> str | None:
+    try:
+        executor.run(sql_query)
+    except SQLAlchemyError as e:
+        return str(e.orig if hasattr(e, "orig") else e)
+    return None
+
+
+def reported(error: str | None, fixes: list[str]) -> int:
+    # how many of the needed names the message points to
+    if not error:
+        return 0
+    return sum(fix.strip('"') in error for fix in fixes)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--db-url", default=Config().DATABASE_URI())
+    parser.add_argument("--iterations", type=int, default=20)
+    args = parser.parse_args()
+
+    engine = create_engine(args.db_url)
+    schema_cache = SchemaCache(engine)
+    executor = QueryExecutor(engine)
+    validator = SQLValidator(schema_cache)
+
+    rows = []
+    for sql_query, fixes in BAD_QUERIES:
+        db_times, check_times = [], []
+        for _ in range(args.iterations):
+            db_error, ms = timed(database_error, executor, sql_query)
+            db_times.append(ms)
+            error, ms = timed(validator.validate, sql_query)
+            check_times.append(ms)
+        rows.append((sql_query, fixes, db_error, db_times, error, check_times))
+    engine.dispose()
+
+    print(f"{len(BAD_QUERIES)} bad queries x {args.iterations} against {args.db_url}\n")
+    print(f"{'query':<48} {'db ms':>8} {'db fixes':>9} {'val ms':>8} {'val fixes':>10}")
+    totals = {"db": 0, "validator": 0, "needed": 0, "caught": 0}
+    for sql_query, fixes, db_error, db_times, error, check_times in rows:
+        db_fixes, val_fixes = reported(db_error, fixes), reported(error, fixes)
+        totals["db"] += db_fixes
+        totals["validator"] += val_fixes
+        totals["needed"] += len(fixes)
+        totals["caught"] += error is not None
+        print(
+            f"{sql_query[:48]:<48} {statistics.median(db_times):8.3f} "
+            f"{db_fixes:>4}/{len(fixes):<4} {statistics.median(check_times):8.3f} "
+            f"{val_fixes:>5}/{len(fixes):<4}"
+        )
+
+    false_positives = [q for q in GOOD_QUERIES if validator.validate(q)]
+    print(
+        f"\nvalidator caught {totals['caught']}/{len(BAD_QUERIES)} bad queries before execution"
+    )
+    print(
+        f"fixes named per round: database {totals['db']}/{totals['needed']}, "
+        f"validator {totals['validator']}/{totals['needed']}"
+    )
+    print(
+        f"false positives on {len(GOOD_QUERIES)} valid queries: {len(false_positives)}"
+    )
+    for sql_query in false_positives:
+        print(f"  {sql_query}\n  {validator.validate(sql_query)}")
+
+
+if __name__ == "__main__":
+    main()
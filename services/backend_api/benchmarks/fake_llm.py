@@ -0,0 +1,167 @@
+"""Deterministic stand-in for LLMRegistry, for benchmarks that must not call Groq.
+
+Answers come from a script keyed by the question, and every call sleeps a
+fixed latency plus a per-token one so timings look like a remote model
+without depending on one. The bad SQL of a retry scenario is what the
+default model writes at its default temperature, other SQL candidates get
+it right the first time.
+"""
+
+import asyncio
+import re
+import threading
+import time
+from typing import NamedTuple
+
+from app.config import GROQ_MODEL
+from app.models.chat_models import ChartSpec, QueryOutput
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage
+from langchain_core.messages.utils import count_tokens_approximately
+from langchain_core.outputs import ChatGeneration, ChatResult
+from langchain_core.runnables import RunnableLambda
+
+CHIT_CHAT = "chit_chat"
+OUT_OF_POLICY = "out_of_policy"
+SQL = "sql"
+PLOT = "plot"
+RETRY = "retry"
+REVIEW = "review"
+
+QUESTION = re.compile(r"Question: (.*)")
+COLUMNS = re.compile(r"The query result has these columns: (.*)")
+COLUMN = re.compile(r"(\S+) \((\w+)\)")
+NO_ERROR = "error information if there is any: None"
+
+
+class Scenario(NamedTuple):
+    question: str
+    kind: str
+    sql: str = ""
+    bad_sql: str = ""  # written first on the retry path, rejected by the guard
+    review_search: str = ""  # keywords for retrieve_reviews on the review path
+
+
+class ScriptedChatModel(BaseChatModel):
+    latency_ms: float = 0
+    token_latency_ms: float = 0
+    answer_words: int = 60
+
+    @property
+    def _llm_type(self) -> str:
+        return "scripted"
+
+    def _reply(self, messages) -> AIMessage:
+        content = " ".join(["figure"] * self.answer_words)
+        input_tokens = count_tokens_approximately(messages)
+        return AIMessage(
+            content=content,
+            usage_metadata={
+                "input_tokens": input_tokens,
+                "output_tokens": self.answer_words,
+                "total_tokens": input_tokens + self.answer_words,
+            },
+        )
+
+    def delay(self, output_tokens: int) -> float:
+        return (self.latency_ms + self.token_latency_ms * output_tokens) / 1000
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        message = self._reply(messages)
+        time.sleep(self.delay(self.answer_words))
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        message = self._reply(messages)
+        await asyncio.sleep(self.delay(self.answer_words))
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+
+class ScriptedLLMs:
+    """Same interface as LLMRegistry, `structured` answers write_query from the script.
+
+    Chart specs for plot_agent are derived from the result columns in the prompt.
+    """
+
+    def __init__(
+        self,
+        scenarios: list[Scenario],
+        latency_ms: float = 0,
+        token_latency_ms: float = 0,
+        answer_words: int = 60,
+    ):
+        self.scenarios = {scenario.question: scenario for scenario in scenarios}
+        # approximate tokens of every structured call, what racing candidates cost
+        self.structured_calls = 0
+        self.structured_tokens = 0
+        self._lock = threading.Lock()
+        self.chat = ScriptedChatModel(
+            latency_ms=latency_ms,
+            token_latency_ms=token_latency_ms,
+            answer_words=answer_words,
+        )
+
+    def chat_model(self, model: str = "", temperature: float | None = None):
+        return self.chat
+
+    def _query_output(self, prompt, default_model: bool = True) -> QueryOutput:
+        match = QUESTION.search(prompt[-1].content)
+        scenario = self.scenarios.get(match.group(1).strip() if match else "")
+        if scenario is None or scenario.kind == CHIT_CHAT:
+            return QueryOutput(
+                generated_sql_query="",
+                need_visualise=False,
+                chit_chat=True,
+                out_of_policy=False,
+            )
+        first_attempt = NO_ERROR in prompt[-1].content and default_model
+        return QueryOutput(
+            generated_sql_query=(
+                scenario.bad_sql if scenario.bad_sql and first_attempt else scenario.sql
+            ),
+            need_visualise=scenario.kind == PLOT,
+            chit_chat=False,
+            out_of_policy=scenario.kind == OUT_OF_POLICY,
+            review_search=scenario.review_search,
+        )
+
+    def _chart_spec(self, prompt) -> ChartSpec:
+        # the first column against the first numeric one, over time when it is a date
+        columns = COLUMN.findall(COLUMNS.search(prompt[-2].content).group(1))
+        x, x_type = columns[0]
+        numeric = [name for name, dtype in columns[1:] if dtype in ("int", "float")]
+        return ChartSpec(
+            chart_type="line" if x_type in ("date", "datetime") else "bar",
+            x=x,
+            y=numeric[:1],
+            title="scripted chart",
+            insight=" ".join(["figure"] * self.chat.answer_words),
+        )
+
+    def _count(self, prompt):
+        with self._lock:
+            self.structured_calls += 1
+            self.structured_tokens += count_tokens_approximately(prompt) + 40
+
+    def structured(self, schema, model: str = "", temperature: float | None = None):
+        # a short JSON answer, the same shape of cost as a real tool call
+        delay = self.chat.delay(40)
+        default_model = model in ("", GROQ_MODEL) and temperature is None
+
+        def answer(prompt):
+            if schema is ChartSpec:
+                return self._chart_spec(prompt)
+            return self._query_output(prompt, default_model)
+
+        def invoke(prompt):
+            self._count(prompt)
+            time.sleep(delay)
+            return answer(prompt)
+
+        async def ainvoke(prompt):
+            # counted when sent, a call cancelled while waiting is still billed
+            self._count(prompt)
+            await asyncio.sleep(delay)
+            return answer(prompt)
+
+        return RunnableLambda(invoke, afunc=ainvoke)
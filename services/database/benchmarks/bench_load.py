@@ -0,0 +1,117 @@
+"""Load throughput of the csv loader on a scaled-up sales_transactions.csv.
+
+Writes `--rows` rows of sales_transactions (the cleaned file repeated with
+fresh transaction ids), then loads it:
+- the old way, `pd.read_csv` and `df.to_sql` with the default inserts
+- with `load_table`, chunked `COPY FROM STDIN`
+- as `--tables` copies staged by `load_tables` and swapped in, with 1 worker
+  then `LOAD_WORKERS`
+
+Run from `services/database` against a scratch database, the benchmark
+replaces tables named `bench_*`:
+    python -m benchmarks.bench_load --rows 2000000
+"""
+
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+import pandas as pd
+from config import db_config
+from load_data_to_db import (
+    DATA_FOLDER,
+    drop_tables,
+    load_table,
+    load_tables,
+    swap_tables,
+)
+from sqlalchemy import create_engine
+
+
+def scaled_transactions(folder: str, rows: int) -> str:
+    source = pd.read_csv(os.path.join(DATA_FOLDER, "sales_transactions.csv"))
+    path = os.path.join(folder, "bench_transactions.csv")
+    repeats = -(-rows // len(source))
+    offset = int(source["transaction_id"].max()) + 1
+    for i in range(repeats):
+        part = source.copy()
+        part["transaction_id"] += i * offset
+        part = part.head(rows - i * len(source))
+        part.to_csv(path, mode="a", index=False, header=i == 0)
+    return path
+
+
+def report(name: str, rows: int, seconds: float, baseline: float | None = None):
+    speedup = f"  {baseline / seconds:5.1f}x" if baseline else ""
+    print(f"{name:<28} {seconds:8.2f} s  {rows / seconds:12,.0f} rows/s{speedup}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--db-url", default=db_config.DATABASE_URI())
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--tables", type=int, default=4)
+    parser.add_argument(
+        "--skip-to-sql", action="store_true", help="skip the slow to_sql baseline"
+    )
+    args = parser.parse_args()
+
+    workers = db_config.LOAD_WORKERS
+    engine = create_engine(args.db_url, pool_size=max(workers, 5))
+    folder = tempfile.mkdtemp()
+    try:
+        path = scaled_transactions(folder, args.rows)
+        print(
+            f"{args.rows:,} rows, {os.path.getsize(path) / 2**20:.0f} MiB, "
+            f"chunks of {db_config.LOAD_CHUNK_ROWS:,}, {engine.dialect.name}\n"
+        )
+
+        baseline = None
+        if not args.skip_to_sql:
+            start = time.perf_counter()
+            pd.read_csv(path).to_sql(
+                "bench_transactions", engine, if_exists="replace", index=False
+            )
+            baseline = time.perf_counter() - start
+            report("read_csv + to_sql", args.rows, baseline)
+
+        drop_tables(engine, ["bench_transactions"])
+        start = time.perf_counter()
+        load_table(engine, path)
+        single = time.perf_counter() - start
+        report("load_table (COPY)", args.rows, single, baseline)
+
+        copies = []
+        for i in range(args.tables):
+            copies.append(os.path.join(folder, f"bench_transactions_{i}.csv"))
+            shutil.copyfile(path, copies[-1])
+        total_rows = args.rows * args.tables
+        timings = {}
+        for pool_size in (1, workers):
+            start = time.perf_counter()
+            swap_tables(engine, load_tables(engine, copies, pool_size))
+            timings[pool_size] = time.perf_counter() - start
+        print()
+        report(f"{args.tables} tables, 1 worker", total_rows, timings[1])
+        report(
+            f"{args.tables} tables, {workers} workers",
+            total_rows,
+            timings[workers],
+            timings[1],
+        )
+        drop_tables(
+            engine,
+            [
+                "bench_transactions",
+                *(f"bench_transactions_{i}" for i in range(args.tables)),
+            ],
+        )
+    finally:
+        shutil.rmtree(folder)
+        engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
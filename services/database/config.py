@@ -15,6 +15,26 @@ class Config:
     DB_PORT = os.getenv("DB_PORT", "5432")
     DB_NAME = os.getenv("DB_NAME", "postgres")
 
+    # bumped after every load so the backend can invalidate its schema cache
+    DATA_VERSION_TABLE = "_data_version"
+
+    # rows read from a csv and copied to the database at a time
+    LOAD_CHUNK_ROWS = int(os.getenv("LOAD_CHUNK_ROWS", "100000"))
+    # tables loaded in parallel, each worker holds one connection
+    LOAD_WORKERS = int(os.getenv("LOAD_WORKERS", "4"))
+    # what each table was loaded from, --incremental skips files that match it
+    LOAD_MANIFEST_TABLE = "_load_manifest"
+    # append-heavy tables merged on their primary key instead of swapped in
+    LOAD_UPSERT_TABLES = [
+        t.strip()
+        for t in os.getenv("LOAD_UPSERT_TABLES", "sales_transactions").split(",")
+        if t.strip()
+    ]
+    # summary tables the backend rewrites aggregate queries to, see rollups.py
+    ROLLUP_CATALOG_TABLE = "_rollups"
+    # how the review texts are indexed for search, see text_index.py
+    TEXT_INDEX_CATALOG_TABLE = "_text_index"
+
     def DATABASE_URI(self):
         return f"{self.DB_TYPE}+{self.DB_DRIVER}://{self.DB_USER}:{self.DB_PASSWORD}@{self.DB_HOST}:{self.DB_PORT}/{self.DB_NAME}"
 
@@ -1,73 +1,462 @@
 # define database connection
+import argparse
+import hashlib
+import io
 import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from itertools import chain
 
 import pandas as pd
 from config import db_config
-from sqlalchemy import create_engine, text
-from sqlalchemy.types import Integer, Text
+from rollups import refresh_rollups
+from schema_inference import (
+    KindMismatch,
+    TableProfile,
+    conform,
+    infer_types,
+    references,
+    sql_types,
+)
+from sqlalchemy import Date, DateTime, MetaData, Table, create_engine, inspect, text
+from text_index import refresh_text_index
 
 DATA_FOLDER = "./cleaned_resources"
+# new copies are loaded next to the live tables, the prefix hides them from the agent
+STAGING_PREFIX = "_staging_"
 
 
-# function to identify primary key
-def identify_primary_key(df):
-    for col in df.columns:
-        if df[col].is_unique and not df[col].isnull().any():
-            return col
-    return None
+def copy_chunk(conn, table_name, chunk):
+    """Bulk insert one chunk, COPY FROM STDIN on psycopg2 and executemany elsewhere."""
+    cursor = conn.connection.cursor()
+    if hasattr(cursor, "copy_expert"):
+        quote = conn.dialect.identifier_preparer.quote
+        columns = ", ".join(quote(col) for col in chunk.columns)
+        buffer = io.StringIO()
+        chunk.to_csv(buffer, index=False, header=False)
+        buffer.seek(0)
+        cursor.copy_expert(
+            f"COPY {quote(table_name)} ({columns}) FROM STDIN WITH (FORMAT csv)",
+            buffer,
+        )
+        return
+    # reflected, so the column types convert timestamps for drivers without them
+    target = Table(table_name, MetaData(), autoload_with=conn)
+    rows = chunk.astype(object).where(chunk.notna(), None).to_dict("records")
+    conn.execute(target.insert(), rows)
 
 
-def setup_primary_keys(engine, pk_map):
-    with engine.connect() as conn:
-        for table_name, pk_column in pk_map.items():
-            try:
-                sql = f"""
-                ALTER TABLE {table_name} 
-                ADD PRIMARY KEY ({pk_column});
-                """
-                conn.execute(text(sql))
-                conn.commit()
-                print(f"✅ Set PRIMARY KEY on {table_name}.{pk_column}")
-            except Exception as e:
-                print(f"⚠️ Could not set PK on {table_name}.{pk_column}: {e}")
+def table_name_of(file_path):
+    return os.path.splitext(os.path.basename(file_path))[0]
 
 
-def setup_foreign_keys(engine, pk_map):
-    relationships = []
+def staging_table(table_name):
+    return f"{STAGING_PREFIX}{table_name}"
+
+
+def _load_table(engine, file_path, table_name, text_columns):
+    chunks = pd.read_csv(
+        file_path,
+        chunksize=db_config.LOAD_CHUNK_ROWS,
+        dtype=dict.fromkeys(text_columns, str),
+    )
+    with engine.begin() as conn:
+        first = next(chunks)
+        # the first chunk decides the column types
+        kinds = {
+            col: kind
+            for col, kind in infer_types(first).items()
+            if col not in text_columns
+        }
+        dtypes = first.dtypes.to_dict()
+        first = conform(first, dtypes, kinds)
+        first.head(0).to_sql(table_name, conn, index=False, dtype=sql_types(kinds))
+        profile = TableProfile(first.columns)
+        rest = (conform(chunk, dtypes, kinds) for chunk in chunks)
+        for chunk in chain([first], rest):
+            profile.update(chunk)
+            copy_chunk(conn, table_name, chunk)
+    return table_name, list(first.columns), profile.primary_key(), profile.rows, kinds
+
+
+def load_table(engine, file_path, table_name=None):
+    """Create one table from a csv and stream its rows in, in a single transaction.
+
+    Returns the table name, its columns, the detected primary key columns, the
+    row count and the column kinds inferred from the first chunk. A column a
+    later chunk does not fit is loaded as text, the table is loaded again.
+    """
+    table_name = table_name or table_name_of(file_path)
+    text_columns = set()
+    while True:
+        try:
+            return _load_table(engine, file_path, table_name, text_columns)
+        except KindMismatch as e:
+            print(
+                f"⚠️ {table_name} {', '.join(e.columns)} change type after the first "
+                "chunk, loading them as text"
+            )
+            text_columns.update(e.columns)
+            # sqlite created the table outside the rolled back transaction
+            drop_tables(engine, [table_name])
+
+
+def add_primary_key(engine, table_name, pk_columns, constraint):
+    quote = engine.dialect.identifier_preparer.quote
+    columns = ", ".join(quote(col) for col in pk_columns)
+    try:
+        with engine.begin() as conn:
+            conn.execute(
+                text(
+                    f"ALTER TABLE {quote(table_name)} ADD CONSTRAINT {quote(constraint)} PRIMARY KEY ({columns})"
+                )
+            )
+        return True
+    except Exception as e:
+        print(f"⚠️ Could not set PK on {table_name} ({', '.join(pk_columns)}): {e}")
+        return False
+
+
+def stage_table(engine, file_path, with_key=True):
+    """Load a csv into the table's staging copy, keyed so the swap only renames."""
+    table_name = table_name_of(file_path)
+    staging = staging_table(table_name)
+    _, columns, pk_columns, rows, kinds = load_table(engine, file_path, staging)
+    keyed = bool(
+        with_key
+        and pk_columns
+        and add_primary_key(engine, staging, pk_columns, f"{table_name}_pkey_new")
+    )
+    return table_name, {
+        "columns": columns,
+        "pk": pk_columns,
+        "keyed": keyed,
+        "rows": rows,
+        "kinds": kinds,
+    }
+
+
+def table_keys(engine, table_names):
+    """Primary key and columns of tables already in the database."""
+    inspector = inspect(engine)
+    pk_map, columns_map = {}, {}
+    for table_name in table_names:
+        columns_map[table_name] = [c["name"] for c in inspector.get_columns(table_name)]
+        pk = inspector.get_pk_constraint(table_name)["constrained_columns"]
+        if pk:
+            pk_map[table_name] = pk
+    return pk_map, columns_map
+
+
+def column_types(engine, table_name):
+    return [str(c["type"]) for c in inspect(engine).get_columns(table_name)]
+
+
+def contained(conn, child_table, child_col, parent_table, parent_col):
+    """Whether every non-null child value is a parent key, as one anti-join."""
+    quote = conn.dialect.identifier_preparer.quote
+    child, parent = quote(child_table), quote(parent_table)
+    child_col, parent_col = quote(child_col), quote(parent_col)
+    orphan = conn.execute(
+        text(
+            f"SELECT 1 FROM {child} WHERE {child}.{child_col} IS NOT NULL AND NOT EXISTS "
+            f"(SELECT 1 FROM {parent} WHERE {parent}.{parent_col} = {child}.{child_col}) LIMIT 1"
+        )
+    ).first()
+    return orphan is None
 
-    # Scan all tables to find foreign keys
-    for file in os.listdir(DATA_FOLDER):
-        if not file.endswith(".csv"):
-            continue
 
-        child_table = os.path.splitext(file)[0]
-        df = pd.read_csv(os.path.join(DATA_FOLDER, file))
+def setup_foreign_keys(engine, pk_map, columns_map):
+    """Link columns to the single-column keys their name points at and their values fit.
 
-        # Check each column to see if it matches a primary key from another table
-        for col in df.columns:
+    Returns the (table, column) pairs that were confirmed, linked or not.
+    """
+    relationships = []
+
+    # Check each column to see if it names a primary key of another table
+    for child_table, columns in columns_map.items():
+        for col in columns:
             for parent_table, parent_pk in pk_map.items():
-                if child_table == parent_table:
-                    continue  # Skip self-reference
-
-                if col == parent_pk:
-                    relationships.append((child_table, col, parent_table, parent_pk))
-
-    # Create foreign key
-    with engine.connect() as conn:
-        for child_table, child_col, parent_table, parent_col in relationships:
-            sql = f"""
-                ALTER TABLE {child_table} 
-                ADD CONSTRAINT fk_{child_table}_{child_col} 
-                FOREIGN KEY ({child_col}) REFERENCES {parent_table} ({parent_col});
-                """
-            conn.execute(text(sql))
-            conn.commit()
+                if child_table == parent_table or len(parent_pk) != 1:
+                    continue  # Skip self-reference and composite keys
+
+                if references(col, parent_table, parent_pk[0]):
+                    relationships.append((child_table, col, parent_table, parent_pk[0]))
+
+    # Create the missing foreign keys, the ones of swapped tables went with them
+    inspector = inspect(engine)
+    joins = []
+    for child_table, child_col, parent_table, parent_col in relationships:
+        try:
+            with engine.connect() as conn:
+                if not contained(
+                    conn, child_table, child_col, parent_table, parent_col
+                ):
+                    print(
+                        f"⏭️ {child_table}.{child_col} has values missing from {parent_table}.{parent_col}"
+                    )
+                    continue
+        except Exception as e:
+            print(f"⚠️ Could not compare {child_table}.{child_col}: {e}")
+            continue
+        joins.append((child_table, child_col))
+
+        name = f"fk_{child_table}_{child_col}"
+        if name in {fk["name"] for fk in inspector.get_foreign_keys(child_table)}:
+            continue
+        sql = f"""
+            ALTER TABLE {child_table} 
+            ADD CONSTRAINT {name} 
+            FOREIGN KEY ({child_col}) REFERENCES {parent_table} ({parent_col});
+            """
+        try:
+            with engine.begin() as conn:
+                conn.execute(text(sql))
             print(f"✅ Linked {child_table}.{child_col} -> {parent_table}.{parent_col}")
+        except Exception as e:
+            print(f"⚠️ Could not link {child_table}.{child_col}: {e}")
+    return joins
 
 
-def load_data():
+def setup_indexes(engine, table_names, joins):
+    """B-tree indexes on join columns and on date and time columns, the range filters."""
+    quote = engine.dialect.identifier_preparer.quote
+    inspector = inspect(engine)
+    wanted = list(joins)
+    for table_name in table_names:
+        for col in inspector.get_columns(table_name):
+            if isinstance(col["type"], (Date, DateTime)):
+                wanted.append((table_name, col["name"]))
+
+    for table_name, col in wanted:
+        leading = {
+            index["column_names"][0] for index in inspector.get_indexes(table_name)
+        }
+        pk = inspector.get_pk_constraint(table_name)["constrained_columns"]
+        if col in leading or pk[:1] == [col]:
+            continue
+        name = f"ix_{table_name}_{col}"
+        with engine.begin() as conn:
+            conn.execute(
+                text(
+                    f"CREATE INDEX IF NOT EXISTS {quote(name)} ON {quote(table_name)} ({quote(col)})"
+                )
+            )
+        print(f"📇 Indexed {table_name}.{col}")
+
+
+def bump_data_version(engine):
+    table = db_config.DATA_VERSION_TABLE
+    with engine.begin() as conn:
+        conn.execute(
+            text(
+                f"CREATE TABLE IF NOT EXISTS {table} (id INTEGER PRIMARY KEY, version INTEGER NOT NULL)"
+            )
+        )
+        updated = conn.execute(
+            text(f"UPDATE {table} SET version = version + 1 WHERE id = 1")
+        ).rowcount
+        if not updated:
+            conn.execute(text(f"INSERT INTO {table} (id, version) VALUES (1, 1)"))
+        version = conn.execute(
+            text(f"SELECT version FROM {table} WHERE id = 1")
+        ).scalar()
+    print(f"🔖 Data version is now {version}")
+    return version
+
+
+def file_hash(file_path):
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def read_manifest(engine):
+    """What each table was last loaded from, by table name."""
+    table = db_config.LOAD_MANIFEST_TABLE
+    with engine.begin() as conn:
+        conn.execute(
+            text(
+                f"CREATE TABLE IF NOT EXISTS {table} ("
+                "table_name VARCHAR(255) PRIMARY KEY, file_name VARCHAR(255) NOT NULL, "
+                "size BIGINT NOT NULL, mtime DOUBLE PRECISION NOT NULL, "
+                "sha256 VARCHAR(64) NOT NULL, row_count BIGINT NOT NULL, "
+                "data_version INTEGER NOT NULL)"
+            )
+        )
+        rows = conn.execute(text(f"SELECT * FROM {table}")).mappings().all()
+    return {row["table_name"]: dict(row) for row in rows}
+
+
+def write_manifest(engine, entries):
+    table = db_config.LOAD_MANIFEST_TABLE
+    with engine.begin() as conn:
+        for entry in entries:
+            conn.execute(
+                text(f"DELETE FROM {table} WHERE table_name = :table_name"), entry
+            )
+            conn.execute(
+                text(
+                    f"INSERT INTO {table} VALUES (:table_name, :file_name, :size, "
+                    ":mtime, :sha256, :row_count, :data_version)"
+                ),
+                entry,
+            )
+
+
+def fingerprint(file_path, previous=None):
+    """Size, mtime and content hash of a csv, hashed only when size or mtime moved.
+
+    Returns the fingerprint and whether the content differs from `previous`.
+    """
+    stat = os.stat(file_path)
+    entry = {
+        "table_name": table_name_of(file_path),
+        "file_name": os.path.basename(file_path),
+        "size": stat.st_size,
+        "mtime": stat.st_mtime,
+    }
+    if previous and (previous["size"], previous["mtime"]) == (
+        entry["size"],
+        entry["mtime"],
+    ):
+        return {**previous, **entry}, False
+    entry["sha256"] = file_hash(file_path)
+    if previous and previous["sha256"] == entry["sha256"]:
+        # touched but not edited, keep the old load and remember the new mtime
+        return {**previous, **entry}, False
+    return entry, True
+
+
+def drop_tables(engine, table_names):
+    # up front, a parent dropped with CASCADE mid-load would wait on its children
+    cascade = " CASCADE" if engine.dialect.name == "postgresql" else ""
+    quote = engine.dialect.identifier_preparer.quote
+    with engine.begin() as conn:
+        for table_name in table_names:
+            conn.execute(text(f"DROP TABLE IF EXISTS {quote(table_name)}{cascade}"))
+
+
+def swap_tables(engine, staged):
+    """Replace tables with their staging copies in one transaction.
+
+    Readers wait on the lock for the rename instead of finding a table missing.
+    """
+    postgres = engine.dialect.name == "postgresql"
+    cascade = " CASCADE" if postgres else ""
+    quote = engine.dialect.identifier_preparer.quote
+    with engine.begin() as conn:
+        for table_name, info in staged.items():
+            conn.execute(text(f"DROP TABLE IF EXISTS {quote(table_name)}{cascade}"))
+            conn.execute(
+                text(
+                    f"ALTER TABLE {quote(staging_table(table_name))} RENAME TO {quote(table_name)}"
+                )
+            )
+            if postgres and info["keyed"]:
+                conn.execute(
+                    text(
+                        f"ALTER TABLE {quote(table_name)} RENAME CONSTRAINT "
+                        f"{quote(table_name + '_pkey_new')} TO {quote(table_name + '_pkey')}"
+                    )
+                )
+
+
+def upsert_table(engine, table_name, info):
+    """Merge the staging copy into the live table on its primary key.
+
+    Only new rows and rows whose values changed are written, rows gone from
+    the csv are kept.
+    """
+    quote = engine.dialect.identifier_preparer.quote
+    staging = staging_table(table_name)
+    target = quote(table_name)
+    columns = [quote(col) for col in info["columns"]]
+    pk_columns = [quote(col) for col in info["pk"]]
+    values = [col for col in columns if col not in pk_columns]
+    updates = ", ".join(f"{col} = EXCLUDED.{col}" for col in values)
+    current = ", ".join(f"{target}.{col}" for col in values)
+    incoming = ", ".join(f"EXCLUDED.{col}" for col in values)
+    names = ", ".join(columns)
+    with engine.begin() as conn:
+        written = conn.execute(
+            text(
+                f"INSERT INTO {target} ({names}) SELECT {names} FROM {quote(staging)} "
+                f"ON CONFLICT ({', '.join(pk_columns)}) DO UPDATE SET {updates} "
+                f"WHERE ({current}) IS DISTINCT FROM ({incoming})"
+            )
+        ).rowcount
+        conn.execute(text(f"DROP TABLE {quote(staging)}"))
+    return written
+
+
+def analyze_tables(engine, table_names):
+    quote = engine.dialect.identifier_preparer.quote
+    with engine.begin() as conn:
+        for table_name in table_names:
+            conn.execute(text(f"ANALYZE {quote(table_name)}"))
+
+
+def upsert_candidates(engine, file_paths):
+    """Tables to merge into rather than replace, they must already be keyed."""
+    if engine.dialect.name != "postgresql":
+        return set()
+    existing = set(inspect(engine).get_table_names())
+    names = [
+        table_name_of(p)
+        for p in file_paths
+        if table_name_of(p) in db_config.LOAD_UPSERT_TABLES
+        and table_name_of(p) in existing
+    ]
+    pk_map, _ = table_keys(engine, names)
+    return set(pk_map)
+
+
+def load_tables(engine, file_paths, workers, upsert=()):
+    """Load csv files into staging tables, `workers` at a time.
+
+    Tables in `upsert` are staged without a primary key, they are merged into
+    the live table instead of replacing it. Returns what was found for each
+    staged table: its columns, primary key and row count.
+    """
+    drop_tables(engine, [staging_table(table_name_of(p)) for p in file_paths])
+
+    staged = {}  # {table_name: {"columns", "pk", "keyed", "rows", "kinds"}}
+
+    # tables are independent until the keys are set, load them side by side
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {
+            pool.submit(
+                stage_table, engine, file_path, table_name_of(file_path) not in upsert
+            ): file_path
+            for file_path in file_paths
+        }
+        for future in as_completed(futures):
+            try:
+                table_name, info = future.result()
+            except Exception as e:
+                print(f"❌ Error uploading {os.path.basename(futures[future])}: {e}")
+                continue
+
+            staged[table_name] = info
+            if info["pk"]:
+                print(f"🔹 '{table_name}': Found PK '{', '.join(info['pk'])}'.")
+            else:
+                print(f"⚠️ '{table_name}': No primary key found.")
+            if info["kinds"]:
+                kinds = ", ".join(
+                    f"{col} {kind}" for col, kind in info["kinds"].items()
+                )
+                print(f"🧬 '{table_name}': Typed {kinds}.")
+            print(f"✅ Uploaded '{table_name}' ({info['rows']} rows)")
+    return staged
+
+
+def load_data(incremental=False):
     DB_URI = db_config.DATABASE_URI()
-    engine = create_engine(DB_URI)
+    workers = db_config.LOAD_WORKERS
+    engine = create_engine(DB_URI, pool_size=max(workers, 5))
 
     if not os.path.exists(DATA_FOLDER):
         print("Creating folder...")
@@ -77,50 +466,97 @@ def load_data():
     csv_files = [f for f in os.listdir(DATA_FOLDER) if f.endswith(".csv")]
     print(f"👌 Found {len(csv_files)} files.\n")
 
-    # Store primary key info for foreign key setup
-    pk_map = {}  # {table_name: pk_column_name}
+    manifest = read_manifest(engine)
+    entries, file_paths = {}, []
+    for f in csv_files:
+        file_path = os.path.join(DATA_FOLDER, f)
+        previous = manifest.get(table_name_of(f)) if incremental else None
+        entry, changed = fingerprint(file_path, previous)
+        entries[entry["table_name"]] = entry
+        if changed:
+            file_paths.append(file_path)
+        else:
+            print(f"⏭️ '{entry['table_name']}' is unchanged, skipping.")
+    if not file_paths:
+        write_manifest(engine, entries.values())
+        print("\n🎉 Nothing changed.")
+        return
 
-    for file_name in csv_files:
-        table_name = os.path.splitext(file_name)[0]
-        file_path = os.path.join(DATA_FOLDER, file_name)
+    upsert = upsert_candidates(engine, file_paths) if incremental else set()
+    staged = load_tables(engine, file_paths, workers, upsert)
 
-        try:
-            df = pd.read_csv(file_path)
-            # Find primary key
-            pk_column = identify_primary_key(df)
-            dtype_dict = {}
-
-            if pk_column:
-                if df[pk_column].dtype == "int64":
-                    dtype_dict[pk_column] = Integer()
-                else:
-                    dtype_dict[pk_column] = Text()
-
-                pk_map[table_name] = pk_column
-                print(f"🔹 '{table_name}': Found PK column '{pk_column}'.")
-            else:
-                print(f"⚠️ '{table_name}': No primary key found.")
-
-            df.to_sql(
-                table_name,
-                engine,
-                if_exists="replace",
-                index=False,
-                dtype=dtype_dict,
+    live_pk, live_columns = table_keys(engine, [n for n in staged if n in upsert])
+    for table_name in live_columns:
+        info = staged[table_name]
+        live = (live_columns[table_name], live_pk[table_name])
+        if live != (info["columns"], info["pk"]) or column_types(
+            engine, table_name
+        ) != column_types(engine, staging_table(table_name)):
+            print(f"⚠️ '{table_name}' changed shape, replacing it instead.")
+            upsert.discard(table_name)
+            info["keyed"] = (
+                add_primary_key(
+                    engine,
+                    staging_table(table_name),
+                    info["pk"],
+                    f"{table_name}_pkey_new",
+                )
+                if info["pk"]
+                else False
             )
-            print(f"✅ Uploaded '{table_name}' ({len(df)} rows)")
-
-        except Exception as e:
-            print(f"❌ Error uploading {file_name}: {e}")
+            continue
+        written = upsert_table(engine, table_name, info)
+        print(f"🔁 Upserted {written} new or changed rows into '{table_name}'")
 
-    print("\n🔑 Setting up Primary Keys...")
-    setup_primary_keys(engine, pk_map)
+    swapped = {name: info for name, info in staged.items() if name not in upsert}
+    print("\n🔀 Swapping in reloaded tables...")
+    swap_tables(engine, swapped)
 
     print("\n🔗 Setting up Foreign Keys...")
-    setup_foreign_keys(engine, pk_map)
+    # swapped tables lost their links, rebuild them against every loaded table
+    loaded = [name for name in entries if inspect(engine).has_table(name)]
+    pk_map, columns_map = table_keys(engine, loaded)
+    for table_name, info in staged.items():
+        columns_map[table_name] = info["columns"]
+        if info["pk"]:
+            pk_map[table_name] = info["pk"]
+    joins = setup_foreign_keys(engine, pk_map, columns_map)
+
+    print("\n📇 Setting up Indexes...")
+    setup_indexes(engine, loaded, joins)
+
+    print("\n📊 Analyzing reloaded tables...")
+    analyze_tables(engine, list(staged))
+
+    print("\n🧮 Refreshing rollups...")
+    analyze_tables(engine, refresh_rollups(engine, staged))
+
+    print("\n🔎 Indexing review texts...")
+    analyze_tables(engine, refresh_text_index(engine, staged))
+
+    print("\n🔖 Bumping data version...")
+    version = bump_data_version(engine)
+    for table_name, info in staged.items():
+        entries[table_name].update(row_count=info["rows"], data_version=version)
+    # a file that failed keeps its old entry, so the next run tries it again
+    failed = {table_name_of(p) for p in file_paths} - set(staged)
+    write_manifest(
+        engine,
+        [
+            manifest[name] if name in failed else entry
+            for name, entry in entries.items()
+            if name not in failed or name in manifest
+        ],
+    )
 
     print("\n🎉 All operations completed.")
 
 
 if __name__ == "__main__":
-    load_data()
+    parser = argparse.ArgumentParser(description="Load the cleaned csv files.")
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="skip unchanged files and upsert LOAD_UPSERT_TABLES",
+    )
+    load_data(parser.parse_args().incremental)
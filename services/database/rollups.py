@@ -0,0 +1,272 @@
+import json
+
+from config import db_config
+from sqlalchemy import inspect, text
+
+# summary tables of sales_transactions for the common aggregate questions, the
+# backend sends eligible queries to the smallest one that can answer them.
+# dimensions and measures map "table.column" to the rollup column, "days" are
+# timestamps kept as their date. Each measure gets _sum, _count, _min and _max.
+MEASURES = {
+    "sales_transactions.quantity": "quantity",
+    "sales_transactions.total_price": "revenue",
+}
+FRANCHISE = {
+    "sales_transactions.franchise_id": "franchise_id",
+    "sales_franchises.name": "franchise_name",
+    "sales_franchises.city": "franchise_city",
+    "sales_franchises.country": "franchise_country",
+    "sales_franchises.size": "franchise_size",
+}
+PRODUCT = {
+    "sales_transactions.product": "product",
+    "sales_transactions.payment_method": "payment_method",
+}
+DAY = {"sales_transactions.date_time": "day"}
+ROLLUPS = {
+    "_rollup_sales_day": {
+        "base": "sales_transactions",
+        "joins": {},
+        "days": DAY,
+        "dimensions": PRODUCT,
+        "measures": MEASURES,
+        "count": "transactions",
+    },
+    "_rollup_sales_franchise": {
+        "base": "sales_transactions",
+        "joins": {"sales_franchises": "franchise_id"},
+        "days": {},
+        "dimensions": {**FRANCHISE, **PRODUCT},
+        "measures": MEASURES,
+        "count": "transactions",
+    },
+    "_rollup_sales_franchise_day": {
+        "base": "sales_transactions",
+        "joins": {"sales_franchises": "franchise_id"},
+        "days": DAY,
+        "dimensions": FRANCHISE,
+        "measures": MEASURES,
+        "count": "transactions",
+    },
+    "_rollup_sales_customer": {
+        "base": "sales_transactions",
+        "joins": {"sales_customers": "customer_id"},
+        "days": {},
+        "dimensions": {
+            "sales_transactions.customer_id": "customer_id",
+            **PRODUCT,
+            "sales_customers.city": "customer_city",
+            "sales_customers.state": "customer_state",
+            "sales_customers.country": "customer_country",
+            "sales_customers.continent": "customer_continent",
+            "sales_customers.gender": "customer_gender",
+        },
+        "measures": MEASURES,
+        "count": "transactions",
+    },
+}
+MEASURE_AGGREGATES = ("sum", "count", "min", "max")
+
+
+def _missing_columns(inspector, definition):
+    columns = {}
+    wanted = [*definition["days"], *definition["dimensions"], *definition["measures"]]
+    wanted += [f"{definition['base']}.{key}" for key in definition["joins"].values()]
+    wanted += [f"{table}.{key}" for table, key in definition["joins"].items()]
+    missing = []
+    for name in wanted:
+        table, col = name.split(".")
+        if table not in columns:
+            has_table = inspector.has_table(table)
+            columns[table] = (
+                {c["name"] for c in inspector.get_columns(table)}
+                if has_table
+                else set()
+            )
+        if col not in columns[table]:
+            missing.append(name)
+    return missing
+
+
+def _day(engine, column):
+    # CAST(... AS DATE) on sqlite is numeric affinity, it keeps only the year
+    if engine.dialect.name == "sqlite":
+        return f"DATE({column})"
+    return f"CAST({column} AS DATE)"
+
+
+def rollup_select(engine, definition):
+    """The GROUP BY that fills a rollup, dimension tables are LEFT JOINed."""
+    quote = engine.dialect.identifier_preparer.quote
+    aliases = {definition["base"]: "t"}
+    for i, table in enumerate(definition["joins"]):
+        aliases[table] = f"j{i}"
+
+    def ref(name):
+        table, col = name.split(".")
+        return f"{aliases[table]}.{quote(col)}"
+
+    groups = [_day(engine, ref(name)) for name in definition["days"]]
+    groups += [ref(name) for name in definition["dimensions"]]
+    selects = [
+        f"{group} AS {quote(col)}"
+        for group, col in zip(
+            groups, [*definition["days"].values(), *definition["dimensions"].values()]
+        )
+    ]
+    selects.append(f"COUNT(*) AS {quote(definition['count'])}")
+    for name, col in definition["measures"].items():
+        for agg in MEASURE_AGGREGATES:
+            selects.append(f"{agg.upper()}({ref(name)}) AS {quote(f'{col}_{agg}')}")
+    joins = " ".join(
+        f"LEFT JOIN {quote(table)} {aliases[table]} "
+        f"ON {aliases[table]}.{quote(key)} = t.{quote(key)}"
+        for table, key in definition["joins"].items()
+    )
+    return (
+        f"SELECT {', '.join(selects)} FROM {quote(definition['base'])} t {joins} "
+        f"GROUP BY {', '.join(groups)}"
+    )
+
+
+def join_checks(conn, definition):
+    """Whether each joined table's key is unique and every base key finds a row.
+
+    A duplicated key would count transactions twice. Orphan keys are fine for
+    the LEFT JOIN but the rollup cannot answer an INNER JOIN that drops them.
+    """
+    quote = conn.dialect.identifier_preparer.quote
+    base = quote(definition["base"])
+    unique, complete = True, {}
+    for table, key in definition["joins"].items():
+        dim, col = quote(table), quote(key)
+        duplicated = conn.execute(
+            text(f"SELECT 1 FROM {dim} GROUP BY {col} HAVING COUNT(*) > 1 LIMIT 1")
+        ).first()
+        unique = unique and duplicated is None
+        orphan = conn.execute(
+            text(
+                f"SELECT 1 FROM {base} t WHERE t.{col} IS NOT NULL AND NOT EXISTS "
+                f"(SELECT 1 FROM {dim} d WHERE d.{col} = t.{col}) LIMIT 1"
+            )
+        ).first()
+        complete[table] = orphan is None
+    return unique, complete
+
+
+def not_null(conn, table):
+    """Columns without nulls right now, COUNT of one of them is COUNT(*)."""
+    quote = conn.dialect.identifier_preparer.quote
+    columns = [c["name"] for c in inspect(conn).get_columns(table)]
+    counts = ", ".join(f"COUNT({quote(col)})" for col in columns)
+    row = conn.execute(text(f"SELECT COUNT(*), {counts} FROM {quote(table)}")).one()
+    return [col for col, count in zip(columns, row[1:]) if count == row[0]]
+
+
+def _timezone(conn):
+    # DATE() of a timestamptz depends on the session time zone
+    if conn.dialect.name == "postgresql":
+        return conn.execute(text("SELECT current_setting('TimeZone')")).scalar()
+    return None
+
+
+def write_catalog(engine, entries):
+    table = db_config.ROLLUP_CATALOG_TABLE
+    with engine.begin() as conn:
+        conn.execute(
+            text(
+                f"CREATE TABLE IF NOT EXISTS {table} "
+                "(name TEXT PRIMARY KEY, definition TEXT NOT NULL)"
+            )
+        )
+        for name, definition in entries.items():
+            conn.execute(
+                text(f"DELETE FROM {table} WHERE name = :name"), {"name": name}
+            )
+            if definition is not None:
+                conn.execute(
+                    text(
+                        f"INSERT INTO {table} (name, definition) VALUES (:name, :definition)"
+                    ),
+                    {"name": name, "definition": json.dumps(definition)},
+                )
+
+
+def build_rollup(engine, name, definition):
+    """Rebuild one rollup next to the live one and swap it in.
+
+    Returns its catalog entry, or None when the tables cannot support it.
+    """
+    quote = engine.dialect.identifier_preparer.quote
+    missing = _missing_columns(inspect(engine), definition)
+    if missing:
+        print(f"⚠️ Skipping rollup '{name}', missing {', '.join(missing)}")
+        return None
+    staging = quote(f"_staging_{name}")
+    with engine.begin() as conn:
+        unique, complete = join_checks(conn, definition)
+        if not unique:
+            print(f"⚠️ Skipping rollup '{name}', a joined key is not unique")
+            return None
+        conn.execute(text(f"DROP TABLE IF EXISTS {staging}"))
+        conn.execute(
+            text(f"CREATE TABLE {staging} AS {rollup_select(engine, definition)}")
+        )
+        rows = conn.execute(text(f"SELECT COUNT(*) FROM {staging}")).scalar()
+        conn.execute(text(f"DROP TABLE IF EXISTS {quote(name)}"))
+        conn.execute(text(f"ALTER TABLE {staging} RENAME TO {quote(name)}"))
+        entry = {
+            **definition,
+            "complete": complete,
+            "not_null": not_null(conn, definition["base"]),
+            "rows": rows,
+            "timezone": _timezone(conn),
+        }
+    print(f"🧮 Built rollup '{name}' ({rows} rows)")
+    return entry
+
+
+def read_catalog(engine):
+    table = db_config.ROLLUP_CATALOG_TABLE
+    if not inspect(engine).has_table(table):
+        return {}
+    with engine.connect() as conn:
+        rows = conn.execute(text(f"SELECT name, definition FROM {table}")).fetchall()
+    return {name: json.loads(definition) for name, definition in rows}
+
+
+def _drop(engine, name):
+    with engine.begin() as conn:
+        conn.execute(
+            text(
+                f"DROP TABLE IF EXISTS {engine.dialect.identifier_preparer.quote(name)}"
+            )
+        )
+
+
+def refresh_rollups(engine, changed):
+    """Rebuild the rollups reading any of the `changed` tables, new or redefined ones.
+
+    Rollups no longer in ROLLUPS are dropped. Returns the names of the rebuilt
+    rollups.
+    """
+    existing = set(inspect(engine).get_table_names())
+    catalog = read_catalog(engine)
+    entries = {}
+    for name, definition in ROLLUPS.items():
+        built = catalog.get(name, {})
+        current = name in existing and all(
+            built.get(key) == value for key, value in definition.items()
+        )
+        tables = {definition["base"], *definition["joins"]}
+        if current and not tables & set(changed):
+            continue
+        entries[name] = build_rollup(engine, name, definition)
+        if entries[name] is None:
+            # stale, and nothing may be rewritten to it any more
+            _drop(engine, name)
+    for name in catalog.keys() - ROLLUPS.keys():
+        _drop(engine, name)
+        entries[name] = None
+    write_catalog(engine, entries)
+    return [name for name, entry in entries.items() if entry is not None]
@@ -0,0 +1,210 @@
+import re
+from itertools import combinations
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import Boolean, DateTime, Numeric
+
+BOOLEANS = {"true": True, "false": False, "t": True, "f": False}
+BOOLEANS.update({"yes": True, "no": False, "y": True, "n": False})
+# decimals a float column may have and still be stored as exact NUMERIC
+NUMERIC_MAX_SCALE = 4
+# null-free columns tried pairwise when no single column is a key
+COMPOSITE_KEY_COLUMNS = 8
+
+
+def _text(values):
+    return values.astype(str).str.strip()
+
+
+def _is_boolean(values):
+    return _text(values).str.lower().isin(BOOLEANS).all()
+
+
+def _is_numeric(values):
+    return pd.to_numeric(_text(values), errors="coerce").notna().all()
+
+
+def _is_timestamp(values):
+    parsed = pd.to_datetime(_text(values), errors="coerce", utc=True, format="ISO8601")
+    return parsed.notna().all()
+
+
+def _scale_fits(values, scale):
+    scaled = values.to_numpy(dtype="float64") * 10**scale
+    return bool(np.all(np.abs(scaled - np.round(scaled)) < 1e-6))
+
+
+def _parses(check, values):
+    # most text columns fail on their first rows, skip parsing the rest
+    return check(values.head(100)) and check(values)
+
+
+def infer_types(sample):
+    """Column kinds the sample supports beyond what read_csv parsed.
+
+    Every non-null value of a column must parse for it to get a kind, the
+    kinds are "boolean", "integer", "numeric" and "timestamp".
+    """
+    kinds = {}
+    for col in sample.columns:
+        values = sample[col].dropna()
+        if values.empty:
+            continue
+        if pd.api.types.is_string_dtype(values.dtype):
+            if _parses(_is_boolean, values):
+                kinds[col] = "boolean"
+            elif _parses(_is_numeric, values):
+                kinds[col] = "numeric"
+            elif _parses(_is_timestamp, values):
+                kinds[col] = "timestamp"
+        elif pd.api.types.is_float_dtype(values):
+            # integers read as floats because of their nulls, a csv with 3.0 means money
+            if len(values) < len(sample) and _scale_fits(values, 0):
+                kinds[col] = "integer"
+            elif _scale_fits(values, NUMERIC_MAX_SCALE):
+                kinds[col] = "numeric"
+    return kinds
+
+
+def sql_types(kinds):
+    """Column types for `to_sql`, the rest keep the pandas defaults."""
+    types = {
+        "boolean": Boolean(),
+        "numeric": Numeric(),
+        "timestamp": DateTime(timezone=True),
+    }
+    return {col: types[kind] for col, kind in kinds.items() if kind in types}
+
+
+class KindMismatch(ValueError):
+    """A later chunk has values the types inferred from the first one cannot hold."""
+
+    def __init__(self, errors):
+        super().__init__("; ".join(f"{col}: {error}" for col, error in errors.items()))
+        self.columns = list(errors)
+
+
+def conform(chunk, dtypes, kinds):
+    """Convert a chunk to the inferred kinds and the first chunk's dtypes.
+
+    Integer columns stay integer when a later chunk has nulls in them. A value
+    that does not fit raises `KindMismatch` naming every such column.
+    """
+    errors = {}
+    for col, kind in kinds.items():
+        values = chunk[col]
+        try:
+            if kind == "boolean":
+                parsed = _text(values).str.lower().map(BOOLEANS)
+                if (parsed.isna() & values.notna()).any():
+                    raise ValueError("values that are not booleans")
+                chunk[col] = parsed.astype("boolean")
+            elif kind == "integer":
+                chunk[col] = values.astype("Int64")
+            elif kind == "numeric" and pd.api.types.is_string_dtype(values.dtype):
+                chunk[col] = pd.to_numeric(values)
+            elif kind == "timestamp":
+                chunk[col] = pd.to_datetime(values, utc=True, format="ISO8601")
+        except (ValueError, TypeError) as e:
+            errors[col] = e
+    for col, dtype in dtypes.items():
+        if col in kinds or chunk[col].dtype == dtype:
+            continue
+        # read_csv guesses each chunk's dtypes on its own
+        try:
+            if pd.api.types.is_integer_dtype(dtype):
+                chunk[col] = chunk[col].astype("Int64")
+            elif pd.api.types.is_bool_dtype(dtype):
+                chunk[col] = chunk[col].astype("boolean")
+            elif pd.api.types.is_float_dtype(dtype):
+                chunk[col] = pd.to_numeric(chunk[col])
+        except (ValueError, TypeError) as e:
+            errors[col] = e
+    if errors:
+        raise KindMismatch(errors)
+    return chunk
+
+
+def _hashes(values):
+    values = values.dropna()
+    if pd.api.types.is_float_dtype(values) and _scale_fits(values, 0):
+        values = values.astype("int64")  # 3.0 and 3 are the same key
+    return pd.util.hash_pandas_object(values, index=False).to_numpy()
+
+
+class TableProfile:
+    """Finds the primary key of a csv read in chunks without keeping its values.
+
+    Only key candidates keep 64 bit hashes of their values: a column keeps
+    its sorted distinct hashes while it has no null and no duplicate, and the
+    `COMPOSITE_KEY_COLUMNS` most distinct null-free columns of the first
+    chunk keep one hash per row to be tried as pairs. A column is dropped as
+    soon as it shows a null, or a duplicate for a single column key.
+    """
+
+    def __init__(self, columns):
+        self.columns = list(columns)
+        self.rows = 0
+        self.nulls = dict.fromkeys(self.columns, 0)
+        self.unique = {col: np.empty(0, dtype=np.uint64) for col in self.columns}
+        self.paired = {col: [] for col in self.columns}
+
+    def update(self, chunk):
+        hashes = {}
+        for col in self.columns:
+            self.nulls[col] += int(chunk[col].isna().sum())
+            if not self.nulls[col] and (col in self.unique or col in self.paired):
+                hashes[col] = _hashes(chunk[col])
+        if not self.rows:
+            # the most distinct columns are the likeliest to pair up
+            ranked = sorted(
+                hashes, key=lambda col: len(np.unique(hashes[col])), reverse=True
+            )
+            self.paired = {col: [] for col in ranked[:COMPOSITE_KEY_COLUMNS]}
+        self.rows += len(chunk)
+
+        for col in list(self.unique):
+            seen = (
+                np.unique(np.concatenate([self.unique[col], hashes[col]]))
+                if col in hashes
+                else []
+            )
+            if len(seen) == self.rows:
+                self.unique[col] = seen
+            else:
+                del self.unique[col]
+        for col in list(self.paired):
+            if col in hashes:
+                self.paired[col].append(hashes[col])
+            else:
+                del self.paired[col]
+
+    def null_rate(self, col):
+        return self.nulls[col] / self.rows if self.rows else 0.0
+
+    def primary_key(self):
+        """The first unique column in csv order, else the first unique pair."""
+        for col in self.columns:
+            if col in self.unique:
+                return [col]
+        values = {col: np.concatenate(parts) for col, parts in self.paired.items()}
+        for first, second in combinations(values, 2):
+            pair = values[first] * np.uint64(0x9E3779B97F4A7C15) ^ values[second]
+            if len(np.unique(pair)) == self.rows:
+                return [first, second]
+        return []
+
+
+def name_stem(name):
+    return re.sub(r"[^a-z0-9]", "", name.lower())
+
+
+def references(column_name, parent_table, parent_pk):
+    """Whether a column's name points at a parent key.
+
+    `supplier_id` points at both `sales_suppliers.supplierid` and
+    `suppliers.id`. Names only pick the candidates, values confirm them.
+    """
+    entity = name_stem(parent_table.split("_")[-1]).removesuffix("s")
+    return name_stem(column_name) in {name_stem(parent_pk), entity + "id"}
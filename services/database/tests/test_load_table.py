@@ -0,0 +1,81 @@
+import pandas as pd
+import pytest
+from config import db_config
+from load_data_to_db import load_table
+from schema_inference import KindMismatch, conform, infer_types
+from sqlalchemy import create_engine, inspect, text
+
+
+@pytest.fixture
+def engine(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'load.db'}")
+    yield engine
+    engine.dispose()
+
+
+def write_csv(tmp_path, rows):
+    path = tmp_path / "orders.csv"
+    pd.DataFrame(rows).to_csv(path, index=False)
+    return str(path)
+
+
+def test_conform_names_the_column_a_later_chunk_does_not_fit():
+    first = pd.DataFrame({"paid": ["yes", "no"], "amount": ["1.5", "2"]})
+    kinds = infer_types(first)
+    assert kinds == {"paid": "boolean", "amount": "numeric"}
+
+    later = pd.DataFrame({"paid": ["yes", "maybe"], "amount": ["3", "4"]})
+    with pytest.raises(KindMismatch) as error:
+        conform(later, first.dtypes.to_dict(), kinds)
+    assert error.value.columns == ["paid"]
+
+
+def test_type_change_after_the_first_chunk_loads_the_column_as_text(
+    tmp_path, engine, monkeypatch
+):
+    monkeypatch.setattr(db_config, "LOAD_CHUNK_ROWS", 3)
+    rows = [
+        {
+            "order_id": i,
+            "quantity": i,
+            "amount": f"{i}.5",
+            "paid": "yes" if i % 2 else "no",
+            "ordered_at": f"2024-01-0{i + 1}T10:00:00",
+        }
+        for i in range(6)
+    ]
+    # every typed column turns to text in the second chunk
+    rows[4].update(
+        quantity="many", amount="unknown", paid="maybe", ordered_at="next week"
+    )
+    path = write_csv(tmp_path, rows)
+
+    table_name, _, pk, row_count, kinds = load_table(engine, path)
+
+    assert table_name == "orders"
+    assert row_count == 6
+    assert pk == ["order_id"]
+    assert kinds == {}
+    types = {c["name"]: str(c["type"]) for c in inspect(engine).get_columns("orders")}
+    assert types["order_id"] == "BIGINT"
+    assert types["quantity"] == types["paid"] == "TEXT"
+    with engine.connect() as conn:
+        loaded = conn.execute(
+            text(
+                "SELECT quantity, amount, paid, ordered_at FROM orders ORDER BY order_id"
+            )
+        ).fetchall()
+    assert loaded[1] == ("1", "1.5", "yes", "2024-01-02T10:00:00")
+    assert loaded[4] == ("many", "unknown", "maybe", "next week")
+
+
+def test_columns_that_keep_their_type_stay_typed(tmp_path, engine, monkeypatch):
+    monkeypatch.setattr(db_config, "LOAD_CHUNK_ROWS", 2)
+    rows = [{"order_id": i, "amount": f"{i}.25", "paid": "yes"} for i in range(5)]
+    rows[3]["amount"] = None
+    path = write_csv(tmp_path, rows)
+
+    _, _, _, row_count, kinds = load_table(engine, path)
+
+    assert row_count == 5
+    assert kinds == {"amount": "numeric", "paid": "boolean"}
@@ -0,0 +1,218 @@
+import json
+import math
+import re
+from collections import Counter
+
+import pandas as pd
+from config import db_config
+from sqlalchemy import inspect, text
+
+# free-text columns the backend searches instead of scanning them with ILIKE
+TEXT_SOURCES = {
+    "media_customer_reviews": {
+        "text": "review",
+        "franchise": "franchise_id",
+        "date": "review_date",
+    },
+    "media_gold_reviews_chunked": {
+        "text": "chunked_text",
+        "franchise": "franchise_id",
+        "date": "review_date",
+    },
+}
+# postgres text search configuration, the backend queries with the same one
+TEXT_SEARCH_CONFIG = "english"
+BM25_DOCS_TABLE = "_text_docs"
+BM25_TERMS_TABLE = "_text_terms"
+BM25_POSTINGS_TABLE = "_text_postings"
+STOPWORDS = set(
+    """
+    a an and are as at be but by for from had has have he her his i if in is it its
+    me my not of on or our she so that the their them they this to too was we were
+    what when which who will with you your
+    """.split()
+)
+DOCS_PER_BATCH = 1000
+
+
+def terms(body):
+    """Lower case words without stopwords, plurals cut to their stem.
+
+    The backend splits questions the same way, see `TextRetriever`.
+    """
+    words = re.findall(r"[a-z0-9]+", body.lower())
+    return [
+        w[:-1] if len(w) > 3 and w.endswith("s") else w
+        for w in words
+        if w not in STOPWORDS
+    ]
+
+
+def _sources(engine):
+    inspector = inspect(engine)
+    sources = {}
+    for table_name, source in TEXT_SOURCES.items():
+        if not inspector.has_table(table_name):
+            continue
+        columns = {c["name"] for c in inspector.get_columns(table_name)}
+        missing = [col for col in source.values() if col not in columns]
+        if missing:
+            print(f"⚠️ Not indexing '{table_name}', missing {', '.join(missing)}")
+            continue
+        sources[table_name] = source
+    return sources
+
+
+def gin_indexes(engine, sources):
+    """Expression GIN indexes, matched by queries on the same to_tsvector call."""
+    quote = engine.dialect.identifier_preparer.quote
+    for table_name, source in sources.items():
+        name = f"ix_{table_name}_{source['text']}_fts"
+        with engine.begin() as conn:
+            conn.execute(
+                text(
+                    f"CREATE INDEX IF NOT EXISTS {quote(name)} ON {quote(table_name)} "
+                    f"USING GIN (to_tsvector('{TEXT_SEARCH_CONFIG}', {quote(source['text'])}))"
+                )
+            )
+        print(f"🔎 Indexed {table_name}.{source['text']} for full-text search")
+
+
+def bm25_index(engine, sources):
+    """A BM25 inverted index in three tables, one corpus across every source.
+
+    `_text_docs` keeps each text with its franchise and length, `_text_postings`
+    the term frequencies per document and `_text_terms` the idf of each term.
+    Returns the document count and average length for the catalog.
+    """
+    quote = engine.dialect.identifier_preparer.quote
+    df, docs, total_length = Counter(), 0, 0
+    with engine.begin() as conn:
+        for table in (BM25_DOCS_TABLE, BM25_TERMS_TABLE, BM25_POSTINGS_TABLE):
+            conn.execute(text(f"DROP TABLE IF EXISTS {table}"))
+        conn.execute(
+            text(
+                f"CREATE TABLE {BM25_DOCS_TABLE} (doc_id INTEGER PRIMARY KEY, "
+                "source TEXT NOT NULL, franchise_id BIGINT, review_date TEXT, "
+                "body TEXT NOT NULL, length INTEGER NOT NULL)"
+            )
+        )
+        conn.execute(
+            text(
+                f"CREATE TABLE {BM25_POSTINGS_TABLE} "
+                "(term TEXT NOT NULL, doc_id INTEGER NOT NULL, tf INTEGER NOT NULL)"
+            )
+        )
+        for table_name, source in sources.items():
+            columns = ", ".join(
+                f"{quote(source[key])} AS {key}"
+                for key in ("text", "franchise", "date")
+            )
+            query = f"SELECT {columns} FROM {quote(table_name)} WHERE {quote(source['text'])} IS NOT NULL"
+            for batch in pd.read_sql(text(query), conn, chunksize=DOCS_PER_BATCH):
+                doc_rows, postings = [], []
+                for row in batch.itertuples(index=False):
+                    counts = Counter(terms(row.text))
+                    docs += 1
+                    total_length += sum(counts.values())
+                    df.update(counts.keys())
+                    doc_rows.append(
+                        {
+                            "doc_id": docs,
+                            "source": table_name,
+                            "franchise_id": None
+                            if pd.isna(row.franchise)
+                            else int(row.franchise),
+                            "review_date": None if pd.isna(row.date) else str(row.date),
+                            "body": row.text,
+                            "length": sum(counts.values()),
+                        }
+                    )
+                    postings += [
+                        {"term": term, "doc_id": docs, "tf": tf}
+                        for term, tf in counts.items()
+                    ]
+                conn.execute(
+                    text(
+                        f"INSERT INTO {BM25_DOCS_TABLE} VALUES (:doc_id, :source, "
+                        ":franchise_id, :review_date, :body, :length)"
+                    ),
+                    doc_rows,
+                )
+                if postings:
+                    conn.execute(
+                        text(
+                            f"INSERT INTO {BM25_POSTINGS_TABLE} VALUES (:term, :doc_id, :tf)"
+                        ),
+                        postings,
+                    )
+        conn.execute(
+            text(
+                f"CREATE TABLE {BM25_TERMS_TABLE} (term TEXT PRIMARY KEY, df INTEGER NOT NULL, idf FLOAT NOT NULL)"
+            )
+        )
+        if df:
+            conn.execute(
+                text(f"INSERT INTO {BM25_TERMS_TABLE} VALUES (:term, :df, :idf)"),
+                [
+                    # the BM25 idf that stays positive for terms in most documents
+                    {
+                        "term": term,
+                        "df": n,
+                        "idf": math.log(1 + (docs - n + 0.5) / (n + 0.5)),
+                    }
+                    for term, n in df.items()
+                ],
+            )
+        conn.execute(
+            text(
+                f"CREATE INDEX ix_{BM25_POSTINGS_TABLE}_term ON {BM25_POSTINGS_TABLE} (term)"
+            )
+        )
+    print(f"🔎 Indexed {docs} texts, {len(df)} terms for BM25 search")
+    return docs, total_length / docs if docs else 0.0
+
+
+def write_catalog(engine, entries):
+    table = db_config.TEXT_INDEX_CATALOG_TABLE
+    with engine.begin() as conn:
+        conn.execute(text(f"DROP TABLE IF EXISTS {table}"))
+        conn.execute(
+            text(
+                f"CREATE TABLE {table} (name TEXT PRIMARY KEY, definition TEXT NOT NULL)"
+            )
+        )
+        for name, definition in entries.items():
+            conn.execute(
+                text(
+                    f"INSERT INTO {table} (name, definition) VALUES (:name, :definition)"
+                ),
+                {"name": name, "definition": json.dumps(definition)},
+            )
+
+
+def refresh_text_index(engine, changed):
+    """Index the review texts, on postgres with GIN, elsewhere as BM25 tables.
+
+    A swapped table lost its GIN index so those are recreated every load, the
+    BM25 tables are rebuilt when a source changed. Returns the tables to analyze.
+    """
+    sources = _sources(engine)
+    if engine.dialect.name == "postgresql":
+        gin_indexes(engine, sources)
+        stats = {"method": "tsvector", "config": TEXT_SEARCH_CONFIG}
+        analyze = list(sources)
+    else:
+        inspector = inspect(engine)
+        built = inspector.has_table(BM25_TERMS_TABLE) and inspector.has_table(
+            db_config.TEXT_INDEX_CATALOG_TABLE
+        )
+        if built and not set(sources) & set(changed):
+            return []
+        docs, avg_length = bm25_index(engine, sources)
+        stats = {"method": "bm25", "docs": docs, "avg_length": avg_length}
+        analyze = [BM25_DOCS_TABLE, BM25_TERMS_TABLE, BM25_POSTINGS_TABLE]
+    write_catalog(
+        engine, {name: {**source, **stats} for name, source in sources.items()}
+    )
+    return analyze